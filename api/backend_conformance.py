@@ -0,0 +1,224 @@
+"""
+推理后端一致性检查
+
+每个InferenceBackend实现都必须通过同一组检查：批量回答按问题顺序拆分、
+批量（含同一图片多个问题）与逐个生成一致、结果确定、停止条件传入生成过程、流式片段拼接等于完整回答且只结束一次、
+生成异常时也会结束流等；支持多页打包的后端，其多图回答须能按分节标记拆回各页。
+
+用法:
+    cd api
+    python backend_conformance.py --backend stub
+    python backend_conformance.py --backend hf --model-path /path/to/internvl3-8b
+    python backend_conformance.py --backend onnx --model-path /path/to/internvl3-8b
+"""
+
+import sys
+import argparse
+import traceback
+from typing import Callable, List, Tuple
+
+import torch
+from PIL import Image, ImageDraw
+from transformers import LogitsProcessorList, StoppingCriteriaList
+
+from image_preprocess import load_image
+from inference_backend import BACKENDS, InferenceBackend, create_backend
+from page_packing import build_packed_question, split_packed_answer
+from repetition_stopping import STOP_EOS, STOP_MAX_NEW_TOKENS, GenerationStoppingCriteria, RepetitionSettings
+from token_confidence import TokenConfidence
+
+GENERATION_CONFIG = dict(max_new_tokens=32, do_sample=False)
+QUESTIONS = ["<image>\n请识别图片中的文字。", "<image>\n请提取图片中的表格数据。", "<image>\n图中的编号是多少？"]
+
+
+def _sample_pages() -> List[torch.Tensor]:
+    """尺寸不同的样例页面，产生不同的分块数"""
+    pages = []
+    for index, size in enumerate([(448, 448), (1240, 1754), (1754, 1240)]):
+        image = Image.new("RGB", size, "white")
+        draw = ImageDraw.Draw(image)
+        draw.text((40, 40), f"DWG-{index:04d} PUMP P-10{index}", fill="black")
+        pages.append(load_image(image, max_num=6))
+    return pages
+
+
+class _Collector:
+    """记录流式回调"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.ends = 0
+
+    def __call__(self, text: str, stream_end: bool):
+        if self.ends:
+            raise AssertionError("流结束后仍有回调")
+        self.chunks.append(text)
+        if stream_end:
+            self.ends += 1
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+
+def _generate_one(backend: InferenceBackend, pixel_values: torch.Tensor, question: str) -> str:
+    responses = backend.generate(backend.prepare_inputs(pixel_values), [question],
+                                 [pixel_values.shape[0]], GENERATION_CONFIG)
+    assert isinstance(responses, list) and len(responses) == 1, f"单个请求应返回1个回答: {responses!r}"
+    assert isinstance(responses[0], str), f"回答应为字符串: {responses[0]!r}"
+    return responses[0]
+
+
+def check_describe(backend, pages):
+    info = backend.describe()
+    assert info.get("name") == backend.name and "device" in info, f"describe缺少name/device: {info}"
+
+
+def check_prepare_inputs(backend, pages):
+    inputs = backend.prepare_inputs(pages[1])
+    assert inputs.shape[0] == pages[1].shape[0], "prepare_inputs不应改变分块数"
+
+
+def check_generate_single(backend, pages):
+    _generate_one(backend, pages[0], QUESTIONS[0])
+
+
+def check_batch_order(backend, pages):
+    """批量回答按问题顺序返回，且与逐个生成一致"""
+    batch = backend.generate(
+        backend.prepare_inputs(torch.cat(pages, dim=0)), QUESTIONS,
+        [p.shape[0] for p in pages], GENERATION_CONFIG)
+    assert len(batch) == len(QUESTIONS), f"应返回{len(QUESTIONS)}个回答，实际{len(batch)}个"
+    single = [_generate_one(backend, page, question) for page, question in zip(pages, QUESTIONS)]
+    assert batch == single, f"批量与逐个生成不一致:\n{batch}\n{single}"
+
+
+def check_deterministic(backend, pages):
+    first = _generate_one(backend, pages[1], QUESTIONS[1])
+    second = _generate_one(backend, pages[1], QUESTIONS[1])
+    assert first == second, f"贪心解码结果不确定:\n{first}\n{second}"
+
+
+def check_multi_prompt(backend, pages):
+    """同一张图片的多个问题与逐个生成一致"""
+    responses = backend.generate_multi_prompt(backend.prepare_inputs(pages[1]), QUESTIONS, GENERATION_CONFIG)
+    single = [_generate_one(backend, pages[1], question) for question in QUESTIONS]
+    assert responses == single, f"多提示词生成与逐个生成不一致:\n{responses}\n{single}"
+
+
+def check_stopping_criteria(backend, pages):
+    """stopping_criteria传给生成过程：不触发时回答不变，记录的token可解码回原回答"""
+    settings = RepetitionSettings(min_span=GENERATION_CONFIG["max_new_tokens"] + 1)
+    criteria = GenerationStoppingCriteria(settings, 2, GENERATION_CONFIG["max_new_tokens"], backend.stop_token_ids())
+    responses = backend.generate(
+        backend.prepare_inputs(torch.cat(pages[:2], dim=0)), QUESTIONS[:2], [p.shape[0] for p in pages[:2]],
+        dict(GENERATION_CONFIG, stopping_criteria=StoppingCriteriaList([criteria])))
+    single = [_generate_one(backend, page, question) for page, question in zip(pages, QUESTIONS[:2])]
+    assert responses == single, f"带停止条件的回答与不带时不一致:\n{responses}\n{single}"
+    for row, response in enumerate(responses):
+        final, info = criteria.finalize(row, response, backend.decode_tokens)
+        assert final == response and info.generated_tokens > 0, f"停止条件未收到生成的token: {info}"
+        assert info.stop_reason in (STOP_EOS, STOP_MAX_NEW_TOKENS), f"意外的停止原因: {info}"
+        assert backend.decode_tokens(criteria.tokens(row)).strip() == response.strip(), \
+            "decode_tokens与回答不一致"
+
+
+def check_token_confidence(backend, pages):
+    """logits_processor传给生成过程：回答不变，每行都得到0~1之间的置信度"""
+    confidence = TokenConfidence(2)
+    criteria = GenerationStoppingCriteria(None, 2, GENERATION_CONFIG["max_new_tokens"], backend.stop_token_ids(),
+                                          confidence=confidence)
+    responses = backend.generate(
+        backend.prepare_inputs(torch.cat(pages[:2], dim=0)), QUESTIONS[:2], [p.shape[0] for p in pages[:2]],
+        dict(GENERATION_CONFIG, stopping_criteria=StoppingCriteriaList([criteria]),
+             logits_processor=LogitsProcessorList([confidence])))
+    single = [_generate_one(backend, page, question) for page, question in zip(pages, QUESTIONS[:2])]
+    assert responses == single, f"带logits_processor的回答与不带时不一致:\n{responses}\n{single}"
+    for row, response in enumerate(responses):
+        _, info = criteria.finalize(row, response, backend.decode_tokens)
+        assert info.confidence is not None and 0.0 < info.confidence <= 1.0, f"置信度无效: {info}"
+
+
+def check_packed(backend, pages):
+    """多图打包的回答按分节标记拆回每一页（不支持打包的后端跳过）"""
+    if not backend.supports_packing:
+        return
+    question = build_packed_question("请识别图片中的文字。", len(pages))
+    response = backend.generate_packed(
+        backend.prepare_inputs(torch.cat(pages, dim=0)), question, [p.shape[0] for p in pages],
+        dict(GENERATION_CONFIG, max_new_tokens=GENERATION_CONFIG["max_new_tokens"] * len(pages) * 2))
+    answers = split_packed_answer(response, len(pages))
+    assert all(answer is not None for answer in answers), f"打包回答无法拆回各页: {response!r}"
+
+
+def check_stream(backend, pages):
+    """流式片段拼接等于返回的完整回答与generate的结果，且只结束一次"""
+    collector = _Collector()
+    response = backend.stream(backend.prepare_inputs(pages[2]), QUESTIONS[2], GENERATION_CONFIG, collector)
+    assert collector.ends == 1, f"流应恰好结束一次，实际{collector.ends}次"
+    assert collector.text.strip() == response.strip(), f"流式片段与回答不一致:\n{collector.text}\n{response}"
+    assert response == _generate_one(backend, pages[2], QUESTIONS[2]), "流式回答与generate不一致"
+
+
+def check_stream_error_ends(backend, pages):
+    """生成异常时流也要结束，避免消费端一直等待"""
+    collector = _Collector()
+    try:
+        # 分辨率不符合视觉编码器输入的分块
+        backend.stream(backend.prepare_inputs(torch.zeros(1, 3, 7, 7)), QUESTIONS[0], GENERATION_CONFIG, collector)
+    except Exception:
+        pass
+    else:
+        raise AssertionError("无效输入应抛出异常")
+    assert collector.ends == 1, f"异常时流应恰好结束一次，实际{collector.ends}次"
+
+
+CHECKS: List[Tuple[str, Callable]] = [
+    ("describe", check_describe),
+    ("prepare_inputs", check_prepare_inputs),
+    ("generate_single", check_generate_single),
+    ("batch_order", check_batch_order),
+    ("deterministic", check_deterministic),
+    ("multi_prompt", check_multi_prompt),
+    ("stopping_criteria", check_stopping_criteria),
+    ("token_confidence", check_token_confidence),
+    ("packed", check_packed),
+    ("stream", check_stream),
+    ("stream_error_ends", check_stream_error_ends),
+]
+
+
+def run_conformance_suite(backend: InferenceBackend, verbose: bool = True) -> List[Tuple[str, bool, str]]:
+    """对已加载的后端运行全部检查，返回 [(检查名, 是否通过, 失败信息)]"""
+    pages = _sample_pages()
+    results = []
+    for name, check in CHECKS:
+        try:
+            check(backend, pages)
+            results.append((name, True, ""))
+        except Exception as e:
+            detail = str(e) if isinstance(e, AssertionError) else traceback.format_exc(limit=3)
+            results.append((name, False, detail))
+        if verbose:
+            passed, detail = results[-1][1:]
+            print(f"{'✅' if passed else '❌'} {backend.name}.{name}" + (f"\n   {detail}" if detail else ""))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理后端一致性检查")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="stub")
+    parser.add_argument("--model-path", default="")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    backend = create_backend(args.backend, args.model_path, args.device, {"IMAGE_SIZE": 448})
+    backend.load()
+    results = run_conformance_suite(backend)
+    failed = [name for name, passed, _ in results if not passed]
+    print(f"{len(results) - len(failed)}/{len(results)} 项通过")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
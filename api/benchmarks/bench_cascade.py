@@ -0,0 +1,104 @@
+"""
+模型级联路由基准
+
+在混合的工程文档页面（打字文本页、封面、图纸、表格、密集规格表）上对比三种优先级：
+quality（全部交给主模型，即原有行为）/ auto（按页面特征路由，小模型置信度低时升级）/
+speed（全部交给小模型）。报告各模型处理的页数、升级率、每页延迟与总耗时。
+
+未指定模型路径时使用两个stub后端：小模型单次生成更快，回答置信度按分块数给出
+（分块少的页面置信度低，用于触发升级），主模型更慢。
+
+用法:
+    cd api
+    python benchmarks/bench_cascade.py
+    python benchmarks/bench_cascade.py --small-model-path /path/to/internvl3-2b --model-path /path/to/internvl3-8b
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw
+
+import intervl_service as service
+from bench_tile_budget import A4_150DPI, CORPUS
+from model_router import PRIORITIES, page_features
+
+
+def memo_page() -> Image.Image:
+    page = Image.new("RGB", A4_150DPI, "white")
+    draw = ImageDraw.Draw(page)
+    for line in range(24):
+        draw.text((120, 200 + line * 36), f"Item {line + 1}: replace the seal kit on pump P-{101 + line % 4} "
+                                           f"during the next scheduled shutdown.", fill="black")
+    return page
+
+
+def build_registry(args) -> service.ModelRegistry:
+    if args.model_path:
+        small = service.InterVLModelManager(args.small_name, args.small_model_path)
+        large = service.InterVLModelManager(service.CONFIG["MODEL_NAME"], args.model_path)
+    else:
+        small = service.InterVLModelManager("stub-small", None, "stub", {
+            "STUB_BASE_LATENCY_MS": args.small_latency * 1000,
+            "STUB_CONFIDENCE_PER_PATCH": args.small_confidence_per_patch,
+        })
+        large = service.InterVLModelManager("stub-large", None, "stub", {
+            "STUB_BASE_LATENCY_MS": args.large_latency * 1000,
+        })
+    registry = service.ModelRegistry(large, [small])
+    registry.load_all()
+    return registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型级联路由基准")
+    parser.add_argument("--model-path", default="", help="主模型路径，指定时同时需要 --small-model-path")
+    parser.add_argument("--small-model-path", default="")
+    parser.add_argument("--small-name", default="internvl3-2b")
+    parser.add_argument("--small-latency", type=float, default=0.05, help="stub小模型单次生成耗时（秒）")
+    parser.add_argument("--large-latency", type=float, default=0.3, help="stub主模型单次生成耗时（秒）")
+    parser.add_argument("--small-confidence-per-patch", type=float, default=0.12,
+                        help="stub小模型每个分块增加的token概率")
+    parser.add_argument("--repeat", type=int, default=4, help="语料重复次数")
+    args = parser.parse_args()
+    if args.model_path and not args.small_model_path:
+        parser.error("--model-path 需要同时指定 --small-model-path")
+
+    corpus = [("memo", memo_page())] + [(name, build()) for name, build in CORPUS.items()]
+    for name, image in corpus:
+        features = page_features(image)
+        print(f"{name:<11} 边缘占比={features['edge_ratio']:.4f} "
+              f"表格线={features['horizontal_lines']}x{features['vertical_lines']}")
+
+    totals = {}
+    for priority in PRIORITIES:
+        registry = build_registry(args)
+        print(f"--- {priority} ---")
+        started = time.perf_counter()
+        for round_index in range(args.repeat):
+            for name, image in corpus:
+                result = registry.process_image(image, priority=priority)
+                if round_index == 0:
+                    routing = result["metadata"].get("routing", {})
+                    escalated = "".join(f" <- {item['model']}" for item in routing.get("escalated_from", []))
+                    print(f"{name:<11} 路由={routing.get('reason', '-'):<12} 模型={result['metadata']['model']}"
+                          f"{escalated} 置信度={result['confidence']}")
+        elapsed = time.perf_counter() - started
+        totals[priority] = elapsed
+        pages = args.repeat * len(corpus)
+        for name, metrics in registry.get_metrics()["models"].items():
+            print(f"  {name:<14} 加载={metrics['load_time']}s 页数={metrics['pages']:<3} "
+                  f"升级率={metrics['escalation_rate']:6.1%} 每页延迟={metrics['latency']['mean']}s")
+        print(f"  总耗时={elapsed:7.2f}s 吞吐={pages / elapsed:6.2f} 页/秒")
+
+    print("--- 汇总（相对quality） ---")
+    for priority, elapsed in totals.items():
+        print(f"{priority:<8} 总耗时={elapsed:7.2f}s 加速比={totals['quality'] / elapsed:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+CPU推理模式基准
+
+在随机初始化的微型InternVL结构（小型视觉编码器 + mlp1投影 + 小型Llama语言模型）上
+对比float32基线与 bf16 autocast / 动态int8量化 / torch.compile 组合的贪心解码速度，
+并报告相对float32的精度漂移：末位logits的最大绝对误差、余弦相似度，
+以及生成token与基线一致的比例。
+
+用法:
+    cd api
+    python benchmarks/bench_cpu_inference.py
+    python benchmarks/bench_cpu_inference.py --threads 8 --compile --new-tokens 64
+"""
+
+import sys
+import copy
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from cpu_inference import CpuSettings, bf16_supported, configure_threads, optimize_cpu_model
+
+
+class TinyVisionModel(torch.nn.Module):
+    """patch embedding + 若干Transformer编码层"""
+
+    def __init__(self, hidden_size: int, layers: int, patch_size: int = 28):
+        super().__init__()
+        self.patch_embed = torch.nn.Conv2d(3, hidden_size, kernel_size=patch_size, stride=patch_size)
+        layer = torch.nn.TransformerEncoderLayer(hidden_size, nhead=4, dim_feedforward=hidden_size * 4,
+                                                 batch_first=True)
+        self.encoder = torch.nn.TransformerEncoder(layer, num_layers=layers)
+
+    def forward(self, pixel_values):
+        return self.encoder(self.patch_embed(pixel_values).flatten(2).transpose(1, 2))
+
+
+class TinyInternVL(torch.nn.Module):
+    """与InternVL相同的组成部分（vision_model / mlp1 / language_model），便于复用CPU优化"""
+
+    def __init__(self, hidden_size: int = 256, layers: int = 4, vocab_size: int = 4096):
+        super().__init__()
+        self.vision_model = TinyVisionModel(hidden_size, 2)
+        self.mlp1 = torch.nn.Sequential(torch.nn.Linear(hidden_size, hidden_size), torch.nn.GELU(),
+                                        torch.nn.Linear(hidden_size, hidden_size))
+        self.language_model = LlamaForCausalLM(LlamaConfig(
+            vocab_size=vocab_size, hidden_size=hidden_size, intermediate_size=hidden_size * 4,
+            num_hidden_layers=layers, num_attention_heads=4, num_key_value_heads=4,
+            max_position_embeddings=2048))
+
+    def embed(self, pixel_values, input_ids):
+        image_embeds = self.mlp1(self.vision_model(pixel_values)).float()
+        text_embeds = self.language_model.get_input_embeddings()(input_ids)
+        return torch.cat([image_embeds, text_embeds], dim=1)
+
+    @torch.no_grad()
+    def generate(self, pixel_values, input_ids, max_new_tokens):
+        # 禁用eos，使各变体生成相同数量的token
+        return self.language_model.generate(
+            inputs_embeds=self.embed(pixel_values, input_ids), max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens, do_sample=False, eos_token_id=None, pad_token_id=0)
+
+    @torch.no_grad()
+    def last_logits(self, pixel_values, input_ids):
+        return self.language_model(inputs_embeds=self.embed(pixel_values, input_ids)).logits[:, -1].float()
+
+
+def measure(model, pixel_values, input_ids, new_tokens: int, repeats: int):
+    model.generate(pixel_values, input_ids, 2)  # 预热（torch.compile在此编译）
+    started = time.perf_counter()
+    for _ in range(repeats):
+        tokens = model.generate(pixel_values, input_ids, new_tokens)
+    elapsed = time.perf_counter() - started
+    return tokens, new_tokens * input_ids.shape[0] * repeats / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU推理模式基准")
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--prompt-tokens", type=int, default=64)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op线程数，0表示torch默认值")
+    parser.add_argument("--interop-threads", type=int, default=0)
+    parser.add_argument("--compile", action="store_true", help="额外测试torch.compile变体")
+    args = parser.parse_args()
+
+    print(f"线程数: {configure_threads(args.threads, args.interop_threads)}，CPU原生bf16: {bf16_supported()}")
+    torch.manual_seed(0)
+    baseline = TinyInternVL(args.hidden_size, args.layers).eval()
+    pixel_values = torch.randn(args.batch_size, 3, 448, 448)
+    input_ids = torch.randint(1, 4096, (args.batch_size, args.prompt_tokens))
+
+    variants = {
+        "fp32": CpuSettings(bf16="off"),
+        "bf16": CpuSettings(bf16="on"),
+        "int8": CpuSettings(bf16="off", int8_dynamic=True),
+        "bf16+int8": CpuSettings(bf16="on", int8_dynamic=True),
+    }
+    if args.compile:
+        variants.update({name + "+compile": settings._replace(compile=True)
+                         for name, settings in list(variants.items())})
+
+    base_tokens = base_logits = base_speed = None
+    for name, settings in variants.items():
+        model = copy.deepcopy(baseline)
+        optimize_cpu_model(model, settings)
+        tokens, speed = measure(model, pixel_values, input_ids, args.new_tokens, args.repeats)
+        logits = model.last_logits(pixel_values, input_ids)
+        if base_tokens is None:
+            base_tokens, base_logits, base_speed = tokens, logits, speed
+        max_error = (logits - base_logits).abs().max().item()
+        cosine = torch.nn.functional.cosine_similarity(logits, base_logits, dim=-1).mean().item()
+        agreement = (tokens == base_tokens).float().mean().item()
+        print(f"{name:<18} {speed:8.1f} tokens/s  加速={speed / base_speed:5.2f}x  "
+              f"logits最大误差={max_error:8.4f}  余弦={cosine:.5f}  token一致率={agreement:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+版面预分割基准
+
+在带标注的合成工程文档页面（标题、双栏正文、表格、插图、标题栏）上对比整页识别
+（process_image）与版面预分割后只识别区域（process_layout）：
+
+- 版面分析：区域检出的召回率/精确率（IoU >= 0.5且类别一致）、阅读顺序是否正确、分析耗时
+- 端到端：每页耗时与送入模型的分块数；指定 --model-path 时还统计准确率
+  （页面上标注的文字有多少出现在识别结果中）
+
+未指定 --model-path 时使用stub后端（只模拟推理固定开销），准确率不统计。
+
+用法:
+    cd api
+    python benchmarks/bench_layout.py
+    python benchmarks/bench_layout.py --model-path /path/to/internvl3-8b --pages 6
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw
+
+import intervl_service as service
+from inference_backend import StubBackend
+from layout_segment import LABEL_FIGURE, LABEL_TABLE, LABEL_TEXT, LayoutSettings, segment_layout
+
+A4_150DPI = (1240, 1754)
+
+
+def synthetic_page(index: int):
+    """
+    生成一页带标注的页面
+
+    Returns:
+        (图片, [(类别, 相对坐标bbox), ...] 按阅读顺序, 页面上的文字)
+    """
+    width, height = A4_150DPI
+    page = Image.new("RGB", A4_150DPI, "white")
+    draw = ImageDraw.Draw(page)
+    regions, texts = [], []
+
+    def add(label, box):
+        regions.append((label, (box[0] / width, box[1] / height, box[2] / width, box[3] / height)))
+
+    # 标题
+    title = f"PUMP STATION P-{index:03d} DESIGN MANUAL"
+    draw.text((420, 80), title, fill="black")
+    texts.append(title)
+    add(LABEL_TEXT, (420, 78, 420 + draw.textlength(title), 94))
+
+    # 双栏正文
+    for column, x in enumerate((80, 660)):
+        for line in range(14):
+            text = f"{column + 1}.{line:02d} Flange DN{50 + line} PN16 bolt M{12 + line % 6}"
+            draw.text((x, 180 + line * 18), text, fill="black")
+            texts.append(text)
+        add(LABEL_TEXT, (x, 178, x + 420, 180 + 13 * 18 + 14))
+
+    # 表格
+    top = 520
+    for row in range(9):
+        draw.line([(80, top + row * 36), (1160, top + row * 36)], fill="black", width=2)
+    for col in range(6):
+        draw.line([(80 + col * 216, top), (80 + col * 216, top + 8 * 36)], fill="black", width=2)
+    for row in range(8):
+        for col in range(5):
+            text = f"R{row}C{col}-{index * 40 + row * 5 + col}"
+            draw.text((92 + col * 216, top + 12 + row * 36), text, fill="black")
+            texts.append(text)
+    add(LABEL_TABLE, (80, top, 1160, top + 8 * 36))
+
+    # 插图
+    for i in range(4):
+        draw.ellipse([200 + i * 220, 940, 340 + i * 220, 1080], outline="black", width=3)
+        draw.line([(270 + i * 220, 1080), (270 + i * 220, 1260)], fill="black", width=3)
+    draw.line([(200, 1260), (1000, 1260)], fill="black", width=3)
+    add(LABEL_FIGURE, (200, 940, 1000, 1262))
+
+    # 说明文字
+    note = f"NOTE: ALL DIMENSIONS IN MM, REV {chr(65 + index % 26)}"
+    draw.text((80, 1360), note, fill="black")
+    texts.append(note)
+    add(LABEL_TEXT, (80, 1358, 80 + draw.textlength(note), 1374))
+
+    # 标题栏
+    for row in range(4):
+        draw.line([(700, 1520 + row * 40), (1160, 1520 + row * 40)], fill="black", width=2)
+    for col in range(3):
+        draw.line([(700 + col * 230, 1520), (700 + col * 230, 1640)], fill="black", width=2)
+    for row, (key, value) in enumerate([("DWG", f"D-{index:04d}"), ("SCALE", "1:50"), ("DATE", "2024-05")]):
+        draw.text((712, 1532 + row * 40), key, fill="black")
+        draw.text((942, 1532 + row * 40), value, fill="black")
+        texts.extend([key, value])
+    add(LABEL_TABLE, (700, 1520, 1160, 1640))
+    return page, regions, texts
+
+
+def iou(a, b) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+def match_regions(truth, detected):
+    """按IoU >= 0.5且类别一致匹配，返回各标注区域匹配到的检出区域下标（未匹配为None）"""
+    used, matches = set(), []
+    for label, box in truth:
+        best, best_iou = None, 0.5
+        for index, region in enumerate(detected):
+            if index in used or region.label != label:
+                continue
+            overlap = iou(box, region.bbox)
+            if overlap >= best_iou:
+                best, best_iou = index, overlap
+        if best is not None:
+            used.add(best)
+        matches.append(best)
+    return matches
+
+
+def text_recall(texts, output: str) -> float:
+    normalized = " ".join(output.split())
+    return sum(1 for text in texts if " ".join(text.split()) in normalized) / len(texts)
+
+
+def build_manager(model_path: str, base_latency: float, per_sample_latency: float) -> service.InterVLModelManager:
+    if model_path:
+        service.CONFIG["MODEL_PATH"] = model_path
+        manager = service.InterVLModelManager()
+        manager.load_model()
+        return manager
+
+    manager = service.InterVLModelManager()
+    manager.backend = StubBackend(options={
+        "STUB_BASE_LATENCY_MS": base_latency * 1000,
+        "STUB_PER_SAMPLE_LATENCY_MS": per_sample_latency * 1000,
+        "IMAGE_SIZE": service.CONFIG["IMAGE_SIZE"],
+    })
+    manager.backend.load()
+    manager.is_loaded = True
+    return manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description="整页识别 vs 版面预分割后按区域识别")
+    parser.add_argument("--model-path", default="", help="不指定时使用stub后端，不统计准确率")
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--base-latency", type=float, default=0.2, help="stub后端单次生成固定耗时（秒）")
+    parser.add_argument("--per-sample-latency", type=float, default=0.02, help="stub后端按样本增量耗时（秒）")
+    args = parser.parse_args()
+
+    pages = [synthetic_page(i) for i in range(args.pages)]
+    settings = LayoutSettings(analysis_size=service.CONFIG["LAYOUT_ANALYSIS_SIZE"])
+
+    # 版面分析本身
+    found = detected_total = truth_total = ordered = 0
+    layout_time = 0.0
+    for image, truth, _ in pages:
+        started = time.perf_counter()
+        detected = segment_layout(image, settings, service.CONFIG["ROI_MAX_REGIONS"])
+        layout_time += time.perf_counter() - started
+        matches = match_regions(truth, detected)
+        hits = [m for m in matches if m is not None]
+        found += len(hits)
+        truth_total += len(truth)
+        detected_total += len(detected)
+        ordered += hits == sorted(hits)
+    print(f"版面分析: 召回率={found / truth_total:6.1%} 精确率={found / max(detected_total, 1):6.1%} "
+          f"阅读顺序正确={ordered}/{len(pages)} 每页耗时={layout_time / len(pages) * 1000:7.1f}ms")
+
+    manager = build_manager(args.model_path, args.base_latency, args.per_sample_latency)
+    print(f"后端: {manager.backend.name}  页面数: {len(pages)}")
+    variants = [
+        ("full-page", lambda image: manager.process_image(image)),
+        ("layout", lambda image: manager.process_layout(image)),
+    ]
+    baseline = None
+    for name, run in variants:
+        patches = recall = 0.0
+        started = time.perf_counter()
+        for image, _, texts in pages:
+            result = run(image)
+            patches += result["metadata"]["image_patches"]
+            recall += text_recall(texts, result["raw_text"])
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        accuracy = f"{recall / len(pages):6.1%}" if args.model_path else "   n/a"
+        print(f"{name:<10} 耗时={elapsed:7.2f}s 每页={elapsed / len(pages):6.2f}s 加速比={baseline / elapsed:5.2f}x "
+              f"分块数={int(patches):<4} 文字召回率={accuracy}")
+
+
+if __name__ == "__main__":
+    main()
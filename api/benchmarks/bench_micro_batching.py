@@ -0,0 +1,109 @@
+"""
+动态微批处理基准测试
+
+使用stub推理后端（模拟固定开销 + 按样本增量的推理耗时）驱动真实的
+InterVLModelManager与InferenceScheduler，对比不同批大小下的吞吐量，
+并校验每个调用方只拿到自己的回答。
+
+用法:
+    cd api
+    python benchmarks/bench_micro_batching.py --requests 64 --concurrency 16
+"""
+
+import sys
+import time
+import argparse
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image
+
+import intervl_service as service
+from inference_backend import StubBackend
+from inference_scheduler import InferenceScheduler
+
+
+def build_manager(base_latency: float = 0.2, per_sample_latency: float = 0.02) -> service.InterVLModelManager:
+    """由stub后端（固定开销 + 按样本增量的耗时）驱动的模型管理器"""
+    manager = service.InterVLModelManager()
+    manager.backend = StubBackend(options={
+        "STUB_BASE_LATENCY_MS": base_latency * 1000,
+        "STUB_PER_SAMPLE_LATENCY_MS": per_sample_latency * 1000,
+        "IMAGE_SIZE": service.CONFIG["IMAGE_SIZE"],
+    })
+    manager.backend.load()
+    manager.is_loaded = True
+    return manager
+
+
+def run(max_batch_size: int, total_requests: int, concurrency: int, window_ms: float) -> dict:
+    manager = build_manager()
+    scheduler = InferenceScheduler(
+        max_queue_size=total_requests,
+        batch_handler=manager.process_batch,
+        max_batch_size=max_batch_size,
+        batch_window_ms=window_ms
+    )
+    scheduler.start()
+
+    # 不同尺寸的图片产生不同的分块数，用于检验num_patches_list的拆分
+    sizes = [(800, 600), (1240, 1754), (2480, 1754), (448, 448)]
+    requests = [
+        manager.prepare_request(Image.new("RGB", sizes[i % len(sizes)], "white"), f"请求-{i}")
+        for i in range(total_requests)
+    ]
+    errors = []
+    semaphore = threading.Semaphore(concurrency)
+
+    def client(i: int):
+        with semaphore:
+            result = scheduler.submit_batch_item(requests[i], batch_key=requests[i].batch_key).result()
+        text = result["raw_text"]
+        expected = f"<image>\n请求-{i}|patches={requests[i].num_patches}"
+        if text != expected:
+            errors.append((i, text))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(total_requests)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    metrics = scheduler.get_metrics()
+    scheduler.stop()
+
+    return {
+        "max_batch_size": max_batch_size,
+        "elapsed": elapsed,
+        "throughput": total_requests / elapsed,
+        "errors": errors,
+        "metrics": metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="动态微批处理基准测试（桩模型）")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--window-ms", type=float, default=30.0)
+    parser.add_argument("--batch-sizes", type=str, default="1,4,8")
+    args = parser.parse_args()
+
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+        report = run(batch_size, args.requests, args.concurrency, args.window_ms)
+        metrics = report["metrics"]
+        print(f"max_batch_size={batch_size:<3} 耗时={report['elapsed']:.2f}s "
+              f"吞吐={report['throughput']:.1f} req/s "
+              f"平均批大小={metrics['avg_batch_size']} "
+              f"排队p50/p95={metrics['queue_wait']['p50']:.3f}/{metrics['queue_wait']['p95']:.3f}s "
+              f"批大小分布={metrics['batch_size_histogram']}")
+        if report["errors"]:
+            print(f"  ❌ {len(report['errors'])} 个请求拿到了错误的回答: {report['errors'][:3]}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+多提示词单次分析基准测试
+
+对同一批页面，对比按提示词类型逐个调用（相当于对同一文件多次调用 /ocr/process）
+与 /ocr/analyze 的单次多提示词生成：总耗时、每页耗时与视觉编码器执行的分块数。
+
+逐个调用分别在视觉特征缓存关闭与开启时测量；指定 --model-path 时使用真实模型，
+否则使用stub后端（只模拟推理固定开销，没有视觉编码器）。
+
+用法:
+    cd api
+    python benchmarks/bench_multi_prompt.py --pages 4
+    python benchmarks/bench_multi_prompt.py --model-path /path/to/internvl3-8b --pages 4
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw
+
+import intervl_service as service
+from config import Config
+from inference_backend import StubBackend
+from vision_cache import VisionFeatureCache
+
+PROMPT_TYPES = list(Config.ENGINEERING_PROMPTS)
+
+
+def synthetic_pages(count: int):
+    """带表格与参数文字的合成页面"""
+    pages = []
+    for i in range(count):
+        page = Image.new("RGB", (1240, 1754), "white")
+        draw = ImageDraw.Draw(page)
+        draw.text((80, 60), f"DWG-{i:04d} 离心泵技术规格", fill="black")
+        for row in range(12):
+            y = 120 + row * 40
+            draw.rectangle((80, y, 1160, y + 40), outline="black")
+            draw.text((100, y + 12), f"P-{i:02d}{row:02d}  流量 {row * 12.5} m3/h  扬程 {30 + row} m", fill="black")
+        pages.append(page)
+    return pages
+
+
+def build_manager(model_path: str, base_latency: float, per_sample_latency: float) -> service.InterVLModelManager:
+    if model_path:
+        service.CONFIG["MODEL_PATH"] = model_path
+        manager = service.InterVLModelManager()
+        manager.load_model()
+        return manager
+
+    manager = service.InterVLModelManager()
+    manager.backend = StubBackend(options={
+        "STUB_BASE_LATENCY_MS": base_latency * 1000,
+        "STUB_PER_SAMPLE_LATENCY_MS": per_sample_latency * 1000,
+        "IMAGE_SIZE": service.CONFIG["IMAGE_SIZE"],
+    })
+    manager.backend.load()
+    manager.is_loaded = True
+    return manager
+
+
+def count_vision_tiles(manager) -> dict:
+    """统计实际送入视觉编码器的分块数（包装在缓存内侧，缓存命中的分块不计入）"""
+    counter = {"tiles": 0}
+    model = manager.model
+    if model is None or not hasattr(model, "extract_feature"):
+        return counter
+    extract_feature = model.extract_feature
+
+    def counted(pixel_values):
+        counter["tiles"] += pixel_values.shape[0]
+        return extract_feature(pixel_values)
+
+    model.extract_feature = counted
+    return counter
+
+
+def use_feature_cache(manager, max_bytes: int):
+    manager.feature_cache = VisionFeatureCache(max_bytes, manager.model_version)
+    if manager.model is not None and hasattr(manager.model, "extract_feature"):
+        manager.feature_cache.install(manager.model)
+
+
+def run_separate(manager, pages) -> float:
+    started = time.perf_counter()
+    for page in pages:
+        for prompt_type in PROMPT_TYPES:
+            manager.process_image(page, Config.get_prompt(prompt_type))
+    return time.perf_counter() - started
+
+
+def run_single_pass(manager, pages) -> float:
+    started = time.perf_counter()
+    for page in pages:
+        manager.process_multi_prompt(manager.prepare_request(page), PROMPT_TYPES)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="逐个提示词调用 vs 单次多提示词生成")
+    parser.add_argument("--model-path", default="", help="不指定时使用stub后端")
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--base-latency", type=float, default=0.2, help="stub后端单次生成固定耗时（秒）")
+    parser.add_argument("--per-sample-latency", type=float, default=0.02, help="stub后端按样本增量耗时（秒）")
+    args = parser.parse_args()
+
+    manager = build_manager(args.model_path, args.base_latency, args.per_sample_latency)
+    pages = synthetic_pages(args.pages)
+    cache_bytes = service.CONFIG["VISION_CACHE_MB"] * 1024 * 1024
+    counter = count_vision_tiles(manager)
+
+    variants = [
+        ("separate", 0, run_separate),
+        ("separate+cache", cache_bytes, run_separate),
+        ("single-pass", 0, run_single_pass),
+    ]
+    print(f"后端: {manager.backend.name}  页面数: {len(pages)}  提示词: {PROMPT_TYPES}")
+    baseline = None
+    for name, max_bytes, run in variants:
+        use_feature_cache(manager, max_bytes)
+        counter["tiles"] = 0
+        elapsed = run(manager, pages)
+        baseline = baseline or elapsed
+        print(f"{name:<15} 耗时={elapsed:7.2f}s 每页={elapsed / len(pages):6.2f}s "
+              f"加速比={baseline / elapsed:5.2f}x 视觉编码分块数={counter['tiles']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+多页打包基准
+
+在以半页内容为主、夹杂少量密集页面的手册样例上对比三种执行方式的吞吐（页/秒）：
+逐页（每页一次生成）、微批（相邻页面按MAX_BATCH_SIZE合并为一批，/ocr/pdf原有的执行方式）
+与打包（分块数不超过--max-page-patches的相邻页面按分块预算合并为一次多图对话，其余页面逐页）。
+同时核对打包后拆回的各页回答与逐页生成的回答是否一致。
+
+未指定模型路径时使用stub后端：--base-latency模拟每次生成的固定开销（对话模板、提示词预填充与
+生成启动），--per-page-latency模拟每页（每个样本或每张图片）的增量。stub不区分批内并行与打包后
+串行解码，微批与打包的差异需用真实模型测量。
+
+用法:
+    cd api
+    python benchmarks/bench_packing.py
+    python benchmarks/bench_packing.py --model-path /path/to/internvl3-8b --repeat 1
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw
+
+import intervl_service as service
+from bench_cascade import memo_page
+from bench_tile_budget import A4_150DPI, drawing_page, spec_sheet_page, table_page, title_page
+from page_packing import PackSettings, fits, packable
+
+
+def half_page(section: int) -> Image.Image:
+    """只有上半页有几段文字的手册页面"""
+    page = Image.new("RGB", A4_150DPI, "white")
+    draw = ImageDraw.Draw(page)
+    draw.text((120, 140), f"SECTION {section}  MAINTENANCE NOTES", fill="black")
+    for line in range(8):
+        draw.text((120, 220 + line * 40), f"{section}.{line + 1} Check the coupling alignment of pump "
+                                           f"P-{100 + section} before start-up.", fill="black")
+    return page
+
+
+def manual_corpus() -> List[Image.Image]:
+    """按手册的页面顺序：封面、若干半页说明、图纸、备忘、表格与规格表"""
+    return ([title_page()] + [half_page(section) for section in range(1, 5)] + [drawing_page(), memo_page()]
+            + [half_page(section) for section in range(5, 8)] + [table_page(), spec_sheet_page()])
+
+
+def plan_packs(requests: List["service.OCRRequest"], settings: PackSettings) -> List[List[int]]:
+    """按页码顺序贪心打包（与PagePacker相同的规则），不可打包的页面单独成组"""
+    groups, current, patches = [], [], 0
+    for index, request in enumerate(requests):
+        if not packable(request.num_patches, settings):
+            groups.append([index])
+            continue
+        if current and not fits(patches, len(current), request.num_patches, settings):
+            groups.append(current)
+            current, patches = [], 0
+        current.append(index)
+        patches += request.num_patches
+    if current:
+        groups.append(current)
+    return groups
+
+
+def run_single(manager, requests):
+    return [manager.process_batch([request])[0] for request in requests]
+
+
+def run_micro_batch(manager, requests, batch_size: int):
+    results = []
+    for start in range(0, len(requests), batch_size):
+        results.extend(manager.process_batch(requests[start:start + batch_size]))
+    return results
+
+
+def run_packed(manager, requests, groups, retried: List[int]):
+    """打包推理，拆分失败的页面逐页重试（页码下标记入retried）"""
+    results = [None] * len(requests)
+    for group in groups:
+        if len(group) == 1:
+            results[group[0]] = manager.process_batch([requests[group[0]]])[0]
+            continue
+        for index, result in zip(group, manager.process_packed([requests[index] for index in group])):
+            if result is None:
+                retried.append(index)
+                result = manager.process_batch([requests[index]])[0]
+            results[index] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多页打包基准")
+    parser.add_argument("--model-path", default="", help="指定时使用真实模型（hf后端）")
+    parser.add_argument("--base-latency", type=float, default=0.2, help="stub单次生成的固定耗时（秒）")
+    parser.add_argument("--per-page-latency", type=float, default=0.05, help="stub每页的增量耗时（秒）")
+    parser.add_argument("--tile-preset", default=service.CONFIG["TILE_PRESET"])
+    parser.add_argument("--batch-size", type=int, default=service.CONFIG["MAX_BATCH_SIZE"], help="微批的批大小")
+    parser.add_argument("--patch-budget", type=int, default=service.CONFIG["PACK_PATCH_BUDGET"])
+    parser.add_argument("--max-page-patches", type=int, default=service.CONFIG["PACK_MAX_PAGE_PATCHES"])
+    parser.add_argument("--max-pages", type=int, default=service.CONFIG["PACK_MAX_PAGES"])
+    parser.add_argument("--repeat", type=int, default=3, help="样例重复次数")
+    args = parser.parse_args()
+
+    if args.model_path:
+        manager = service.InterVLModelManager(model_path=args.model_path)
+    else:
+        manager = service.InterVLModelManager("stub", None, "stub", {
+            "STUB_BASE_LATENCY_MS": args.base_latency * 1000,
+            "STUB_PER_SAMPLE_LATENCY_MS": args.per_page_latency * 1000,
+        })
+    manager.load_model()
+    settings = manager.pack_settings._replace(
+        patch_budget=args.patch_budget, max_page_patches=args.max_page_patches, max_pages=args.max_pages)
+    manager.pack_settings = settings
+
+    corpus = manual_corpus() * args.repeat
+    requests = [manager.prepare_request(image, tile_preset=args.tile_preset) for image in corpus]
+    groups = plan_packs(requests, settings)
+    packed_pages = sum(len(group) for group in groups if len(group) > 1)
+    print(f"页数={len(requests)} 分块={[r.num_patches for r in requests[:len(corpus) // args.repeat]]} "
+          f"打包={packed_pages}页/{sum(len(group) > 1 for group in groups)}次 "
+          f"分块预算={settings.patch_budget} 单页分块上限={settings.max_page_patches}")
+
+    throughput = {}
+    retried: List[int] = []
+    runs = {
+        "逐页": lambda: run_single(manager, requests),
+        "微批": lambda: run_micro_batch(manager, requests, args.batch_size),
+        "打包": lambda: run_packed(manager, requests, groups, retried),
+    }
+    outputs = {}
+    for mode, run in runs.items():
+        started = time.perf_counter()
+        outputs[mode] = run()
+        elapsed = time.perf_counter() - started
+        throughput[mode] = len(requests) / elapsed
+        print(f"{mode}  总耗时={elapsed:7.2f}s 吞吐={throughput[mode]:6.2f} 页/秒")
+
+    # 打包后拆回的回答与逐页生成一致（真实模型的措辞可能略有差异，仅供参考）
+    mismatched = sum(packed["raw_text"] != single["raw_text"]
+                     for packed, single in zip(outputs["打包"], outputs["逐页"]))
+    print(f"与逐页回答不一致的页数={mismatched}/{len(requests)} 拆分失败（已逐页重试）={len(retried)}")
+    print("--- 汇总 ---")
+    for baseline in ("逐页", "微批"):
+        print(f"打包相对{baseline}: {throughput[baseline]:6.2f} -> {throughput['打包']:6.2f} 页/秒 "
+              f"({throughput['打包'] / throughput[baseline]:5.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+图片预处理微基准
+
+对比原有的逐块PIL裁剪 + torchvision Compose实现与向量化分块实现在
+A4/A3/A0扫描件上的耗时，并校验两者输出的pixel_values一致。
+
+用法:
+    cd api
+    python benchmarks/bench_preprocess.py --dpi 150 --repeat 5
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import torch
+from PIL import Image, ImageDraw
+from torchvision import transforms
+
+from image_preprocess import IMAGENET_MEAN, IMAGENET_STD, find_closest_aspect_ratio, load_image
+
+# 纸张尺寸（毫米，纵向）
+PAPER_SIZES = {"A4": (210, 297), "A3": (297, 420), "A0": (841, 1189)}
+
+
+def reference_load_image(image, input_size=448, max_num=12):
+    """原实现：每次构建Compose，逐块裁剪后逐块变换"""
+    transform = transforms.Compose([
+        transforms.Lambda(lambda img: img.convert('RGB') if img.mode != 'RGB' else img),
+        transforms.Resize((input_size, input_size), interpolation=transforms.InterpolationMode.BICUBIC),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    ])
+    orig_width, orig_height = image.size
+    target_ratios = set(
+        (i, j) for n in range(1, max_num + 1) for i in range(1, n + 1) for j in range(1, n + 1) if
+        i * j <= max_num and i * j >= 1
+    )
+    target_ratios = sorted(target_ratios, key=lambda x: x[0] * x[1])
+    ratio = find_closest_aspect_ratio(orig_width / orig_height, target_ratios, orig_width, orig_height, input_size)
+    target_width, target_height = input_size * ratio[0], input_size * ratio[1]
+    resized_img = image.resize((target_width, target_height))
+    tiles = []
+    for i in range(ratio[0] * ratio[1]):
+        box = (
+            (i % (target_width // input_size)) * input_size,
+            (i // (target_width // input_size)) * input_size,
+            ((i % (target_width // input_size)) + 1) * input_size,
+            ((i // (target_width // input_size)) + 1) * input_size
+        )
+        tiles.append(resized_img.crop(box))
+    if len(tiles) != 1:
+        tiles.append(image.resize((input_size, input_size)))
+    return torch.stack([transform(tile) for tile in tiles])
+
+
+def make_scan(paper: str, dpi: int, landscape: bool) -> Image.Image:
+    """生成带网格线和文字的合成扫描页"""
+    width_mm, height_mm = PAPER_SIZES[paper]
+    if landscape:
+        width_mm, height_mm = height_mm, width_mm
+    size = (int(width_mm / 25.4 * dpi), int(height_mm / 25.4 * dpi))
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    step = max(20, dpi // 2)
+    for x in range(0, size[0], step * 4):
+        draw.line([(x, 0), (x, size[1])], fill=(40, 40, 40), width=2)
+    for y in range(0, size[1], step):
+        draw.text((10, y), f"{paper} row {y // step} 参数 {y * 0.37:.2f}", fill="black")
+    return image
+
+
+def timeit(fn, image, repeat: int) -> float:
+    fn(image)  # 预热（填充缓存）
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(image)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片预处理微基准")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-num", type=int, default=12)
+    parser.add_argument("--atol", type=float, default=1e-5)
+    args = parser.parse_args()
+
+    for paper in PAPER_SIZES:
+        for landscape in (False, True):
+            image = make_scan(paper, args.dpi, landscape)
+            expected = reference_load_image(image, max_num=args.max_num)
+            actual = load_image(image, max_num=args.max_num)
+            max_diff = (expected - actual).abs().max().item() if expected.shape == actual.shape else float("inf")
+
+            reference_time = timeit(lambda img: reference_load_image(img, max_num=args.max_num), image, args.repeat)
+            vectorized_time = timeit(lambda img: load_image(img, max_num=args.max_num), image, args.repeat)
+            label = f"{paper}{'横' if landscape else '竖'} {image.width}x{image.height}"
+            print(f"{label:<22} 分块={actual.shape[0]:<3} 原实现={reference_time * 1000:8.1f}ms "
+                  f"向量化={vectorized_time * 1000:8.1f}ms 加速={reference_time / vectorized_time:5.2f}x "
+                  f"最大误差={max_diff:.2e}")
+            if max_diff > args.atol:
+                print(f"  ❌ 输出不一致（容差 {args.atol}）")
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+自适应分块预算基准
+
+在混合的工程文档页面（空白页、封面、图纸、表格、密集规格表）上对比
+draft / fast / balanced / accurate 四种分块预设的分块数与预处理耗时；指定
+--model-path 时还会逐页推理，对比端到端延迟。
+
+用法:
+    cd api
+    python benchmarks/bench_tile_budget.py
+    python benchmarks/bench_tile_budget.py --model-path /path/to/internvl3-8b --images /path/to/pages
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw
+
+from image_preprocess import load_image
+from tile_budget import TILE_PRESETS, plan_tiles, record_dropped_tiles
+
+A4_150DPI = (1240, 1754)
+
+
+def blank_page() -> Image.Image:
+    return Image.new("RGB", A4_150DPI, "white")
+
+
+def title_page() -> Image.Image:
+    page = blank_page()
+    draw = ImageDraw.Draw(page)
+    draw.rectangle([100, 600, 1140, 900], outline="black", width=4)
+    for i, text in enumerate(["PUMP STATION P-101", "DESIGN MANUAL", "REV. C  2024-05"]):
+        draw.text((420, 680 + i * 60), text, fill="black")
+    return page
+
+
+def drawing_page() -> Image.Image:
+    page = blank_page()
+    draw = ImageDraw.Draw(page)
+    draw.rectangle([40, 40, 1200, 1714], outline="black", width=3)
+    for i in range(6):
+        draw.ellipse([200 + i * 140, 500, 300 + i * 140, 600], outline="black", width=2)
+        draw.line([(250 + i * 140, 600), (250 + i * 140, 1100)], fill="black", width=2)
+    draw.line([(200, 1100), (1050, 1100)], fill="black", width=3)
+    draw.rectangle([800, 1500, 1200, 1714], outline="black", width=2)
+    draw.text((820, 1520), "DWG-0042  SCALE 1:50", fill="black")
+    return page
+
+
+def table_page() -> Image.Image:
+    page = blank_page()
+    draw = ImageDraw.Draw(page)
+    for row in range(31):
+        draw.line([(80, 120 + row * 40), (1160, 120 + row * 40)], fill="black", width=1)
+    for col in range(7):
+        draw.line([(80 + col * 180, 120), (80 + col * 180, 1320)], fill="black", width=1)
+    for row in range(30):
+        for col in range(6):
+            draw.text((90 + col * 180, 132 + row * 40), f"{row * 6 + col:03d}.{col}5 MPa", fill="black")
+    return page
+
+
+def spec_sheet_page() -> Image.Image:
+    page = blank_page()
+    draw = ImageDraw.Draw(page)
+    for line in range(110):
+        y = 60 + line * 15
+        draw.text((60, y), f"3.{line:03d} Flange DN{50 + line} PN16, ASTM A105, bolt M{12 + line % 8}x60, "
+                           f"torque {40 + line % 30} N.m, gasket t=3mm", fill="black")
+    return page
+
+
+CORPUS = {
+    "blank": blank_page,
+    "title": title_page,
+    "drawing": drawing_page,
+    "table": table_page,
+    "spec_sheet": spec_sheet_page,
+}
+
+
+def load_corpus(images_dir: str):
+    if images_dir:
+        paths = sorted(p for p in Path(images_dir).iterdir()
+                       if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".bmp", ".tiff"))
+        return [(p.name, Image.open(p).convert("RGB")) for p in paths]
+    return [(name, build()) for name, build in CORPUS.items()]
+
+
+def preprocess(image: Image.Image, preset: str, max_num: int):
+    started = time.perf_counter()
+    budget, drop_blank_tiles, info = plan_tiles(image, preset, max_num=max_num)
+    pixel_values = load_image(image, max_num=budget, drop_blank_tiles=drop_blank_tiles)
+    elapsed = time.perf_counter() - started
+    return pixel_values, record_dropped_tiles(info, pixel_values.shape[0]), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自适应分块预算基准")
+    parser.add_argument("--images", default="", help="样例页面目录，默认使用合成的工程文档页面")
+    parser.add_argument("--model-path", default="", help="指定时逐页推理并统计端到端延迟")
+    parser.add_argument("--max-num", type=int, default=12)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images)
+    manager = None
+    if args.model_path:
+        import intervl_service as service
+        service.CONFIG["MODEL_PATH"] = args.model_path
+        manager = service.InterVLModelManager()
+        manager.load_model()
+
+    totals = {}
+    for preset in TILE_PRESETS:
+        patches = preprocess_time = latency = 0.0
+        print(f"--- {preset} ---")
+        for name, image in corpus:
+            pixel_values, info, elapsed = preprocess(image, preset, args.max_num)
+            line = (f"{name:<14} 分块={pixel_values.shape[0]:<3} 网格={info['grid']:<5} "
+                    f"丢弃={info['dropped_tiles']:<2} 预处理={elapsed * 1000:7.1f}ms")
+            if manager is not None:
+                request = manager.build_request(pixel_values, f"{image.width}x{image.height}", tile_info=info)
+                started = time.perf_counter()
+                manager.process_batch([request])
+                page_latency = time.perf_counter() - started
+                latency += page_latency
+                line += f" 推理={page_latency:7.2f}s"
+            print(line)
+            patches += pixel_values.shape[0]
+            preprocess_time += elapsed
+        totals[preset] = (patches, preprocess_time, latency)
+
+    base_patches, base_preprocess, base_latency = totals["accurate"]
+    print("--- 汇总（相对accurate） ---")
+    for preset, (patches, preprocess_time, latency) in totals.items():
+        line = (f"{preset:<10} 分块总数={int(patches):<4} 节省={1 - patches / base_patches:6.1%} "
+                f"预处理={preprocess_time * 1000:8.1f}ms")
+        if manager is not None:
+            line += f" 推理={latency:7.2f}s 节省={1 - latency / base_latency:6.1%}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
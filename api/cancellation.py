@@ -0,0 +1,146 @@
+"""
+截止时间传播与取消
+
+调用方（Flask端的InterVLAPIClient）通过 X-Request-Deadline 请求头给出截止时间
+（Unix时间戳，秒）。服务端把它换算为本机单调时钟，与客户端断开状态一起保存在
+CancelScope中，随OCRRequest进入推理：
+
+- 排队期间已取消的请求不再推理
+- 生成中的请求由停止条件（GenerationStoppingCriteria）按行检查，取消后该行立即停止，
+  其余行继续生成；整批都取消时生成随之结束
+
+并发的相同请求合并为一次推理（SingleFlight），由SharedCancelScope表示：只有全部
+调用方都超时或断开后才取消。
+"""
+
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+DEADLINE_HEADER = "X-Request-Deadline"
+
+CANCEL_DEADLINE = "deadline"
+CANCEL_DISCONNECTED = "disconnected"
+CANCEL_REASONS = (CANCEL_DEADLINE, CANCEL_DISCONNECTED)
+
+
+class RequestCancelled(Exception):
+    """请求已超过截止时间或客户端已断开"""
+
+    def __init__(self, reason: str):
+        super().__init__("请求已超过截止时间" if reason == CANCEL_DEADLINE else "客户端已断开连接")
+        self.reason = reason
+
+
+def parse_deadline(value: Optional[str]) -> Optional[float]:
+    """把请求头中的截止时间（Unix时间戳，秒）换算为本机time.monotonic()时刻"""
+    if value is None or not value.strip():
+        return None
+    deadline = float(value)
+    return time.monotonic() + (deadline - time.time())
+
+
+class CancelScope:
+    """单个调用方的取消状态：截止时间（单调时钟）与客户端断开"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self._reason: Optional[str] = None
+
+    def cancel(self, reason: str = CANCEL_DISCONNECTED):
+        if self._reason is None:
+            self._reason = reason
+
+    @property
+    def reason(self) -> Optional[str]:
+        """取消原因，未取消时为None"""
+        if self._reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self._reason = CANCEL_DEADLINE
+        return self._reason
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        """距截止时间的秒数，没有截止时间时为None"""
+        return None if self.deadline is None else max(self.deadline - time.monotonic(), 0.0)
+
+    def check(self):
+        reason = self.reason
+        if reason is not None:
+            raise RequestCancelled(reason)
+
+
+class SharedCancelScope(CancelScope):
+    """多个调用方共享的一次推理：全部调用方都取消后才取消"""
+
+    def __init__(self):
+        super().__init__()
+        self._members: List[CancelScope] = []
+        self._lock = threading.Lock()
+
+    def add(self, scope: Optional[CancelScope]):
+        # 没有截止时间、无法感知断开的调用方永远等待结果，共享推理不再取消
+        with self._lock:
+            self._members.append(scope if scope is not None else CancelScope())
+
+    @property
+    def reason(self) -> Optional[str]:
+        if self._reason is None:
+            with self._lock:
+                members = list(self._members)
+            reasons = [member.reason for member in members]
+            if reasons and all(reasons):
+                self._reason = CANCEL_DEADLINE if CANCEL_DEADLINE in reasons else CANCEL_DISCONNECTED
+        return self._reason
+
+
+@asynccontextmanager
+async def watch_disconnect(http_request, scope: CancelScope, interval: float = 0.5):
+    """在区间内轮询客户端连接，断开时取消scope"""
+
+    async def poll():
+        while not scope.cancelled:
+            if await http_request.is_disconnected():
+                scope.cancel(CANCEL_DISCONNECTED)
+                return
+            await asyncio.sleep(interval)
+
+    task = asyncio.ensure_future(poll())
+    try:
+        yield scope
+    finally:
+        task.cancel()
+
+
+class CancellationStats:
+    """按原因与阶段统计被取消的请求（线程安全）"""
+
+    STAGES = ("queued", "generating")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {reason: {stage: 0 for stage in self.STAGES} for reason in CANCEL_REASONS}
+        self._tokens_saved = 0
+
+    def record(self, reason: str, stage: str, tokens_saved: int = 0):
+        """
+        Args:
+            reason: deadline / disconnected
+            stage: queued（推理开始前取消，不再推理） / generating（生成中途停止）
+            tokens_saved: 生成中途停止而未生成的token数
+        """
+        with self._lock:
+            self._counts[reason][stage] += 1
+            self._tokens_saved += tokens_saved
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **{reason: dict(stages) for reason, stages in self._counts.items()},
+                "total": sum(sum(stages.values()) for stages in self._counts.values()),
+                "tokens_saved": self._tokens_saved,
+            }
@@ -46,11 +46,32 @@ class Config:
         "specification": "请提取图片中的技术规格和参数信息。"
     }
     
+    # 各提示词类型的生成token预算（max_new_tokens），自定义提示词使用MAX_NEW_TOKENS
+    PROMPT_TOKEN_BUDGETS = {
+        "general": 1024,
+        "table": 1024,
+        "diagram": 512,
+        "specification": 512
+    }
+    
     @classmethod
     def get_prompt(cls, prompt_type: str = "general") -> str:
         """获取指定类型的提示词"""
         return cls.ENGINEERING_PROMPTS.get(prompt_type, cls.DEFAULT_PROMPT)
     
+    @classmethod
+    def get_prompt_type(cls, prompt: str):
+        """根据提示词文本查找提示词类型，自定义提示词返回None"""
+        for prompt_type, text in cls.ENGINEERING_PROMPTS.items():
+            if text == prompt:
+                return prompt_type
+        return None
+    
+    @classmethod
+    def get_token_budget(cls, prompt_type=None) -> int:
+        """获取提示词类型的生成token预算"""
+        return cls.PROMPT_TOKEN_BUDGETS.get(prompt_type, cls.MAX_NEW_TOKENS)
+    
     @classmethod
     def ensure_directories(cls):
         """确保必要的目录存在"""
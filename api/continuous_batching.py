@@ -0,0 +1,439 @@
+"""
+Token级连续批处理引擎
+
+静态批处理中，短回答必须等待同批最长的序列生成完毕。连续批处理在每个解码步
+（iteration）之后检查：已结束的序列立即返回并移出批次，队列中的新请求立即
+预填充（prefill）后加入正在运行的批次。
+
+每个序列拥有自己的KV缓存（prefill时单独计算），加入批次时左侧补零对齐合并为
+批量缓存，并记录各行的填充长度，用attention_mask屏蔽填充位置、用position_ids
+保持各序列自身的位置编码。序列移出时删除对应行并裁掉公共的左侧填充。
+
+批次中有序列时引擎持有模型闸门（model_manager.gate）的共享区间；热重载等待交换时
+不再接纳新序列，运行中的序列生成完毕后释放闸门，新模型就绪后再继续接纳。
+
+超过截止时间或客户端已断开的序列（见cancellation.py）不再预填充，生成中的则在下一个解码步移出批次。
+"""
+
+import math
+import queue
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import torch
+
+from inference_scheduler import QueueFullError, percentile
+from cancellation import CANCEL_REASONS
+from repetition_stopping import STOP_EOS, STOP_MAX_NEW_TOKENS, STOP_REPETITION, RepetitionDetector, StopInfo
+from token_confidence import chosen_logprobs, sequence_confidence
+from internvl_generation import (
+    build_input_embeds, build_query, decode_response, from_legacy_cache,
+    get_img_context_token_id, to_legacy_cache, validate_greedy_config
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Sequence:
+    """正在生成的单个序列"""
+
+    def __init__(self, request, future: Future, repetition_settings=None):
+        self.request = request
+        self.future = future
+        self.max_new_tokens = request.generation_config.get("max_new_tokens", 1024)
+        self.generated: List[int] = []
+        self.generated_count = 0  # 截断前生成的token数
+        self.logprobs: List[float] = []  # 各步所选token的对数概率（置信度）
+        self.detector = RepetitionDetector(repetition_settings) if repetition_settings is not None else None
+        self.eos_token_id: Optional[int] = None
+        self.sep = ""
+        self.stop_reason: Optional[str] = None
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+
+    def append(self, token_id: int, logprob: float) -> bool:
+        """追加一个生成的token及其对数概率，返回序列是否结束"""
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.logprobs.append(logprob)
+        if token_id == self.eos_token_id:
+            self.stop_reason = STOP_EOS
+            return True
+        self.generated.append(token_id)
+        self.generated_count = len(self.generated)
+        scope = self.request.cancel_scope
+        if scope is not None and scope.cancelled:
+            # 截止时间已过或客户端已断开
+            self.stop_reason = scope.reason
+            return True
+        if self.detector is not None and self.detector.append(token_id):
+            # 在最后一个完整重复处截断
+            self.generated = self.generated[:self.detector.keep]
+            self.stop_reason = STOP_REPETITION
+            return True
+        if len(self.generated) >= self.max_new_tokens:
+            self.stop_reason = STOP_MAX_NEW_TOKENS
+            return True
+        return False
+
+    @property
+    def stop_info(self) -> StopInfo:
+        stopped_early = self.stop_reason == STOP_REPETITION or self.stop_reason in CANCEL_REASONS
+        saved = self.max_new_tokens - self.generated_count if stopped_early else 0
+        confidence = sequence_confidence(self.logprobs[:max(self.generated_count, 1)])
+        return StopInfo(self.stop_reason, self.generated_count, saved, confidence)
+
+
+def _pad_left(x: torch.Tensor, n: int) -> torch.Tensor:
+    """在序列维（dim=2）左侧补零"""
+    if n == 0:
+        return x
+    return torch.cat([x.new_zeros(x.shape[0], x.shape[1], n, x.shape[3]), x], dim=2)
+
+
+class ContinuousBatchingEngine:
+    """围绕InternVL语言模型的迭代级调度器"""
+
+    def __init__(self, model_manager, max_batch_size: int = 8, max_queue_size: int = 16,
+                 initial_service_time: float = 30.0, name: str = "intervl-continuous"):
+        """
+        初始化引擎
+
+        Args:
+            model_manager: InterVLModelManager，提供model/tokenizer/设备信息并构建返回结果
+            max_batch_size: 同时参与解码的最大序列数
+            max_queue_size: 等待队列最大长度，超出后新请求被拒绝
+            initial_service_time: 尚无历史数据时单个请求的预估耗时（秒）
+            name: 工作线程名称
+        """
+        self.model_manager = model_manager
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_queue_size = max_queue_size
+        self.name = name
+        self._pending: "queue.Queue[_Sequence]" = queue.Queue(maxsize=max_queue_size)
+        self._running: List[_Sequence] = []
+        # 批量KV缓存：[(key, value), ...]，形状[B, heads, T, dim]；_pads[i]为第i行左侧填充长度
+        self._cache: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None
+        self._pads: List[int] = []
+        self._holds_gate = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self._avg_service_time = initial_service_time
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._decode_steps = 0
+        self._decode_rows = 0
+        self._generated_tokens = 0
+        self._busy_time = 0.0
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._ttfts: Deque[float] = deque(maxlen=1000)
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动引擎工作线程"""
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"✅ 连续批处理引擎已启动，最大并发序列数: {self.max_batch_size}")
+
+    def stop(self, timeout: float = 10.0):
+        """停止引擎（正在生成的序列以异常结束）"""
+        if not self.is_running:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        logger.info("🛑 连续批处理引擎已停止")
+
+    def submit(self, request) -> Future:
+        """
+        提交已预处理的OCRRequest
+
+        Raises:
+            ValueError: 生成配置不是贪心解码
+            QueueFullError: 等待队列已满
+        """
+        validate_greedy_config(request.generation_config)
+        sequence = _Sequence(request, Future(), self.model_manager.repetition_settings)
+        try:
+            self._pending.put_nowait(sequence)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            depth = self._pending.qsize()
+            raise QueueFullError(depth, self.estimate_retry_after(depth))
+        with self._lock:
+            self._submitted += 1
+        return sequence.future
+
+    def estimate_retry_after(self, depth: Optional[int] = None) -> int:
+        """根据队列深度和平均耗时估算重试等待秒数"""
+        if depth is None:
+            depth = self._pending.qsize()
+        waves = math.ceil((depth + len(self._running)) / self.max_batch_size)
+        return max(1, math.ceil(waves * self._avg_service_time))
+
+    # ==================== 工作线程 ====================
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self._admit()
+                if not self._running:
+                    self._release_gate()
+                    continue
+                step_start = time.monotonic()
+                self._decode_step()
+                self._busy_time += time.monotonic() - step_start
+            except Exception as e:
+                # 解码步失败时无法确定哪个序列出错，整批失败并重置缓存
+                logger.error(f"❌ 连续批处理解码失败: {e}")
+                self._fail_running(e)
+
+        self._fail_running(RuntimeError("连续批处理引擎已停止"))
+        self._release_gate()
+        while True:
+            try:
+                sequence = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if sequence.future.set_running_or_notify_cancel():
+                sequence.future.set_exception(RuntimeError("连续批处理引擎已停止"))
+
+    def _admit(self):
+        """将等待队列中的请求预填充后加入运行批次"""
+        gate = self.model_manager.gate
+        while len(self._running) < self.max_batch_size:
+            if self._running and gate.swap_pending:
+                # 模型交换等待中：只让运行中的序列生成完毕（排空）
+                return
+            try:
+                if self._running:
+                    sequence = self._pending.get_nowait()
+                else:
+                    # 没有运行中的序列时阻塞等待，避免空转
+                    sequence = self._pending.get(timeout=0.1)
+            except queue.Empty:
+                return
+            if not sequence.future.set_running_or_notify_cancel():
+                continue
+            if sequence.request.cancelled:
+                # 排队期间已超时或断开，不再预填充
+                sequence.future.set_exception(self.model_manager.cancelled_error(sequence.request))
+                continue
+            if not self._holds_gate:
+                # 交换进行中时在此等待新模型就绪
+                gate.acquire_shared()
+                self._holds_gate = True
+
+            prefill_start = time.monotonic()
+            try:
+                first_token, first_logprob, cache = self._prefill(sequence)
+            except Exception as e:
+                logger.error(f"❌ 序列预填充失败: {e}")
+                sequence.future.set_exception(e)
+                with self._lock:
+                    self._failed += 1
+                continue
+            finally:
+                self._busy_time += time.monotonic() - prefill_start
+
+            if sequence.append(first_token, first_logprob):
+                self._finish(sequence)
+            else:
+                self._merge_cache(cache)
+                self._running.append(sequence)
+
+    def _release_gate(self):
+        if self._holds_gate:
+            self._holds_gate = False
+            self.model_manager.gate.release_shared()
+
+    @torch.no_grad()
+    def _prefill(self, sequence: _Sequence) -> Tuple[int, float, List[Tuple[torch.Tensor, torch.Tensor]]]:
+        """单独编码图像并预填充提示词，返回第一个token、其对数概率和该序列的KV缓存"""
+        manager = self.model_manager
+        model, tokenizer = manager.model, manager.tokenizer
+        request = sequence.request
+        sequence.admitted_at = time.monotonic()
+
+        img_context_token_id = get_img_context_token_id(model, tokenizer)
+        query, sequence.eos_token_id, sequence.sep = build_query(
+            model, tokenizer, request.question, [request.num_patches])
+        input_ids = tokenizer(query, return_tensors='pt')['input_ids'].to(manager.device)
+
+        with manager.feature_cache.tiles(request.tile_keys):
+            vit_embeds = model.extract_feature(manager.to_model_input(request.pixel_values))
+        input_embeds = build_input_embeds(model, input_ids, vit_embeds, img_context_token_id)
+
+        outputs = self._decoder(inputs_embeds=input_embeds, use_cache=True)
+        token_ids, logprobs = chosen_logprobs(self._lm_head(outputs.last_hidden_state[:, -1, :]))
+        return token_ids[0], logprobs[0], to_legacy_cache(outputs.past_key_values)
+
+    @torch.no_grad()
+    def _decode_step(self):
+        """对所有运行中的序列执行一步批量贪心解码"""
+        manager = self.model_manager
+        device = manager.device
+        batch_size = len(self._running)
+        cache_len = self._cache[0][0].shape[2]
+
+        input_ids = torch.tensor([[s.generated[-1]] for s in self._running], device=device)
+        input_embeds = manager.model.language_model.get_input_embeddings()(input_ids)
+        attention_mask = torch.ones(batch_size, cache_len + 1, dtype=torch.long, device=device)
+        for row, pad in enumerate(self._pads):
+            attention_mask[row, :pad] = 0
+        position_ids = torch.tensor([[cache_len - pad] for pad in self._pads], device=device)
+
+        outputs = self._decoder(
+            inputs_embeds=input_embeds,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=from_legacy_cache(self._cache),
+            use_cache=True
+        )
+        next_tokens, logprobs = chosen_logprobs(self._lm_head(outputs.last_hidden_state[:, -1, :]))
+        self._cache = to_legacy_cache(outputs.past_key_values)
+
+        with self._lock:
+            self._decode_steps += 1
+            self._decode_rows += batch_size
+
+        finished = []
+        for row, (sequence, token_id, logprob) in enumerate(zip(self._running, next_tokens, logprobs)):
+            if sequence.append(token_id, logprob):
+                finished.append(row)
+        if finished:
+            self._evict(finished)
+
+    @property
+    def _decoder(self):
+        language_model = self.model_manager.model.language_model
+        return language_model.get_decoder() if hasattr(language_model, "get_decoder") else language_model.model
+
+    @property
+    def _lm_head(self):
+        return self.model_manager.model.language_model.get_output_embeddings()
+
+    # ==================== 批量KV缓存管理 ====================
+
+    def _merge_cache(self, new_cache: List[Tuple[torch.Tensor, torch.Tensor]]):
+        """将新序列的KV缓存左侧对齐后并入批量缓存"""
+        new_len = new_cache[0][0].shape[2]
+        if self._cache is None:
+            self._cache = new_cache
+            self._pads = [0]
+            return
+
+        cache_len = self._cache[0][0].shape[2]
+        target_len = max(cache_len, new_len)
+        self._cache = [
+            (torch.cat([_pad_left(k, target_len - cache_len), _pad_left(nk, target_len - new_len)], dim=0),
+             torch.cat([_pad_left(v, target_len - cache_len), _pad_left(nv, target_len - new_len)], dim=0))
+            for (k, v), (nk, nv) in zip(self._cache, new_cache)
+        ]
+        self._pads = [pad + target_len - cache_len for pad in self._pads] + [target_len - new_len]
+
+    def _evict(self, rows: List[int]):
+        """移出已结束的序列，返回结果并裁剪批量缓存"""
+        for row in rows:
+            self._finish(self._running[row])
+
+        keep = [row for row in range(len(self._running)) if row not in set(rows)]
+        self._running = [self._running[row] for row in keep]
+        if not keep:
+            self._cache = None
+            self._pads = []
+            return
+
+        index = torch.tensor(keep, device=self._cache[0][0].device)
+        pads = [self._pads[row] for row in keep]
+        trim = min(pads)
+        self._cache = [
+            (k.index_select(0, index)[:, :, trim:], v.index_select(0, index)[:, :, trim:])
+            for k, v in self._cache
+        ]
+        self._pads = [pad - trim for pad in pads]
+
+    # ==================== 结果处理 ====================
+
+    def _finish(self, sequence: _Sequence):
+        """解码序列文本并完成Future"""
+        now = time.monotonic()
+        if sequence.stop_reason in CANCEL_REASONS:
+            sequence.future.set_exception(self.model_manager.cancelled_error(sequence.request, sequence.stop_info))
+            return
+        try:
+            response = decode_response(self.model_manager.tokenizer, sequence.generated, sequence.sep)
+            result = self.model_manager.build_result(
+                sequence.request, response, batch_size=len(self._running) or 1, stop=sequence.stop_info)
+            result["metadata"]["batching"] = "continuous"
+            result["metadata"]["time_to_first_token"] = round(sequence.first_token_at - sequence.enqueued_at, 3)
+        except Exception as e:
+            sequence.future.set_exception(e)
+            with self._lock:
+                self._failed += 1
+            return
+
+        sequence.future.set_result(result)
+        latency = now - sequence.enqueued_at
+        with self._lock:
+            self._completed += 1
+            self._generated_tokens += sequence.generated_count
+            self._latencies.append(latency)
+            self._ttfts.append(sequence.first_token_at - sequence.enqueued_at)
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * (now - sequence.admitted_at)
+
+    def _fail_running(self, error: Exception):
+        for sequence in self._running:
+            sequence.future.set_exception(error)
+        with self._lock:
+            self._failed += len(self._running)
+        self._running = []
+        self._cache = None
+        self._pads = []
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取引擎统计信息"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            ttfts = sorted(self._ttfts)
+            return {
+                "worker_running": self.is_running,
+                "running_sequences": len(self._running),
+                "queue_depth": self._pending.qsize(),
+                "queue_capacity": self.max_queue_size,
+                "max_batch_size": self.max_batch_size,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "decode_steps": self._decode_steps,
+                "avg_running_batch_size": round(self._decode_rows / self._decode_steps, 2) if self._decode_steps else 0.0,
+                "generated_tokens": self._generated_tokens,
+                "tokens_per_second": round(self._generated_tokens / self._busy_time, 2) if self._busy_time else 0.0,
+                "latency": {
+                    "p50": round(percentile(latencies, 50), 3),
+                    "p95": round(percentile(latencies, 95), 3),
+                },
+                "time_to_first_token": {
+                    "p50": round(percentile(ttfts, 50), 3),
+                    "p95": round(percentile(ttfts, 95), 3),
+                },
+                "estimated_retry_after": self.estimate_retry_after(),
+            }
@@ -0,0 +1,126 @@
+"""
+CPU推理优化
+
+无GPU节点上默认是float32 + torch默认线程数。此模块提供可组合的CPU优化：
+
+- bf16 autocast：CPU支持bf16指令（AVX512-BF16 / AMX）时，视觉编码器与语言模型在bf16下计算
+- 动态int8量化：语言模型的Linear层权重量化为int8，激活在运行时动态量化
+  （量化后的Linear只接受float32输入，因此此时bf16只作用于视觉部分）
+- 线程数：intra-op / inter-op线程数可配置
+- torch.compile：编译各部分的forward（首次推理即预热时完成编译）
+
+语言模型的优化作用于其解码器（get_decoder()）与lm_head（get_output_embeddings()）而不是
+language_model.forward：连续批处理（continuous_batching.py）绕过language_model.forward直接调用这两部分，
+包装在它们上面时chat/generate与连续批处理两条路径都生效。
+"""
+
+import logging
+from typing import Any, Dict, List, NamedTuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class CpuSettings(NamedTuple):
+    bf16: str = "off"  # auto / on / off
+    int8_dynamic: bool = False
+    intra_op_threads: int = 0  # 0表示使用torch默认值
+    inter_op_threads: int = 0
+    compile: bool = False
+
+
+def bf16_supported() -> bool:
+    """CPU是否有原生bf16指令（否则bf16靠软件模拟，反而更慢）"""
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            flags = f.read()
+        return "avx512_bf16" in flags or "amx_bf16" in flags
+    except OSError:
+        pass
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configure_threads(intra_op_threads: int = 0, inter_op_threads: int = 0) -> Dict[str, int]:
+    """设置torch线程数，返回实际生效的线程数"""
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0 and torch.get_num_interop_threads() != inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # inter-op线程池只能在首次并行计算前设置
+            logger.warning(f"⚠️ 无法设置inter-op线程数: {e}")
+    return {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+
+
+def _autocast_forward(module: torch.nn.Module):
+    forward = module.forward
+
+    def wrapper(*args, **kwargs):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return forward(*args, **kwargs)
+
+    module.forward = wrapper
+
+
+def language_model_parts(language_model: torch.nn.Module) -> List[torch.nn.Module]:
+    """语言模型的解码器与lm_head（与连续批处理取用的模块相同）"""
+    decoder = language_model.get_decoder() if hasattr(language_model, "get_decoder") else language_model.model
+    return [decoder, language_model.get_output_embeddings()]
+
+
+def _compile_forward(module: torch.nn.Module):
+    # 序列长度随生成变化，使用动态形状避免反复重新编译
+    module.forward = torch.compile(module.forward, dynamic=True)
+
+
+def optimize_cpu_model(model: torch.nn.Module, settings: CpuSettings) -> Dict[str, Any]:
+    """
+    对已加载的float32 InternVL模型原地应用CPU优化
+
+    Returns:
+        实际生效的优化项（供/model/info与基准报告）
+    """
+    language_model = model.language_model
+    vision_parts = [part for part in (getattr(model, "vision_model", None), getattr(model, "mlp1", None))
+                    if part is not None]
+
+    use_bf16 = settings.bf16 == "on" or (settings.bf16 == "auto" and bf16_supported())
+    applied: Dict[str, Any] = {"bf16": use_bf16, "int8_dynamic": settings.int8_dynamic,
+                               "compile": settings.compile}
+
+    if settings.int8_dynamic:
+        model.language_model = language_model = torch.ao.quantization.quantize_dynamic(
+            language_model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if use_bf16:
+        for part in vision_parts:
+            _autocast_forward(part)
+        if not settings.int8_dynamic:
+            for part in language_model_parts(language_model):
+                _autocast_forward(part)
+
+    if settings.compile:
+        for part in vision_parts + language_model_parts(language_model):
+            _compile_forward(part)
+
+    logger.info(f"✅ CPU推理优化: {applied}")
+    return applied
+
+
+def settings_from_config(config: Dict[str, Any]) -> CpuSettings:
+    defaults = CpuSettings()
+    settings = CpuSettings(
+        bf16=config.get("CPU_BF16", defaults.bf16),
+        int8_dynamic=config.get("CPU_INT8_DYNAMIC", defaults.int8_dynamic),
+        intra_op_threads=config.get("CPU_INTRA_OP_THREADS", defaults.intra_op_threads),
+        inter_op_threads=config.get("CPU_INTER_OP_THREADS", defaults.inter_op_threads),
+        compile=config.get("CPU_TORCH_COMPILE", defaults.compile),
+    )
+    if settings.bf16 not in ("auto", "on", "off"):
+        raise ValueError(f"CPU_BF16必须为auto/on/off: {settings.bf16}")
+    return settings
@@ -0,0 +1,142 @@
+"""
+InternVL图片预处理
+
+按最接近的宽高比把图片缩放到 (列数×448, 行数×448) 的网格，一次性转换为张量后
+用reshape切分为448×448分块，并对全部分块做一次批量归一化。
+网格选择结果按 (宽, 高, 分块上限) 缓存，同尺寸的扫描件无需重复搜索。
+"""
+
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+_MEAN = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+_STD = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+
+
+@lru_cache(maxsize=8)
+def build_transform(input_size):
+    """构建单张图片的预处理变换（兼容旧接口，批量路径见load_image）"""
+    from torchvision import transforms
+    transform = transforms.Compose([
+        transforms.Lambda(lambda img: img.convert('RGB') if img.mode != 'RGB' else img),
+        transforms.Resize((input_size, input_size), interpolation=transforms.InterpolationMode.BICUBIC),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    ])
+    return transform
+
+
+@lru_cache(maxsize=64)
+def get_target_ratios(max_num: int) -> Tuple[Tuple[int, int], ...]:
+    """列出分块数不超过max_num的所有 (列, 行) 组合，按分块数升序"""
+    target_ratios = set(
+        (i, j) for n in range(1, max_num + 1) for i in range(1, n + 1) for j in range(1, n + 1) if
+        i * j <= max_num and i * j >= 1
+    )
+    return tuple(sorted(target_ratios, key=lambda x: x[0] * x[1]))
+
+
+def find_closest_aspect_ratio(aspect_ratio, target_ratios, width, height, image_size):
+    """找到最接近的宽高比"""
+    best_ratio_diff = float('inf')
+    best_ratio = (1, 1)
+    area = width * height
+    for ratio in target_ratios:
+        target_aspect_ratio = ratio[0] / ratio[1]
+        ratio_diff = abs(aspect_ratio - target_aspect_ratio)
+        if ratio_diff < best_ratio_diff:
+            best_ratio_diff = ratio_diff
+            best_ratio = ratio
+        elif ratio_diff == best_ratio_diff:
+            if area > 0.5 * image_size * image_size * ratio[0] * ratio[1]:
+                best_ratio = ratio
+    return best_ratio
+
+
+@lru_cache(maxsize=1024)
+def select_grid(width: int, height: int, image_size: int = 448, max_num: int = 12) -> Tuple[int, int]:
+    """为给定图片尺寸选择分块网格，返回 (列数, 行数)"""
+    return find_closest_aspect_ratio(
+        width / height, get_target_ratios(max_num), width, height, image_size)
+
+
+def dynamic_preprocess(image, image_size, use_thumbnail=False, max_num=12):
+    """动态预处理图片，返回PIL分块列表（兼容旧接口）"""
+    cols, rows = select_grid(image.width, image.height, image_size, max_num)
+    resized_img = image.resize((image_size * cols, image_size * rows))
+    processed_images = []
+    for i in range(cols * rows):
+        box = (
+            (i % cols) * image_size,
+            (i // cols) * image_size,
+            ((i % cols) + 1) * image_size,
+            ((i // cols) + 1) * image_size
+        )
+        processed_images.append(resized_img.crop(box))
+
+    if use_thumbnail and len(processed_images) != 1:
+        processed_images.append(image.resize((image_size, image_size)))
+    return processed_images
+
+
+def _to_uint8_tensor(image: Image.Image) -> torch.Tensor:
+    """PIL RGB图片 -> [3, H, W] uint8张量"""
+    array = np.array(image, dtype=np.uint8)
+    return torch.from_numpy(array).permute(2, 0, 1)
+
+
+def split_tiles(grid: torch.Tensor, cols: int, rows: int, image_size: int) -> torch.Tensor:
+    """[C, rows*S, cols*S] -> [rows*cols, C, S, S]，按行优先顺序排列分块"""
+    channels = grid.shape[0]
+    tiles = grid.reshape(channels, rows, image_size, cols, image_size).permute(1, 3, 0, 2, 4)
+    return tiles.reshape(rows * cols, channels, image_size, image_size)
+
+
+def normalize(tiles: torch.Tensor) -> torch.Tensor:
+    """uint8分块 -> 归一化后的float32张量"""
+    pixel_values = tiles.to(torch.float32).div_(255.0)
+    return pixel_values.sub_(_MEAN).div_(_STD)
+
+
+def blank_tile_mask(tiles: torch.Tensor, contrast: int = 48) -> torch.Tensor:
+    """uint8分块中灰度几乎一致（无墨迹）的分块，返回 [分块数] 的bool张量"""
+    gray = tiles.to(torch.float32).mean(dim=1, keepdim=True)
+    # 4×4平均池化抑制扫描噪点
+    pooled = torch.nn.functional.avg_pool2d(gray, 4).flatten(1)
+    return (pooled.amax(dim=1) - pooled.amin(dim=1)) < contrast
+
+
+def load_image(image, input_size=448, max_num=12, use_thumbnail=True, drop_blank_tiles=False):
+    """
+    加载和预处理图片，返回 [分块数, 3, input_size, input_size] 的pixel_values
+
+    drop_blank_tiles为True时丢弃空白分块（至少保留一块），缩略图不受影响
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    cols, rows = select_grid(image.width, image.height, input_size, max_num)
+    resized_img = image.resize((input_size * cols, input_size * rows))
+    tiles = split_tiles(_to_uint8_tensor(resized_img), cols, rows, input_size)
+
+    if drop_blank_tiles and cols * rows > 1:
+        keep = ~blank_tile_mask(tiles)
+        if keep.any():
+            tiles = tiles[keep]
+        else:
+            tiles = tiles[:1]
+
+    # 如果使用缩略图，添加原图的缩略图
+    if use_thumbnail and cols * rows != 1:
+        thumbnail = _to_uint8_tensor(image.resize((input_size, input_size)))
+        tiles = torch.cat([tiles, thumbnail.unsqueeze(0)], dim=0)
+
+    return normalize(tiles)
+
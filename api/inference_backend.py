@@ -0,0 +1,427 @@
+"""
+推理后端接口
+
+InterVLModelManager通过InferenceBackend访问模型，不再直接依赖AutoModel.chat：
+- prepare_inputs: 预处理后的pixel_values -> 后端所需的输入（设备、精度）
+- generate: 一批图片与问题 -> 各自的回答（num_patches_list把分块分配回各问题）
+- generate_multi_prompt: 同一张图片回答多个问题
+- stream: 单个请求逐段输出文本
+
+generation_config中可以带有transformers的stopping_criteria（重复循环检测）与
+logits_processor（记录token对数概率，用于置信度），后端需把它们传给生成过程，
+并通过stop_token_ids / decode_tokens支持截断后重新解码。
+
+实现（由CONFIG["BACKEND"]选择）:
+- hf: transformers AutoModel（默认）
+- onnx: 视觉编码器由ONNX Runtime在CPU上执行，语言模型仍为torch（见onnx_backend.py）
+- stub: 确定性的桩后端，不需要模型文件，用于测试与负载基准
+
+所有后端都应通过 backend_conformance.py 中的一致性检查。
+"""
+
+import time
+import importlib
+import logging
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Type
+
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+from cpu_inference import configure_threads, optimize_cpu_model, settings_from_config
+from internvl_generation import (
+    CallbackTextStreamer, build_query, decode_response, get_conv_template, get_img_context_token_id
+)
+from model_reload import model_nbytes
+from page_packing import pack_marker, packed_prompt
+
+logger = logging.getLogger(__name__)
+
+TextCallback = Callable[[str, bool], None]  # (文本片段, 是否结束)
+PhaseFn = Callable[[str], ContextManager]
+
+
+def _no_phase(name: str) -> ContextManager:
+    return nullcontext()
+
+
+class InferenceBackend(ABC):
+    """推理后端基类"""
+
+    name = "base"
+    # 是否提供InternVL的model/tokenizer，供连续批处理引擎直接驱动language_model
+    supports_continuous_batching = False
+    # 是否支持一次对话中的多张图片（多页打包，见page_packing.py）
+    supports_packing = False
+
+    def __init__(self, model_path, device: str = "cpu", options: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            model_path: 模型目录
+            device: 推理设备
+            options: 服务配置（CONFIG），各后端读取自己需要的键
+        """
+        self.model_path = Path(model_path) if model_path else None
+        self.device = device
+        self.options = dict(options or {})
+        self.model = None
+        self.tokenizer = None
+
+    @abstractmethod
+    def load(self, phase: PhaseFn = _no_phase):
+        """加载模型；phase(name)返回计时上下文，用于报告冷启动各阶段"""
+
+    def prepare_inputs(self, pixel_values: torch.Tensor) -> Any:
+        """把预处理后的pixel_values转换为后端输入"""
+        return pixel_values
+
+    @abstractmethod
+    def generate(self, inputs: Any, questions: List[str], num_patches_list: List[int],
+                 generation_config: Dict[str, Any]) -> List[str]:
+        """批量生成，按questions的顺序返回回答"""
+
+    def generate_multi_prompt(self, inputs: Any, questions: List[str],
+                              generation_config: Dict[str, Any]) -> List[str]:
+        """同一张图片回答多个问题，按questions的顺序返回（默认实现：复制分块后批量生成）"""
+        num_patches = inputs.shape[0]
+        return self.generate(inputs.repeat(len(questions), 1, 1, 1), questions,
+                             [num_patches] * len(questions), generation_config)
+
+    def generate_packed(self, inputs: Any, question: str, num_patches_list: List[int],
+                        generation_config: Dict[str, Any]) -> str:
+        """
+        一次对话回答多张图片：question中每个<image>依次对应num_patches_list中的一张图片，
+        inputs为各图片分块按同一顺序拼接的结果
+        """
+        raise NotImplementedError(f"{self.name}后端不支持多页打包")
+
+    @abstractmethod
+    def stream(self, inputs: Any, question: str, generation_config: Dict[str, Any],
+               on_text: TextCallback) -> str:
+        """
+        单个请求流式生成，返回完整回答
+
+        生成过程中调用on_text(片段, False)；结束时（包括生成异常时）必须调用一次on_text(剩余文本, True)
+        """
+
+    def stop_token_ids(self) -> List[int]:
+        """结束生成的token（停止条件据此区分正常结束与其他停止原因）"""
+        return []
+
+    @abstractmethod
+    def decode_tokens(self, token_ids: List[int]) -> str:
+        """把生成的token解码为回答文本（重复循环截断后重新解码）"""
+
+    def nbytes(self) -> int:
+        """模型占用的字节数（热重载据此判断能否双缓冲）"""
+        return model_nbytes(self.model) if self.model is not None else 0
+
+    def offload(self) -> bool:
+        """pause策略：腾出推理设备内存，返回之后能否restore"""
+        self.model = None
+        return False
+
+    def restore(self):
+        """新模型加载失败时恢复offload前的状态"""
+        raise RuntimeError(f"{self.name}后端不支持恢复")
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "device": self.device}
+
+
+class HFBackend(InferenceBackend):
+    """transformers AutoModel后端（InternVL remote code的chat/batch_chat）"""
+
+    supports_packing = True
+
+    name = "hf"
+    supports_continuous_batching = True
+
+    def __init__(self, model_path, device: str = "cpu", options: Optional[Dict[str, Any]] = None):
+        super().__init__(model_path, device, options)
+        self.cpu_optimizations: Optional[Dict[str, Any]] = None
+
+    def load(self, phase: PhaseFn = _no_phase):
+        logger.info(f"开始加载InterVL模型: {self.model_path}")
+        logger.info(f"使用设备: {self.device}")
+
+        # 检查模型路径
+        if not self.model_path.exists():
+            raise FileNotFoundError(f"模型路径不存在: {self.model_path}")
+        cpu_settings = settings_from_config(self.options) if self.device == "cpu" else None
+        if cpu_settings is not None:
+            threads = configure_threads(cpu_settings.intra_op_threads, cpu_settings.inter_op_threads)
+            logger.info(f"CPU线程数: {threads}")
+
+        with phase("tokenizer"):
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                str(self.model_path),
+                trust_remote_code=True
+            )
+
+        # 加载权重：safetensors按需映射文件页，不先把整个权重读入内存
+        with phase("weights"):
+            use_safetensors = any(self.model_path.glob("*.safetensors"))
+            if not use_safetensors:
+                logger.warning("⚠️ 模型目录中没有safetensors权重，无法使用内存映射加载")
+            model = AutoModel.from_pretrained(
+                str(self.model_path),
+                torch_dtype=torch.bfloat16 if self.device == "cuda" else torch.float32,
+                low_cpu_mem_usage=True,
+                use_safetensors=use_safetensors or None,
+                trust_remote_code=True,
+                **({"use_flash_attn": True} if self.device == "cuda" else {})
+            ).eval()
+            self._on_weights_loaded(model, phase)
+
+        with phase("device"):
+            if self.device == "cuda":
+                model = model.cuda()
+                torch.cuda.synchronize()
+            else:
+                # bf16 autocast / int8量化 / torch.compile（编译在随后的预热中完成）
+                self.cpu_optimizations = dict(optimize_cpu_model(model, cpu_settings),
+                                              threads=configure_threads())
+            self.model = model
+
+    def _on_weights_loaded(self, model, phase: PhaseFn):
+        """权重加载完成、尚未应用设备优化时的扩展点"""
+
+    def prepare_inputs(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """将预处理后的图片张量移动到模型所在设备并转换精度"""
+        pixel_values = pixel_values.to(self.device)
+        if self.device == "cuda":
+            pixel_values = pixel_values.to(torch.bfloat16)
+        return pixel_values
+
+    @torch.no_grad()
+    def generate(self, inputs: torch.Tensor, questions: List[str], num_patches_list: List[int],
+                 generation_config: Dict[str, Any]) -> List[str]:
+        if len(questions) == 1:
+            response = self.model.chat(self.tokenizer, inputs, questions[0], generation_config)
+            return [response]
+        return self.model.batch_chat(
+            self.tokenizer,
+            inputs,
+            num_patches_list=num_patches_list,
+            questions=questions,
+            generation_config=generation_config
+        )
+
+    @torch.no_grad()
+    def generate_multi_prompt(self, inputs: torch.Tensor, questions: List[str],
+                              generation_config: Dict[str, Any]) -> List[str]:
+        """视觉编码器只执行一次，特征复制给每个问题后一次批量生成（与batch_chat的模板拼接一致）"""
+        model, tokenizer = self.model, self.tokenizer
+        get_img_context_token_id(model, tokenizer)
+        vit_embeds = model.extract_feature(inputs)
+
+        queries = []
+        for question in questions:
+            query, eos_token_id, sep = build_query(model, tokenizer, question, [inputs.shape[0]])
+            queries.append(query)
+        tokenizer.padding_side = "left"
+        model_inputs = tokenizer(queries, return_tensors="pt", padding=True)
+        outputs = model.generate(
+            input_ids=model_inputs["input_ids"].to(self.device),
+            attention_mask=model_inputs["attention_mask"].to(self.device),
+            visual_features=vit_embeds.repeat(len(questions), 1, 1),
+            **dict(generation_config, eos_token_id=eos_token_id)
+        )
+        responses = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        return [response.split(sep)[0].strip() for response in responses]
+
+    @torch.no_grad()
+    def generate_packed(self, inputs: torch.Tensor, question: str, num_patches_list: List[int],
+                        generation_config: Dict[str, Any]) -> str:
+        return self.model.chat(self.tokenizer, inputs, question, generation_config,
+                               num_patches_list=num_patches_list)
+
+    def stop_token_ids(self) -> List[int]:
+        sep = get_conv_template(self.model).sep.strip()
+        return [self.tokenizer.convert_tokens_to_ids(sep), self.tokenizer.eos_token_id]
+
+    def decode_tokens(self, token_ids: List[int]) -> str:
+        return decode_response(self.tokenizer, token_ids, get_conv_template(self.model).sep.strip())
+
+    @torch.no_grad()
+    def stream(self, inputs: torch.Tensor, question: str, generation_config: Dict[str, Any],
+               on_text: TextCallback) -> str:
+        streamer = CallbackTextStreamer(self.tokenizer, on_text)
+        try:
+            return self.model.chat(self.tokenizer, inputs, question, dict(generation_config, streamer=streamer))
+        finally:
+            # 生成异常时也要结束流，避免消费端一直等待
+            streamer.end()
+
+    def offload(self) -> bool:
+        """CUDA上把模型移到CPU内存以便恢复；CPU推理时内存放不下两份模型，只能释放"""
+        if self.device != "cuda":
+            return super().offload()
+        self.model.to("cpu")
+        return True
+
+    def restore(self):
+        if self.model is None:
+            super().restore()
+        self.model.cuda()
+        torch.cuda.synchronize()
+
+    def describe(self) -> Dict[str, Any]:
+        info = super().describe()
+        if self.cpu_optimizations is not None:
+            info["cpu_optimizations"] = self.cpu_optimizations
+        return info
+
+
+class StubBackend(InferenceBackend):
+    """
+    确定性的桩后端
+
+    回答为 "{question}|patches={分块数}"（按max_new_tokens个字符截断），耗时模拟为
+    固定开销 + 按样本的增量（STUB_BASE_LATENCY_MS / STUB_PER_SAMPLE_LATENCY_MS）。
+    每个字符视为一个token（token id为字符的码位），逐个交给stopping_criteria；与HF后端一样，
+    每行以结束token（EOS_TOKEN_ID，stop_token_ids()声明）结束，之后以同一token填充。
+    交给logits_processor的分数使所选token的概率为
+    min(0.99, 0.5 + STUB_CONFIDENCE_PER_PATCH × 分块数)，分块越多越"确定"，用于模拟渐进式识别。
+    多页打包时按分节标记依次给出各图片的回答（与单独生成的回答相同），耗时为一次固定开销
+    加上按图片的增量。
+    """
+
+    name = "stub"
+    supports_packing = True
+    STREAM_CHUNK_CHARS = 4
+    EOS_TOKEN_ID = 0  # 结束token（也用作结束后的填充token），不对应任何回答中的字符
+
+    def __init__(self, model_path=None, device: str = "cpu", options: Optional[Dict[str, Any]] = None):
+        super().__init__(model_path, device, options)
+        self.base_latency = self.options.get("STUB_BASE_LATENCY_MS", 0) / 1000.0
+        self.per_sample_latency = self.options.get("STUB_PER_SAMPLE_LATENCY_MS", 0) / 1000.0
+        self.image_size = self.options.get("IMAGE_SIZE", 448)
+        self.confidence_per_patch = self.options.get("STUB_CONFIDENCE_PER_PATCH", 0.04)
+
+    def load(self, phase: PhaseFn = _no_phase):
+        with phase("weights"):
+            self.model = "stub"
+
+    def nbytes(self) -> int:
+        return 0
+
+    def offload(self) -> bool:
+        return True
+
+    def restore(self):
+        pass
+
+    def _respond(self, question: str, num_patches: int, generation_config: Dict[str, Any]) -> str:
+        response = f"{question}|patches={num_patches}"
+        return response[:generation_config.get("max_new_tokens", len(response))]
+
+    def stop_token_ids(self) -> List[int]:
+        return [self.EOS_TOKEN_ID]
+
+    def decode_tokens(self, token_ids: List[int]) -> str:
+        return "".join(chr(token_id) for token_id in token_ids if token_id != self.EOS_TOKEN_ID)
+
+    def _scores(self, num_patches_list: List[int]) -> torch.Tensor:
+        """两个候选token的分数，所选token（第0个）的概率按分块数给出"""
+        probs = torch.tensor([min(0.99, 0.5 + self.confidence_per_patch * n) for n in num_patches_list])
+        return torch.stack([probs.log(), (1 - probs).log()], dim=1)
+
+    def _apply_stopping_criteria(self, responses: List[str], num_patches_list: List[int],
+                                 generation_config: Dict[str, Any]) -> List[str]:
+        """
+        按生成步把token交给logits_processor与停止条件，被停止的行在该步截断
+
+        未达到max_new_tokens的行在回答之后生成结束token；已结束的行与transformers一样以填充token补齐
+        """
+        stopping_criteria = generation_config.get("stopping_criteria")
+        logits_processor = generation_config.get("logits_processor")
+        max_new_tokens = generation_config.get("max_new_tokens")
+        scores = self._scores(num_patches_list)
+        sequences = []
+        for response in responses:
+            tokens = [ord(c) for c in response]
+            if max_new_tokens is None or len(tokens) < max_new_tokens:
+                tokens.append(self.EOS_TOKEN_ID)
+            sequences.append(tokens)
+
+        def padded(step: int) -> torch.Tensor:
+            return torch.tensor([tokens[:step] + [self.EOS_TOKEN_ID] * max(step - len(tokens), 0)
+                                 for tokens in sequences], dtype=torch.long).reshape(len(sequences), step)
+
+        lengths = [None] * len(responses)
+        for step in range(1, max(map(len, sequences), default=0) + 1):
+            active = [row for row, length in enumerate(lengths) if length is None]
+            if not active:
+                break
+            if logits_processor is not None:
+                logits_processor(padded(step - 1), scores.clone())
+            if stopping_criteria is None:
+                done = [False] * len(responses)
+            else:
+                done = stopping_criteria(padded(step), None)
+            for row in active:
+                if bool(done[row]) or step >= len(sequences[row]):
+                    lengths[row] = step
+        return [response[:length] for response, length in zip(responses, lengths)]
+
+    def generate(self, inputs: torch.Tensor, questions: List[str], num_patches_list: List[int],
+                 generation_config: Dict[str, Any]) -> List[str]:
+        if inputs.dim() != 4 or tuple(inputs.shape[1:]) != (3, self.image_size, self.image_size):
+            raise ValueError(f"分块形状应为 [N, 3, {self.image_size}, {self.image_size}]: {tuple(inputs.shape)}")
+        if sum(num_patches_list) != inputs.shape[0]:
+            raise ValueError(f"num_patches_list之和({sum(num_patches_list)})与分块数({inputs.shape[0]})不一致")
+        time.sleep(self.base_latency + self.per_sample_latency * len(questions))
+        responses = [self._respond(q, n, generation_config) for q, n in zip(questions, num_patches_list)]
+        if generation_config.get("stopping_criteria") is not None or generation_config.get("logits_processor") is not None:
+            responses = self._apply_stopping_criteria(responses, num_patches_list, generation_config)
+        return responses
+
+    def generate_packed(self, inputs: torch.Tensor, question: str, num_patches_list: List[int],
+                        generation_config: Dict[str, Any]) -> str:
+        if question.count("<image>") != len(num_patches_list):
+            raise ValueError(f"<image>占位数({question.count('<image>')})与图片数({len(num_patches_list)})不一致")
+        if sum(num_patches_list) != inputs.shape[0]:
+            raise ValueError(f"num_patches_list之和({sum(num_patches_list)})与分块数({inputs.shape[0]})不一致")
+        time.sleep(self.base_latency + self.per_sample_latency * len(num_patches_list))
+        prompt = packed_prompt(question)
+        response = "\n".join(f"{pack_marker(index)}\n<image>\n{prompt}|patches={n}"
+                             for index, n in enumerate(num_patches_list, 1))
+        response = response[:generation_config.get("max_new_tokens", len(response))]
+        if generation_config.get("stopping_criteria") is not None or generation_config.get("logits_processor") is not None:
+            # 置信度按分块最少的图片给出，不因打包而高于单独生成
+            response = self._apply_stopping_criteria([response], [min(num_patches_list)], generation_config)[0]
+        return response
+
+    def stream(self, inputs: torch.Tensor, question: str, generation_config: Dict[str, Any],
+               on_text: TextCallback) -> str:
+        try:
+            response = self.generate(inputs, [question], [inputs.shape[0]], generation_config)[0]
+            for start in range(0, len(response), self.STREAM_CHUNK_CHARS):
+                on_text(response[start:start + self.STREAM_CHUNK_CHARS], False)
+            return response
+        finally:
+            on_text("", True)
+
+
+# 后端名称 -> "模块:类"，按需导入（onnx后端依赖onnxruntime）
+BACKENDS = {
+    "hf": "inference_backend:HFBackend",
+    "onnx": "onnx_backend:OnnxRuntimeBackend",
+    "stub": "inference_backend:StubBackend",
+}
+
+
+def get_backend_class(name: str) -> Type[InferenceBackend]:
+    if name not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {name}，支持: {list(BACKENDS)}")
+    module_name, class_name = BACKENDS[name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_backend(name: str, model_path, device: str,
+                   options: Optional[Dict[str, Any]] = None) -> InferenceBackend:
+    return get_backend_class(name)(model_path, device, options)
@@ -0,0 +1,339 @@
+"""
+InterVL推理调度器
+
+将模型推理从FastAPI事件循环中移出，交给专用的推理工作线程执行。
+请求通过有界队列提交，队列满时立即拒绝并给出预计的重试等待时间。
+
+可批处理的请求（submit_batch_item）会在一个很短的时间窗口内聚合，
+按批次交给batch_handler一次性推理（动态微批处理）。
+"""
+
+import math
+import queue
+import time
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """推理队列已满"""
+
+    def __init__(self, queue_depth: int, retry_after: int):
+        super().__init__(f"推理队列已满（当前排队 {queue_depth} 个请求）")
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+
+
+class _Job:
+    """队列中的单个推理任务"""
+
+    __slots__ = ("fn", "args", "kwargs", "payload", "batch_key", "future", "enqueued_at")
+
+    def __init__(self, future: Future, fn: Optional[Callable] = None, args: tuple = (),
+                 kwargs: Optional[dict] = None, payload: Any = None,
+                 batch_key: Optional[Hashable] = None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.payload = payload
+        self.batch_key = batch_key
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def batchable(self) -> bool:
+        return self.fn is None
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """计算百分位数（values需已排序）"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[index]
+
+
+class InferenceScheduler:
+    """推理调度器：有界队列 + 单个推理工作线程 + 动态微批处理"""
+
+    def __init__(self, max_queue_size: int = 16, initial_service_time: float = 30.0,
+                 batch_handler: Optional[Callable[[List[Any]], List[Any]]] = None,
+                 max_batch_size: int = 1, batch_window_ms: float = 30.0,
+                 name: str = "intervl-inference"):
+        """
+        初始化调度器
+
+        Args:
+            max_queue_size: 队列最大长度，超出后新请求被拒绝
+            initial_service_time: 尚无历史数据时单个请求的预估耗时（秒）
+            batch_handler: 批处理函数，输入payload列表，按相同顺序返回结果列表
+            max_batch_size: 单批最大请求数
+            batch_window_ms: 收到第一个请求后等待凑批的最长时间（毫秒）
+            name: 工作线程名称
+        """
+        self.max_queue_size = max_queue_size
+        self.batch_handler = batch_handler
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = max(0.0, batch_window_ms) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue(maxsize=max_queue_size)
+        # 凑批时取出但批次键不同的任务，留到下一轮优先处理
+        self._deferred: Deque[_Job] = deque()
+        # 已接受但尚未开始执行的任务数（含队列中、凑批时取出暂存与延后的任务），按它判断队列是否已满
+        self._pending = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self._avg_service_time = initial_service_time
+        self._busy = False
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._batches = 0
+        self._batch_size_histogram: Counter = Counter()
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+        self._started_jobs = 0
+        self._total_wait_time = 0.0
+        self._total_service_time = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动推理工作线程"""
+        if self.is_running:
+            return
+        self._thread = threading.Thread(target=self._worker_loop, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"✅ 推理工作线程已启动，队列容量: {self.max_queue_size}，"
+                    f"最大批大小: {self.max_batch_size}，凑批窗口: {self.batch_window * 1000:.0f}ms")
+
+    def stop(self, timeout: float = 10.0):
+        """停止推理工作线程（已排队的任务会先执行完）"""
+        if not self.is_running:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        logger.info("🛑 推理工作线程已停止")
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        提交独占执行的推理任务
+
+        Returns:
+            concurrent.futures.Future，可通过asyncio.wrap_future在协程中等待
+
+        Raises:
+            QueueFullError: 队列已满
+        """
+        return self._enqueue(_Job(Future(), fn=fn, args=args, kwargs=kwargs))
+
+    def submit_batch_item(self, payload: Any, batch_key: Hashable = None) -> Future:
+        """
+        提交可批处理的推理任务，由batch_handler与其他同批次键的任务合并执行
+
+        Args:
+            payload: 传给batch_handler的单个样本
+            batch_key: 批次键，只有键相同的任务才会合并（如生成配置不同则不可合并）
+
+        Raises:
+            QueueFullError: 队列已满
+        """
+        if self.batch_handler is None:
+            raise RuntimeError("调度器未配置batch_handler")
+        return self._enqueue(_Job(Future(), payload=payload, batch_key=batch_key))
+
+    def _enqueue(self, job: _Job) -> Future:
+        with self._lock:
+            depth = self._pending
+            if depth >= self.max_queue_size:
+                self._rejected += 1
+                raise QueueFullError(depth, self.estimate_retry_after(depth))
+            self._queue.put_nowait(job)
+            self._pending += 1
+            self._submitted += 1
+        return job.future
+
+    @property
+    def queue_depth(self) -> int:
+        """尚未开始执行的任务数（延后到下一轮的任务同样计入）"""
+        return self._pending
+
+    def estimate_retry_after(self, depth: Optional[int] = None) -> int:
+        """根据队列深度和平均推理耗时估算重试等待秒数"""
+        if depth is None:
+            depth = self.queue_depth
+        pending = depth + (1 if self._busy else 0)
+        # 批处理时每批可处理多个请求，按批数估算
+        batches = math.ceil(pending / self.max_batch_size)
+        return max(1, math.ceil(batches * self._avg_service_time))
+
+    def _next_job(self) -> Optional[_Job]:
+        """优先取回延后的任务，否则阻塞等待队列；收到停止信号时返回None"""
+        if self._deferred:
+            return self._deferred.popleft()
+        return self._queue.get()
+
+    def _collect_batch(self, first: _Job) -> tuple:
+        """以first为首在时间窗口内凑批，返回(批次, 是否收到停止信号)"""
+        batch = [first]
+        stop_requested = False
+        deadline = time.monotonic() + self.batch_window
+        skipped: List[_Job] = []
+
+        # 先检查之前延后的任务
+        while self._deferred and len(batch) < self.max_batch_size:
+            job = self._deferred.popleft()
+            if job.batchable and job.batch_key == first.batch_key:
+                batch.append(job)
+            else:
+                skipped.append(job)
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                stop_requested = True
+                break
+            if job.batchable and job.batch_key == first.batch_key:
+                batch.append(job)
+            else:
+                skipped.append(job)
+
+        # 保持原有顺序放回
+        self._deferred.extendleft(reversed(skipped))
+        return batch, stop_requested
+
+    def _worker_loop(self):
+        """工作线程主循环"""
+        stop_requested = False
+        while True:
+            if stop_requested and not self._deferred:
+                break
+            job = self._next_job()
+            if job is None:
+                stop_requested = True
+                continue
+
+            if job.batchable and self.max_batch_size > 1:
+                batch, stop = self._collect_batch(job)
+                stop_requested = stop_requested or stop
+            else:
+                batch = [job]
+            with self._lock:
+                self._pending -= len(batch)
+
+            # 跳过已被取消的任务
+            batch = [j for j in batch if j.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            if batch[0].batchable:
+                self._run_batch(batch)
+            else:
+                self._run_single(batch[0])
+
+    def _run_single(self, job: _Job):
+        started_at = self._mark_started([job])
+        try:
+            result = job.fn(*job.args, **job.kwargs)
+        except BaseException as e:
+            job.future.set_exception(e)
+            self._mark_finished(started_at, 1, succeeded=0)
+        else:
+            job.future.set_result(result)
+            self._mark_finished(started_at, 1, succeeded=1)
+
+    def _run_batch(self, batch: List[_Job]):
+        started_at = self._mark_started(batch)
+        try:
+            results = self.batch_handler([job.payload for job in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"批处理结果数量不匹配: 期望 {len(batch)}，实际 {len(results)}")
+        except BaseException as e:
+            if len(batch) == 1:
+                batch[0].future.set_exception(e)
+                self._mark_finished(started_at, 1, succeeded=0)
+                return
+            # 整批失败（如显存不足）时逐个重试，避免一个样本拖垮整批
+            logger.warning(f"⚠️ 批处理失败，改为逐个处理 {len(batch)} 个请求: {e}")
+            results = []
+            for job in batch:
+                try:
+                    results.append(self.batch_handler([job.payload])[0])
+                except BaseException as item_error:
+                    results.append(item_error)
+
+        succeeded = 0
+        for job, result in zip(batch, results):
+            if isinstance(result, BaseException):
+                job.future.set_exception(result)
+            else:
+                job.future.set_result(result)
+                succeeded += 1
+        self._mark_finished(started_at, len(batch), succeeded)
+
+    def _mark_started(self, batch: List[_Job]) -> float:
+        started_at = time.monotonic()
+        self._busy = True
+        with self._lock:
+            self._batches += 1
+            self._batch_size_histogram[len(batch)] += 1
+            self._started_jobs += len(batch)
+            for job in batch:
+                wait_time = started_at - job.enqueued_at
+                self._wait_times.append(wait_time)
+                self._total_wait_time += wait_time
+        return started_at
+
+    def _mark_finished(self, started_at: float, count: int, succeeded: int):
+        self._busy = False
+        service_time = time.monotonic() - started_at
+        with self._lock:
+            self._completed += succeeded
+            self._failed += count - succeeded
+            self._total_service_time += service_time
+            # 指数加权平均（按批），用于估算Retry-After
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取调度器统计信息"""
+        with self._lock:
+            waits = sorted(self._wait_times)
+            return {
+                "worker_running": self.is_running,
+                "busy": self._busy,
+                "queue_depth": self.queue_depth,
+                "queue_capacity": self.max_queue_size,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "batches": self._batches,
+                "max_batch_size": self.max_batch_size,
+                "batch_window_ms": round(self.batch_window * 1000, 1),
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_size_histogram.items())},
+                "avg_batch_size": round(self._started_jobs / self._batches, 2) if self._batches else 0.0,
+                "avg_service_time": round(self._avg_service_time, 3),
+                "queue_wait": {
+                    "avg": round(self._total_wait_time / self._started_jobs, 4) if self._started_jobs else 0.0,
+                    "p50": round(percentile(waits, 50), 4),
+                    "p95": round(percentile(waits, 95), 4),
+                    "max": round(waits[-1], 4) if waits else 0.0,
+                },
+                "estimated_retry_after": self.estimate_retry_after(),
+            }
@@ -0,0 +1,116 @@
+"""
+InternVL生成辅助函数
+
+复刻InternVLChatModel.chat内部的对话模板拼接与图像token替换逻辑，
+供需要直接驱动language_model的推理路径（连续批处理等）使用。
+"""
+
+import importlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import TextStreamer
+
+IMG_START_TOKEN = '<img>'
+IMG_END_TOKEN = '</img>'
+IMG_CONTEXT_TOKEN = '<IMG_CONTEXT>'
+
+
+def get_conv_template(model):
+    """从模型的remote code模块中获取对话模板"""
+    module = importlib.import_module(type(model).__module__)
+    template = module.get_conv_template(model.template)
+    template.system_message = model.system_message
+    return template
+
+
+def build_query(model, tokenizer, question: str, num_patches_list: List[int]) -> Tuple[str, int, str]:
+    """
+    构建与model.chat一致的输入文本
+
+    Returns:
+        (query, eos_token_id, sep)：sep用于从解码结果中截断回答
+    """
+    if num_patches_list and '<image>' not in question:
+        question = '<image>\n' + question
+
+    template = get_conv_template(model)
+    sep = template.sep.strip()
+    eos_token_id = tokenizer.convert_tokens_to_ids(sep)
+
+    template.append_message(template.roles[0], question)
+    template.append_message(template.roles[1], None)
+    query = template.get_prompt()
+
+    for num_patches in num_patches_list:
+        image_tokens = IMG_START_TOKEN + IMG_CONTEXT_TOKEN * model.num_image_token * num_patches + IMG_END_TOKEN
+        query = query.replace('<image>', image_tokens, 1)
+    return query, eos_token_id, sep
+
+
+def get_img_context_token_id(model, tokenizer) -> int:
+    """获取图像上下文token id（同时设置到模型上，与chat保持一致）"""
+    img_context_token_id = tokenizer.convert_tokens_to_ids(IMG_CONTEXT_TOKEN)
+    model.img_context_token_id = img_context_token_id
+    return img_context_token_id
+
+
+def build_input_embeds(model, input_ids: torch.Tensor, vit_embeds: Optional[torch.Tensor],
+                       img_context_token_id: int) -> torch.Tensor:
+    """将图像特征填入IMG_CONTEXT位置，返回语言模型的输入embedding"""
+    input_embeds = model.language_model.get_input_embeddings()(input_ids)
+    if vit_embeds is None:
+        return input_embeds
+
+    B, N, C = input_embeds.shape
+    input_embeds = input_embeds.reshape(B * N, C)
+    selected = (input_ids.reshape(B * N) == img_context_token_id)
+    if selected.sum() == 0:
+        raise ValueError("输入中没有图像上下文token")
+    input_embeds[selected] = vit_embeds.reshape(-1, C).to(input_embeds.device, input_embeds.dtype)
+    return input_embeds.reshape(B, N, C)
+
+
+def decode_response(tokenizer, token_ids: List[int], sep: str) -> str:
+    """解码生成的token，并按模板分隔符截断"""
+    response = tokenizer.decode(token_ids, skip_special_tokens=True)
+    return response.split(sep)[0].strip()
+
+
+def validate_greedy_config(generation_config: Dict[str, Any]):
+    """直接驱动language_model的路径只支持贪心解码"""
+    if generation_config.get("do_sample"):
+        raise ValueError("该推理路径只支持贪心解码(do_sample=False)")
+    if generation_config.get("num_beams", 1) != 1:
+        raise ValueError("该推理路径不支持beam search")
+
+
+# ==================== KV缓存格式兼容 ====================
+
+def to_legacy_cache(past_key_values) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """将transformers的Cache对象转换为[(key, value), ...]，形状为[B, heads, T, dim]"""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        past_key_values = past_key_values.to_legacy_cache()
+    return [(layer[0], layer[1]) for layer in past_key_values]
+
+
+def from_legacy_cache(legacy: List[Tuple[torch.Tensor, torch.Tensor]]):
+    """将[(key, value), ...]转换为当前transformers版本可接受的缓存对象"""
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return tuple(legacy)
+    return DynamicCache.from_legacy_cache(tuple(legacy))
+
+
+# ==================== 流式输出 ====================
+
+class CallbackTextStreamer(TextStreamer):
+    """把推理线程中生成的文本片段交给回调 on_text(text, stream_end)（供SSE等异步接口消费）"""
+
+    def __init__(self, tokenizer, on_text):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.on_text = on_text
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        self.on_text(text, stream_end)
@@ -6,23 +6,69 @@ InterVL FastAPI服务
 """
 
 import os
-import io
+import gc
+import copy
 import json
+import time
 import torch
 import asyncio
+import shutil
 import logging
+import tempfile
+import functools
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
+from contextlib import contextmanager
 from datetime import datetime
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from transformers import AutoTokenizer, AutoModel
+from fastapi.responses import JSONResponse, StreamingResponse
 from PIL import Image
 import uvicorn
 
+from image_preprocess import load_image
+from inference_scheduler import InferenceScheduler, QueueFullError
+from result_cache import OCRResultCache, make_cache_key
+from pdf_ingest import PageRangeError, parse_page_range, pdf_digest, render_full_gray, render_preview
+from page_hash import PageDeduplicator, describe, fingerprint, same_content
+from preprocess_pipeline import ImageSource, PreprocessPipeline, SharedDocument, SourceDecodeError
+from tile_budget import TILE_PRESETS, plan_tiles, record_dropped_tiles, validate_preset
+from continuous_batching import ContinuousBatchingEngine
+from model_reload import STRATEGIES, ModelGate, ReloadInProgressError, choose_strategy
+from inference_backend import InferenceBackend, create_backend, get_backend_class
+from vision_cache import VisionFeatureCache, tile_hashes
+from roi_crop import UNITS as ROI_UNITS, Region, RegionError, parse_regions, preprocess_regions
+from layout_segment import LayoutSettings, preprocess_layout
+from cancellation import (
+    CANCEL_DEADLINE, CANCEL_DISCONNECTED, CANCEL_REASONS, DEADLINE_HEADER, CancelScope, CancellationStats, RequestCancelled,
+    SharedCancelScope, parse_deadline, watch_disconnect
+)
+from repetition_stopping import (
+    STOP_EOS, STOP_REPETITION, GenerationStoppingCriteria, StopInfo, StopStats, settings_from_config as repetition_settings
+)
+from token_confidence import TokenConfidence, combine_confidence
+from model_router import (
+    PRIORITIES, PRIORITY_AUTO, ModelStats, page_features, route, should_escalate, validate_priority,
+    settings_from_config as router_settings
+)
+from progressive_ocr import (
+    STAGE_DRAFT, STAGE_REFINED, ProgressiveStats, RefinementRegistry, refinement_reason,
+    settings_from_config as progressive_settings
+)
+from page_packing import (
+    PackSettings, PackStats, build_packed_question, fits, packable, split_packed_answer,
+    settings_from_config as pack_settings
+)
+from config import Config
+from transformers import LogitsProcessorList, StoppingCriteriaList
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -46,204 +92,766 @@ app.add_middleware(
 # 全局配置
 CONFIG = {
     "MODEL_PATH": r"E:\test\ocrsystem\models\internvl3-8b",
+    "MODEL_NAME": "internvl3-8b",
     "DEVICE": "cuda" if torch.cuda.is_available() else "cpu",
     "MAX_FILE_SIZE": 500 * 1024 * 1024,  # 500MB (增加文件大小限制)
     "SUPPORTED_FORMATS": [".jpg", ".jpeg", ".png", ".pdf", ".bmp", ".tiff"],
     "DEFAULT_PROMPT": "请详细描述这张图片中的技术内容，包括图表、表格、文字和技术参数，并且不要遗漏任何一个字或者一处内容。",
+    "MAX_NEW_TOKENS": 1024,
+    "WARMUP_MAX_NEW_TOKENS": 8,  # 预热推理生成的token数
+    "MAX_IMAGE_PATCHES": 12,
+    "IMAGE_SIZE": 448,
+    "TILE_PRESET": "balanced",  # 默认分块预设：draft / fast / balanced / accurate（固定12块）
+    "INFERENCE_QUEUE_SIZE": 16,  # 推理队列容量，超出返回429
+    "INITIAL_SERVICE_TIME": 30.0,  # 单页推理耗时初始估计（秒），用于计算Retry-After
+    "MAX_BATCH_SIZE": 4,  # 动态微批处理的最大批大小
+    "BATCH_WINDOW_MS": 30,  # 凑批等待窗口（毫秒）
+    "BATCHING_MODE": "micro",  # micro: 动态微批处理; continuous: token级连续批处理
+    "CONTINUOUS_MAX_SEQUENCES": 8,  # 连续批处理同时解码的最大序列数
+    "RESULT_CACHE_ENABLED": True,  # OCR结果缓存
+    "RESULT_CACHE_MEMORY_ITEMS": 256,
+    "RESULT_CACHE_MEMORY_MB": 64,
+    "RESULT_CACHE_DB_PATH": str(Path(__file__).parent / "data" / "ocr_result_cache.sqlite3"),
+    "RESULT_CACHE_DISK_MB": 1024,
+    "PDF_MIN_ZOOM": 1.0,  # PDF渲染缩放倍数下限（1.0 = 72dpi）
+    "PDF_MAX_ZOOM": 4.0,  # PDF渲染缩放倍数上限
+    "PDF_PAGE_LOOKAHEAD": 4,  # PDF流式处理时同时提交推理的页数（可合并为一批）
+    "PDF_SKIP_BLANK_PAGES": True,  # 跳过空白页
+    "PDF_DEDUP_MAX_DISTANCE": -1,  # 近似重复页的感知哈希汉明距离阈值（64位），-1表示不去重；命中后逐像素确认才复用
+    "PREPROCESS_PROCESSES": 2,  # 预处理进程数（与推理流水线并行），0表示在线程池中预处理
+    "PREPROCESS_WORKERS": min(4, os.cpu_count() or 1),  # 文件读取/PDF解析等辅助线程数
+    "BATCH_MAX_FILES": 100,  # 批量处理单次最多文件数
+    "BATCH_MAX_TOTAL_MB": 1024,  # 批量处理单次上传总大小上限
+    "BATCH_MEMORY_BUDGET_MB": 2048,  # 批量处理同时在途的图片/张量内存预算，决定并发度
+    "BATCH_MAX_CONCURRENCY": 8,  # 批量处理并发度上限
+    "CPU_BF16": "off",  # CPU推理bf16 autocast：off / auto（CPU支持bf16指令时启用）/ on
+    "CPU_INT8_DYNAMIC": False,  # CPU推理时对语言模型的Linear层做动态int8量化
+    "CPU_INTRA_OP_THREADS": 0,  # CPU推理intra-op线程数，0表示torch默认值
+    "CPU_INTER_OP_THREADS": 0,  # CPU推理inter-op线程数，0表示torch默认值
+    "CPU_TORCH_COMPILE": False,  # CPU推理时用torch.compile编译模型
+    "BACKEND": "hf",  # 推理后端：hf（transformers）/ onnx（视觉编码器走ONNX Runtime CPU）/ stub（桩后端）
+    "ONNX_VISION_PATH": "",  # onnx后端的视觉编码器文件，默认 MODEL_PATH/onnx/vision_encoder.onnx
+    "STUB_BASE_LATENCY_MS": 0,  # stub后端模拟的单次生成固定耗时
+    "STUB_PER_SAMPLE_LATENCY_MS": 0,  # stub后端模拟的按样本增量耗时
+    "VISION_CACHE_MB": 512,  # 视觉特征缓存容量（按分块缓存视觉编码器输出），0表示禁用
+    "VISION_CACHE_ON_DEVICE": False,  # 缓存的特征留在推理设备上（省去拷贝，占用显存）
+    "REPETITION_STOP_ENABLED": True,  # 检测到重复循环（反复输出同一行等）时提前停止生成
+    "REPETITION_MIN_NGRAM": 4,  # 重复单元的最短长度（token）
+    "REPETITION_MAX_NGRAM": 128,  # 重复单元的最长长度（token）
+    "REPETITION_MIN_REPEATS": 3,  # 重复单元连续出现的最少次数
+    "REPETITION_MIN_SPAN": 64,  # 判定为循环的重复部分最少token数
+    "DISCONNECT_POLL_INTERVAL": 0.5,  # 检查客户端是否断开的间隔（秒），断开后停止推理
+    "ROI_MAX_REGIONS": 16,  # 区域识别单次最多区域数（全部区域在同一批中生成）
+    "ROI_MAX_TILES": 6,  # 单个区域的分块上限（按区域原始分辨率，小区域更少）
+    "LAYOUT_ANALYSIS_SIZE": 1600,  # 版面预分割所用分析图的最长边（像素），区域数上限同ROI_MAX_REGIONS
+    "PROGRESSIVE_DRAFT_PRESET": "draft",  # 渐进式识别第一遍的分块预设（立即返回初稿）
+    "PROGRESSIVE_REFINE_PRESET": "accurate",  # 渐进式识别细化时的分块预设
+    "PROGRESSIVE_MIN_CONFIDENCE": 0.85,  # 初稿置信度（token概率几何平均）低于该值时细化
+    "PROGRESSIVE_TABLE_ROWS": 8,  # 初稿的Markdown表格行数不少于该值时视为密集表格并细化
+    "PROGRESSIVE_DENSE_EDGE_RATIO": 0.08,  # 页面笔画边缘占比不低于该值时，初稿含任意表格行即视为密集表格并细化
+    "PROGRESSIVE_MAX_JOBS": 256,  # 保留状态以供查询的细化任务数
+    # 模型级联：比主模型小的模型（从小到大），每项 {"name", "path", "backend"（可选）, "options"（可选）}，
+    # 如 {"name": "internvl3-2b", "path": r"E:\test\ocrsystem\models\internvl3-2b"}；为空时只用主模型
+    "CASCADE_MODELS": [],
+    "ROUTER_DEFAULT_PRIORITY": "auto",  # 默认优先级：speed（最小模型）/ auto（按页面路由并升级）/ quality（主模型）
+    "ROUTER_DENSE_EDGE_RATIO": 0.05,  # 笔画边缘占比不低于该值的页面直接交给主模型
+    "ROUTER_MIN_TABLE_LINES": 3,  # 横竖表格线都不少于该数量的页面直接交给主模型
+    "CASCADE_MIN_CONFIDENCE": 0.85,  # 小模型回答置信度低于该值时升级到更大一级
+    "PACK_ENABLED": False,  # /ocr/pdf默认是否把稀疏页面打包为一次多图推理（请求可用pack覆盖）
+    "PACK_PATCH_BUDGET": 13,  # 一次打包推理的分块总数上限
+    "PACK_MAX_PAGE_PATCHES": 6,  # 分块数不超过该值的页面才参与打包
+    "PACK_MAX_PAGES": 4,  # 一次打包推理的最多页数
+    "PACK_MAX_WAIT_MS": 100,  # 第一页到达后等待其余页面的最长时间（毫秒）
+    "PACK_MARKER_TOKENS": 16,  # 每页分节标记额外预留的生成token数
 }
 
-def build_transform(input_size):
-    """构建图片预处理变换"""
-    from torchvision import transforms
-    transform = transforms.Compose([
-        transforms.Lambda(lambda img: img.convert('RGB') if img.mode != 'RGB' else img),
-        transforms.Resize((input_size, input_size), interpolation=transforms.InterpolationMode.BICUBIC),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))
-    ])
-    return transform
-
-def dynamic_preprocess(image, image_size, use_thumbnail=False, max_num=12):
-    """动态预处理图片"""
-    orig_width, orig_height = image.size
-    aspect_ratio = orig_width / orig_height
-
-    # 计算目标尺寸
-    target_ratios = set(
-        (i, j) for n in range(1, max_num + 1) for i in range(1, n + 1) for j in range(1, n + 1) if
-        i * j <= max_num and i * j >= 1
-    )
-    target_ratios = sorted(target_ratios, key=lambda x: x[0] * x[1])
-
-    # 找到最接近的比例
-    target_aspect_ratio = find_closest_aspect_ratio(
-        aspect_ratio, target_ratios, orig_width, orig_height, image_size)
-
-    # 计算目标宽度和高度
-    target_width = image_size * target_aspect_ratio[0]
-    target_height = image_size * target_aspect_ratio[1]
-    blocks = target_aspect_ratio[0] * target_aspect_ratio[1]
-
-    # 调整图片大小并分割
-    resized_img = image.resize((target_width, target_height))
-    processed_images = []
-    for i in range(blocks):
-        box = (
-            (i % (target_width // image_size)) * image_size,
-            (i // (target_width // image_size)) * image_size,
-            ((i % (target_width // image_size)) + 1) * image_size,
-            ((i // (target_width // image_size)) + 1) * image_size
-        )
-        # 分割图片
-        split_img = resized_img.crop(box)
-        processed_images.append(split_img)
-
-    # 如果使用缩略图，添加原图的缩略图
-    if use_thumbnail and len(processed_images) != 1:
-        thumbnail = image.resize((image_size, image_size))
-        processed_images.append(thumbnail)
-
-    return processed_images
-
-def find_closest_aspect_ratio(aspect_ratio, target_ratios, width, height, image_size):
-    """找到最接近的宽高比"""
-    best_ratio_diff = float('inf')
-    best_ratio = (1, 1)
-    area = width * height
-    for ratio in target_ratios:
-        target_aspect_ratio = ratio[0] / ratio[1]
-        ratio_diff = abs(aspect_ratio - target_aspect_ratio)
-        if ratio_diff < best_ratio_diff:
-            best_ratio_diff = ratio_diff
-            best_ratio = ratio
-        elif ratio_diff == best_ratio_diff:
-            if area > 0.5 * image_size * image_size * ratio[0] * ratio[1]:
-                best_ratio = ratio
-    return best_ratio
-
-def load_image(image, input_size=448, max_num=12):
-    """加载和预处理图片"""
-    transform = build_transform(input_size=input_size)
-    images = dynamic_preprocess(image, image_size=input_size, use_thumbnail=True, max_num=max_num)
-    pixel_values = [transform(img) for img in images]
-    pixel_values = torch.stack(pixel_values)
-    return pixel_values
+class OCRRequest:
+    """已完成预处理、等待推理的单个OCR请求"""
+    
+    def __init__(self, pixel_values: torch.Tensor, prompt: str,
+                 generation_config: Dict[str, Any], start_time: datetime):
+        self.pixel_values = pixel_values
+        self.prompt = prompt
+        self.question = f'<image>\n{prompt}'
+        self.generation_config = generation_config
+        self.start_time = start_time
+        self.image_size: Optional[str] = None
+        self.tile_info: Optional[Dict[str, Any]] = None
+        self.tile_keys: Optional[List[str]] = None  # 各分块内容哈希（视觉特征缓存的键）
+        self.cancel_scope: Optional[CancelScope] = None  # 截止时间与客户端断开状态
+        self.model: Optional[str] = None  # 级联路由选中的模型名称，None为主模型
+        self.route: Optional[Dict[str, Any]] = None  # 路由信息（优先级、原因、页面特征）
+    
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_scope is not None and self.cancel_scope.cancelled
+    
+    @property
+    def num_patches(self) -> int:
+        return self.pixel_values.shape[0]
+    
+    @property
+    def batch_key(self) -> str:
+        """模型与生成配置相同的请求才能合并为一批"""
+        return json.dumps(dict(self.generation_config, model=self.model), sort_keys=True)
 
 class InterVLModelManager:
     """InterVL模型管理器"""
     
-    def __init__(self):
-        self.model = None
-        self.tokenizer = None
-        self.model_path = Path(CONFIG["MODEL_PATH"])
-        self.device = CONFIG["DEVICE"]
+    # 冷启动各阶段及其在加载进度中的权重
+    LOAD_PHASES = (("tokenizer", 0.05), ("weights", 0.6), ("device", 0.2), ("warmup", 0.15))
+    
+    def __init__(self, name: Optional[str] = None, model_path: Optional[str] = None,
+                 backend_name: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            name / model_path / backend_name: 模型名称、路径与推理后端，默认取CONFIG中的主模型
+            options: 覆盖传给后端的CONFIG项（如stub后端的模拟耗时）
+        """
+        self.backend: Optional[InferenceBackend] = None
+        self.backend_name = backend_name or CONFIG["BACKEND"]
+        self.options = dict(CONFIG, **(options or {}))
+        self.model_path = Path(model_path or CONFIG["MODEL_PATH"])
+        self.model_version = name or CONFIG["MODEL_NAME"]
         self.is_loaded = False
-        
+        # 加载状态：not_loaded / loading / warming / ready / reloading / failed
+        self.state = "not_loaded"
+        self.load_phase: Optional[str] = None
+        self.load_progress = 0.0
+        self.load_timings: Dict[str, float] = {}
+        self.load_error: Optional[str] = None
+        self.reload_strategy: Optional[str] = None
+        # 冷启动加载与热重载互斥，重载时不等待（已有加载/重载时直接拒绝）
+        self.load_lock = threading.Lock()
+        # 推理在共享区间内访问后端，热重载在独占区间内交换
+        self.gate = ModelGate()
+        # 按分块缓存视觉编码器输出，同一页面换提示词时跳过ViT前向
+        self.feature_cache = VisionFeatureCache(
+            CONFIG["VISION_CACHE_MB"] * 1024 * 1024, self.model_version, CONFIG["VISION_CACHE_ON_DEVICE"])
+        # 重复循环检测参数（None表示不检测）与停止原因统计
+        self.repetition_settings = repetition_settings(CONFIG)
+        self.stop_stats = StopStats()
+        self.cancel_stats = CancellationStats()
+        self.layout_settings = LayoutSettings(analysis_size=CONFIG["LAYOUT_ANALYSIS_SIZE"])
+        self.progressive_settings = progressive_settings(CONFIG)
+        self.pack_settings = pack_settings(CONFIG)
+    
+    @property
+    def model(self):
+        """InternVL模型（供连续批处理引擎直接驱动language_model）"""
+        return self.backend.model if self.backend is not None else None
+    
+    @property
+    def tokenizer(self):
+        return self.backend.tokenizer if self.backend is not None else None
+    
+    @property
+    def device(self) -> str:
+        return self.backend.device if self.backend is not None else CONFIG["DEVICE"]
+    
+    def _enter_phase(self, phase: str):
+        """进入冷启动的某个阶段，更新状态与进度（热重载期间状态保持为reloading）"""
+        self.load_phase = phase
+        if self.state != "reloading":
+            self.state = "warming" if phase == "warmup" else "loading"
+        finished = [name for name, _ in self.LOAD_PHASES if name in self.load_timings]
+        self.load_progress = round(sum(weight for name, weight in self.LOAD_PHASES if name in finished), 2)
+        logger.info(f"⏳ 模型加载阶段: {phase} ({self.load_progress:.0%})")
+    
+    @contextmanager
+    def _phase(self, phase: str):
+        """计时的加载阶段（传给后端的load）"""
+        self._enter_phase(phase)
+        phase_start = time.perf_counter()
+        yield
+        self.load_timings[phase] = time.perf_counter() - phase_start
+    
+    def _load_backend(self) -> InferenceBackend:
+        """创建并加载推理后端，完成预热后返回，不影响当前后端"""
+        backend = create_backend(self.backend_name, self.model_path, CONFIG["DEVICE"], self.options)
+        backend.load(self._phase)
+        if self.feature_cache.enabled and hasattr(backend.model, "extract_feature"):
+            self.feature_cache.install(backend.model)
+        # 预热：触发CUDA内核编译/显存分配，避免第一个真实请求承担这部分延迟
+        with self._phase("warmup"):
+            self.warmup(backend)
+        return backend
+    
+    def _finish_load(self, started: float):
+        self.load_timings["total"] = time.perf_counter() - started
+        self.load_phase = None
+        self.load_progress = 1.0
+        self.state = "ready"
+        self.is_loaded = True
+        timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.load_timings.items())
+        logger.info(f"✅ InterVL模型 {self.model_version} 加载成功（{self.backend.name}后端），耗时: {timings}")
+    
     def load_model(self):
-        """加载InternVL模型"""
+        """加载InternVL模型（权重通过safetensors内存映射读取），完成一次预热推理后才标记为就绪"""
+        with self.load_lock:
+            self._load_model()
+    
+    def _load_model(self):
+        self.is_loaded = False
+        self.load_timings = {}
+        self.load_error = None
+        self.reload_strategy = None
+        started = time.perf_counter()
         try:
-            logger.info(f"开始加载InterVL模型: {self.model_path}")
-            logger.info(f"使用设备: {self.device}")
-            
-            # 检查模型路径
-            if not self.model_path.exists():
-                raise FileNotFoundError(f"模型路径不存在: {self.model_path}")
-            
-            # 加载tokenizer
-            logger.info("加载tokenizer...")
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                str(self.model_path), 
-                trust_remote_code=True
-            )
-            
-            # 加载模型
-            logger.info("加载模型...")
-            if self.device == "cuda":
-                self.model = AutoModel.from_pretrained(
-                    str(self.model_path),
-                    torch_dtype=torch.bfloat16,
-                    low_cpu_mem_usage=True,
-                    use_flash_attn=True,
-                    trust_remote_code=True
-                ).eval().cuda()
-            else:
-                # CPU模式
-                self.model = AutoModel.from_pretrained(
-                    str(self.model_path),
-                    torch_dtype=torch.float32,
-                    low_cpu_mem_usage=True,
-                    trust_remote_code=True
-                ).eval()
-            
-            self.is_loaded = True
-            logger.info("✅ InterVL模型加载成功")
-            
+            self.backend = self._load_backend()
+            self._finish_load(started)
         except Exception as e:
-            logger.error(f"❌ 模型加载失败: {e}")
+            logger.error(f"❌ 模型 {self.model_version} 加载失败: {e}")
             self.is_loaded = False
-            raise e
+            self.state = "failed"
+            self.load_error = str(e)
     
-    def process_image(self, image: Image.Image, prompt: Optional[str] = None) -> Dict[str, Any]:
-        """处理图片，返回OCR结果"""
+    def reload_model(self, strategy: str = "auto") -> str:
+        """
+        热重载模型，返回实际使用的策略
+        
+        double_buffer: 旧模型继续服务，新模型在旁加载并预热，排空进行中的推理后原子交换再释放旧模型
+        pause: 放不下两份模型时，排空后暂停推理，旧模型移出推理设备、加载新模型后恢复；
+               新模型加载失败时旧模型恢复服务
+        模型尚未成功加载时直接冷启动加载
+        
+        Raises:
+            ReloadInProgressError: 已有加载或热重载在进行（不排队等待）
+        """
+        if not self.load_lock.acquire(blocking=False):
+            raise ReloadInProgressError()
+        try:
+            if not self.is_loaded:
+                self._load_model()
+                return "cold"
+            return self._reload_model(strategy)
+        finally:
+            self.load_lock.release()
+    
+    def _reload_model(self, strategy: str) -> str:
+        strategy = choose_strategy(strategy, self.device, self.backend.nbytes())
+        self.state = "reloading"
+        self.reload_strategy = strategy
+        self.load_timings = {}
+        self.load_error = None
+        started = time.perf_counter()
+        logger.info(f"🔄 热重载模型，策略: {strategy}")
+        try:
+            if strategy == "double_buffer":
+                backend = self._load_backend()
+                self._enter_phase("drain")
+                phase_start = time.perf_counter()
+                with self.gate.exclusive():
+                    self.load_timings["drain"] = time.perf_counter() - phase_start
+                    old_backend, self.backend = self.backend, backend
+                    self.feature_cache.clear()
+            else:
+                self._enter_phase("drain")
+                phase_start = time.perf_counter()
+                with self.gate.exclusive():
+                    self.load_timings["drain"] = time.perf_counter() - phase_start
+                    old_backend = self.backend
+                    # CUDA上旧模型移到CPU内存以便失败时恢复；CPU推理时只能先释放
+                    restorable = old_backend.offload()
+                    self._free_memory()
+                    self.feature_cache.clear()
+                    try:
+                        self.backend = self._load_backend()
+                    except Exception:
+                        self._free_memory()
+                        if restorable:
+                            old_backend.restore()
+                            self.backend = old_backend
+                        else:
+                            self.is_loaded = False
+                        raise
+            # 交换完成后旧模型已无推理引用，释放其显存/内存
+            del old_backend
+            self._free_memory()
+            self._finish_load(started)
+        except Exception as e:
+            logger.error(f"❌ 模型热重载失败: {e}")
+            self.load_phase = None
+            self.state = "ready" if self.is_loaded else "failed"
+            self.load_error = str(e)
+            raise
+        # 新权重下旧的识别结果不再可信，清除本模型产生的OCR结果缓存
+        if result_cache is not None:
+            result_cache.purge(self.model_version)
+        return strategy
+    
+    def _free_memory(self):
+        gc.collect()
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+    
+    def warmup(self, backend: Optional[InferenceBackend] = None):
+        """用一张空白图片执行一次简短推理"""
+        backend = backend or self.backend
+        image_size = CONFIG["IMAGE_SIZE"]
+        pixel_values = load_image(Image.new("RGB", (image_size, image_size), "white"), input_size=image_size, max_num=1)
+        backend.generate(
+            backend.prepare_inputs(pixel_values),
+            ["<image>\n请识别图片中的文字。"],
+            [pixel_values.shape[0]],
+            dict(max_new_tokens=CONFIG["WARMUP_MAX_NEW_TOKENS"], do_sample=False)
+        )
+    
+    def get_load_status(self) -> Dict[str, Any]:
+        """加载状态与进度（供/health使用）"""
+        return {
+            "state": self.state,
+            "phase": self.load_phase,
+            "progress": self.load_progress,
+            "timings": {name: round(seconds, 3) for name, seconds in self.load_timings.items()},
+            "error": self.load_error,
+            "reload_strategy": self.reload_strategy
+        }
+    
+    def prepare_request(self, image: Image.Image, prompt: Optional[str] = None,
+                        tile_preset: Optional[str] = None) -> "OCRRequest":
+        """图片预处理，生成待推理的请求（CPU上执行，不占用推理线程）"""
+        start_time = datetime.now()
+        
+        # 按分块预设选择分块数后预处理
+        tile_settings = self.tile_settings(tile_preset)
+        max_num, drop_blank_tiles, tile_info = plan_tiles(
+            image, tile_settings["preset"], tile_settings["image_size"], tile_settings["max_num"])
+        pixel_values = load_image(image, input_size=tile_settings["image_size"], max_num=max_num,
+                                  drop_blank_tiles=drop_blank_tiles)
+        record_dropped_tiles(tile_info, pixel_values.shape[0])
+        return self.build_request(pixel_values, f"{image.width}x{image.height}", prompt, start_time, tile_info,
+                                  tile_hashes(pixel_values))
+    
+    def build_request(self, pixel_values: torch.Tensor, image_size: str, prompt: Optional[str] = None,
+                      start_time: Optional[datetime] = None,
+                      tile_info: Optional[Dict[str, Any]] = None,
+                      tile_keys: Optional[List[str]] = None) -> "OCRRequest":
+        """由已预处理的pixel_values生成待推理的请求"""
+        # 使用默认提示词或自定义提示词
+        if prompt is None:
+            prompt = CONFIG["DEFAULT_PROMPT"]
+        
+        request = OCRRequest(pixel_values, prompt, self.generation_config(prompt), start_time or datetime.now())
+        request.image_size = image_size
+        request.tile_info = tile_info
+        request.tile_keys = tile_keys
+        return request
+    
+    def generation_config(self, prompt: Optional[str] = None) -> Dict[str, Any]:
+        """生成配置：max_new_tokens取提示词类型的token预算（config.py），不超过MAX_NEW_TOKENS"""
+        return dict(max_new_tokens=self.token_budget(prompt), do_sample=False)
+    
+    def token_budget(self, prompt: Optional[str] = None) -> int:
+        """提示词的生成token预算；默认提示词按general，自定义提示词为MAX_NEW_TOKENS"""
+        if prompt is None or prompt == CONFIG["DEFAULT_PROMPT"]:
+            prompt_type = "general"
+        else:
+            prompt_type = Config.get_prompt_type(prompt)
+        if prompt_type is None:
+            return CONFIG["MAX_NEW_TOKENS"]
+        return min(Config.get_token_budget(prompt_type), CONFIG["MAX_NEW_TOKENS"])
+    
+    def stopping_config(self, generation_config: Dict[str, Any], budgets: List[int],
+                        cancel_scopes: Optional[List[Optional[CancelScope]]] = None
+                        ) -> Tuple[Dict[str, Any], GenerationStoppingCriteria]:
+        """
+        为一次生成附加停止条件：检测重复循环，按行执行各自的token预算并检查取消状态；
+        同时附加记录token对数概率的logits_processor（置信度）
+        
+        停止条件记录各行生成的token，生成结束后由finish_generation给出停止原因与置信度
+        """
+        confidence = TokenConfidence(len(budgets))
+        criteria = GenerationStoppingCriteria(
+            self.repetition_settings, len(budgets), budgets, self.backend.stop_token_ids(), cancel_scopes, confidence)
+        return dict(generation_config, stopping_criteria=StoppingCriteriaList([criteria]),
+                    logits_processor=LogitsProcessorList([confidence])), criteria
+    
+    def finish_generation(self, criteria: GenerationStoppingCriteria,
+                          responses: List[str]) -> Tuple[List[str], List[StopInfo]]:
+        """按停止条件截断陷入循环的回答，返回(回答, 停止信息)"""
+        finished = [criteria.finalize(row, response, self.backend.decode_tokens)
+                    for row, response in enumerate(responses)]
+        for _, stop in finished:
+            if stop.stop_reason == STOP_REPETITION:
+                logger.warning(f"⚠️ 检测到重复循环，提前停止生成，节省 {stop.tokens_saved} 个token")
+        return [response for response, _ in finished], [stop for _, stop in finished]
+    
+    def cancelled_error(self, request: "OCRRequest", stop: Optional[StopInfo] = None) -> RequestCancelled:
+        """记录被取消的请求：stop为None表示推理开始前已取消，否则为生成中途停止"""
+        if stop is None:
+            reason = request.cancel_scope.reason
+            self.cancel_stats.record(reason, "queued")
+        else:
+            reason = stop.stop_reason
+            self.stop_stats.record(stop)
+            self.cancel_stats.record(reason, "generating", stop.tokens_saved)
+        logger.info(f"🚫 请求已取消（{reason}），" + ("未推理" if stop is None else f"节省 {stop.tokens_saved} 个token"))
+        return RequestCancelled(reason)
+    
+    def tile_settings(self, tile_preset: Optional[str] = None) -> Dict[str, Any]:
+        """图片分块设置"""
+        return {
+            "image_size": CONFIG["IMAGE_SIZE"],
+            "max_num": CONFIG["MAX_IMAGE_PATCHES"],
+            "preset": tile_preset or CONFIG["TILE_PRESET"]
+        }
+    
+    def cache_key(self, file_content: bytes, prompt: Optional[str] = None,
+                  tile_preset: Optional[str] = None, model_version: Optional[str] = None) -> str:
+        """计算OCR结果缓存键（model_version默认为本模型，级联路由时为各级模型与路由参数的组合）"""
+        return make_cache_key(
+            file_content,
+            prompt if prompt is not None else CONFIG["DEFAULT_PROMPT"],
+            model_version or self.model_version,
+            dict(self.generation_config(prompt), repetition=self.repetition_settings, confidence="token_logprob"),
+            self.tile_settings(tile_preset)
+        )
+    
+    def to_model_input(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """将预处理后的图片张量转换为后端输入（移动到模型所在设备并转换精度）"""
+        return self.backend.prepare_inputs(pixel_values)
+    
+    def generate_batch(self, requests: List["OCRRequest"]) -> Tuple[List[str], List[StopInfo]]:
+        """
+        批量生成：合并多个请求的pixel_values，一次前向推理
+        
+        各请求的分块数保存在num_patches_list中，模型据此把图像特征分配回各自的问题，
+        因此每个请求只会得到自己的回答；返回各请求的回答与停止信息
+        """
         if not self.is_loaded:
             raise RuntimeError("模型未加载")
         
+        # 微批处理中同一批次的请求生成配置相同（由batch_key保证）；区域识别的各行预算
+        # 可以不同，同一批按最大预算生成，停止条件按行执行各自的预算
+        tile_keys = None
+        if all(r.tile_keys is not None for r in requests):
+            tile_keys = [key for r in requests for key in r.tile_keys]
+        budgets = [r.generation_config["max_new_tokens"] for r in requests]
+        with self.gate.shared(), self.feature_cache.tiles(tile_keys):
+            generation_config, criteria = self.stopping_config(
+                dict(requests[0].generation_config, max_new_tokens=max(budgets)), budgets,
+                [r.cancel_scope for r in requests])
+            responses = self.backend.generate(
+                self.to_model_input(torch.cat([r.pixel_values for r in requests], dim=0)),
+                [r.question for r in requests],
+                [r.num_patches for r in requests],
+                generation_config
+            )
+            return self.finish_generation(criteria, responses)
+    
+    def process_batch(self, requests: List["OCRRequest"]) -> List[Any]:
+        """
+        批量处理已预处理的请求，按输入顺序返回OCR结果（供推理调度器调用）
+        
+        排队期间已取消的请求不参与推理，生成中途被取消的请求，其结果位置为RequestCancelled异常
+        """
         try:
-            start_time = datetime.now()
-            
-            # 使用默认提示词或自定义提示词
-            if prompt is None:
-                prompt = CONFIG["DEFAULT_PROMPT"]
-            
-            # 图片预处理
-            pixel_values = load_image(image, max_num=12)
-            pixel_values = pixel_values.to(self.device)
-            if self.device == "cuda":
-                pixel_values = pixel_values.to(torch.bfloat16)
+            results: List[Any] = [None] * len(requests)
+            live = []
+            for index, request in enumerate(requests):
+                if request.cancelled:
+                    results[index] = self.cancelled_error(request)
+                else:
+                    live.append(index)
+            if not live:
+                return results
             
-            # 生成配置
-            generation_config = dict(max_new_tokens=1024, do_sample=False)
-            
-            # 调用模型进行推理
-            question = f'<image>\n{prompt}'
-            
-            with torch.no_grad():
-                response, history = self.model.chat(
-                    self.tokenizer, 
-                    pixel_values, 
-                    question, 
-                    generation_config,
-                    history=None, 
-                    return_history=True
-                )
-            
-            # 计算处理时间
-            processing_time = (datetime.now() - start_time).total_seconds()
-            
-            # 解析结构化内容（简单示例）
+            responses, stops = self.generate_batch([requests[index] for index in live])
+            for index, response, stop in zip(live, responses, stops):
+                if stop.stop_reason in CANCEL_REASONS:
+                    results[index] = self.cancelled_error(requests[index], stop)
+                else:
+                    results[index] = self.build_result(requests[index], response, batch_size=len(live), stop=stop)
+            logger.info(f"✅ 批处理完成，批大小: {len(live)}")
+            return results
+        except Exception as e:
+            logger.error(f"❌ 图片处理失败: {e}")
+            raise e
+    
+    def process_stream(self, request: "OCRRequest", on_text) -> Dict[str, Any]:
+        """单独生成并通过on_text(片段, 是否结束)逐段输出文本（供推理调度器以独占任务调用）"""
+        streaming = False
+        try:
+            if not self.is_loaded:
+                raise RuntimeError("模型未加载")
+            if request.cancelled:
+                raise self.cancelled_error(request)
+            with self.gate.shared(), self.feature_cache.tiles(request.tile_keys):
+                inputs = self.to_model_input(request.pixel_values)
+                generation_config, criteria = self.stopping_config(
+                    request.generation_config, [request.generation_config["max_new_tokens"]], [request.cancel_scope])
+                # 进入后端后由后端负责在生成结束（包括异常）时结束流
+                streaming = True
+                response = self.backend.stream(inputs, request.question, generation_config, on_text)
+                responses, stops = self.finish_generation(criteria, [response])
+        except Exception:
+            if not streaming:
+                on_text("", True)
+            raise
+        if stops[0].stop_reason in CANCEL_REASONS:
+            raise self.cancelled_error(request, stops[0])
+        return self.build_result(request, responses[0], stop=stops[0])
+    
+    def process_multi_prompt(self, request: "OCRRequest", prompt_types: List[str]) -> Dict[str, Any]:
+        """
+        同一张图片按多个提示词类型一次生成（供推理调度器以独占任务调用）
+        
+        视觉编码器只对图片执行一次，各提示词共享图像特征并在同一批中解码
+        """
+        if not self.is_loaded:
+            raise RuntimeError("模型未加载")
+        if request.cancelled:
+            raise self.cancelled_error(request)
+        
+        questions = [f'<image>\n{Config.get_prompt(prompt_type)}' for prompt_type in prompt_types]
+        # 同一批按最大预算生成，停止条件按行执行各提示词类型的预算
+        budgets = [self.token_budget(Config.get_prompt(prompt_type)) for prompt_type in prompt_types]
+        with self.gate.shared(), self.feature_cache.tiles(request.tile_keys):
+            generation_config, criteria = self.stopping_config(
+                dict(request.generation_config, max_new_tokens=max(budgets)), budgets,
+                [request.cancel_scope] * len(prompt_types))
+            responses = self.backend.generate_multi_prompt(
+                self.to_model_input(request.pixel_values), questions, generation_config)
+            responses, stops = self.finish_generation(criteria, responses)
+        cancelled = next((stop for stop in stops if stop.stop_reason in CANCEL_REASONS), None)
+        if cancelled is not None:
+            raise self.cancelled_error(request, StopInfo(
+                cancelled.stop_reason, sum(s.generated_tokens for s in stops), sum(s.tokens_saved for s in stops)))
+        logger.info(f"✅ 多提示词分析完成，提示词: {prompt_types}")
+        return self.build_multi_prompt_result(request, prompt_types, responses, stops)
+    
+    def build_multi_prompt_result(self, request: "OCRRequest", prompt_types: List[str],
+                                  responses: List[str], stops: List[StopInfo]) -> Dict[str, Any]:
+        """
+        合并各提示词的回答：raw_text按类型分节，structured_content合并并标注来源
+        
+        顶层stop_reason为首个非正常结束（非eos）的回答的停止原因，各回答的停止原因见answers
+        """
+        answers = {}
+        merged = {"tables": [], "diagrams": [], "annotations": [], "specifications": []}
+        for prompt_type, response, stop in zip(prompt_types, responses, stops):
+            self.stop_stats.record(stop)
             structured_content = self._parse_structured_content(response)
-            
-            # 构建返回结果
-            result = {
-                "status": "success",
+            answers[prompt_type] = {
+                "prompt": Config.get_prompt(prompt_type),
                 "raw_text": response,
-                "confidence": 0.95,  # InterVL没有直接的置信度输出，这里设置固定值
-                "metadata": {
-                    "model": "internvl3-8b",
-                    "device": self.device,
-                    "prompt": prompt,
-                    "processing_time": processing_time,
-                    "image_patches": pixel_values.shape[0]
-                },
+                "confidence": stop.confidence,
+                "stop_reason": stop.stop_reason,
+                "generated_tokens": stop.generated_tokens,
+                "tokens_saved": stop.tokens_saved,
                 "structured_content": structured_content
             }
-            
-            logger.info(f"✅ 图片处理完成，耗时: {processing_time:.2f}秒")
-            return result
-            
-        except Exception as e:
-            logger.error(f"❌ 图片处理失败: {e}")
-            raise e
+            for key, items in structured_content.items():
+                merged.setdefault(key, []).extend(dict(item, source=prompt_type) for item in items)
+        
+        raw_text = "\n\n".join(f"【{prompt_type}】\n{answers[prompt_type]['raw_text']}" for prompt_type in prompt_types)
+        result = self.build_result(request, raw_text, batch_size=len(prompt_types))
+        result["structured_content"] = merged
+        result["answers"] = answers
+        result["confidence"] = combine_confidence([s.confidence for s in stops], [s.generated_tokens for s in stops])
+        result["stop_reason"] = next((s.stop_reason for s in stops if s.stop_reason != STOP_EOS), STOP_EOS)
+        result["metadata"]["prompt"] = None
+        result["metadata"]["prompt_types"] = prompt_types
+        result["metadata"]["generated_tokens"] = sum(s.generated_tokens for s in stops)
+        result["metadata"]["tokens_saved"] = sum(s.tokens_saved for s in stops)
+        return result
+    
+    def process_regions(self, requests: List["OCRRequest"], regions: List[Region],
+                        page_size: str) -> Dict[str, Any]:
+        """
+        多个区域一次生成（供推理调度器以独占任务调用）
+        
+        各区域已按原始分辨率裁剪并预处理为独立的请求，合并为一批，
+        不与其他请求拼批，也不受MAX_BATCH_SIZE拆分
+        """
+        if not self.is_loaded:
+            raise RuntimeError("模型未加载")
+        if requests[0].cancelled:
+            raise self.cancelled_error(requests[0])
+        
+        responses, stops = self.generate_batch(requests)
+        cancelled = next((stop for stop in stops if stop.stop_reason in CANCEL_REASONS), None)
+        if cancelled is not None:
+            raise self.cancelled_error(requests[0], StopInfo(
+                cancelled.stop_reason, sum(s.generated_tokens for s in stops), sum(s.tokens_saved for s in stops)))
+        logger.info(f"✅ 区域识别完成，区域数: {len(requests)}")
+        return self.build_region_result(requests, regions, page_size, responses, stops)
+    
+    def build_region_result(self, requests: List["OCRRequest"], regions: List[Region], page_size: str,
+                            responses: List[str], stops: List[StopInfo]) -> Dict[str, Any]:
+        """合并各区域的回答：raw_text按区域分节，structured_content合并并以region标注来源（从1开始）"""
+        region_results = []
+        merged = {"tables": [], "diagrams": [], "annotations": [], "specifications": []}
+        for index, (request, region, response, stop) in enumerate(zip(requests, regions, responses, stops), 1):
+            self.stop_stats.record(stop)
+            structured_content = self._parse_structured_content(response)
+            region_results.append({
+                "region": index,
+                "bbox": list(region.bbox),
+                "label": region.label,
+                "prompt_type": Config.get_prompt_type(request.prompt),
+                "raw_text": response,
+                "confidence": stop.confidence,
+                "stop_reason": stop.stop_reason,
+                "generated_tokens": stop.generated_tokens,
+                "tokens_saved": stop.tokens_saved,
+                "image_size": request.image_size,
+                "image_patches": request.num_patches,
+                "tiles": request.tile_info,
+                "structured_content": structured_content
+            })
+            for key, items in structured_content.items():
+                merged.setdefault(key, []).extend(dict(item, region=index) for item in items)
+        
+        raw_text = "\n\n".join(f"【区域{r['region']} {r['prompt_type']}】\n{r['raw_text']}" for r in region_results)
+        result = self.build_result(requests[0], raw_text, batch_size=len(requests))
+        result["structured_content"] = merged
+        result["regions"] = region_results
+        result["confidence"] = combine_confidence([s.confidence for s in stops], [s.generated_tokens for s in stops])
+        result["stop_reason"] = next((s.stop_reason for s in stops if s.stop_reason != STOP_EOS), STOP_EOS)
+        metadata = result["metadata"]
+        metadata["prompt"] = None
+        metadata["image_size"] = page_size
+        metadata["image_patches"] = sum(r.num_patches for r in requests)
+        metadata["tiles"] = None
+        metadata["region_count"] = len(requests)
+        metadata["generated_tokens"] = sum(s.generated_tokens for s in stops)
+        metadata["tokens_saved"] = sum(s.tokens_saved for s in stops)
+        return result
+    
+    @property
+    def supports_packing(self) -> bool:
+        return self.backend is not None and self.backend.supports_packing
+    
+    def process_packed(self, requests: List["OCRRequest"]) -> List[Optional[Dict[str, Any]]]:
+        """
+        多个稀疏页面一次多图生成（供推理调度器以独占任务调用，见page_packing.py）
+        
+        各页提示词相同；按各页预算之和（另加分节标记的预算）生成，任一页的调用方未取消就继续生成。
+        回答按分节标记拆回各页，拆分失败的页面结果为None，由调用方单独重新推理
+        """
+        if not self.is_loaded:
+            raise RuntimeError("模型未加载")
+        cancel_scope = SharedCancelScope()
+        for request in requests:
+            cancel_scope.add(request.cancel_scope)
+        if cancel_scope.cancelled:
+            raise self.cancelled_error(requests[0])
+        
+        budget = sum(r.generation_config["max_new_tokens"] + self.pack_settings.marker_tokens for r in requests)
+        question = build_packed_question(requests[0].prompt, len(requests))
+        tile_keys = None
+        if all(r.tile_keys is not None for r in requests):
+            tile_keys = [key for r in requests for key in r.tile_keys]
+        with self.gate.shared(), self.feature_cache.tiles(tile_keys):
+            generation_config, criteria = self.stopping_config(
+                dict(requests[0].generation_config, max_new_tokens=budget), [budget], [cancel_scope])
+            response = self.backend.generate_packed(
+                self.to_model_input(torch.cat([r.pixel_values for r in requests], dim=0)),
+                question, [r.num_patches for r in requests], generation_config)
+            responses, stops = self.finish_generation(criteria, [response])
+        stop = stops[0]
+        if stop.stop_reason in CANCEL_REASONS:
+            raise self.cancelled_error(requests[0], stop)
+        self.stop_stats.record(stop)
+        
+        # 未正常结束时最后一节可能被截断，拆分时视为失败
+        answers = split_packed_answer(responses[0], len(requests), complete=stop.stop_reason == STOP_EOS)
+        patches = sum(r.num_patches for r in requests)
+        results: List[Optional[Dict[str, Any]]] = []
+        for index, (request, answer) in enumerate(zip(requests, answers), 1):
+            if answer is None:
+                results.append(None)
+                continue
+            result = self.build_result(request, answer, batch_size=len(requests))
+            # 置信度与生成token数是整次打包生成的
+            result["confidence"] = stop.confidence
+            result["stop_reason"] = STOP_EOS
+            result["metadata"]["packed"] = {
+                "pages": len(requests),
+                "index": index,
+                "image_patches": patches,
+                "generated_tokens": stop.generated_tokens
+            }
+            results.append(result)
+        failed = answers.count(None)
+        if failed:
+            logger.warning(f"⚠️ 打包回答有 {failed} 页无法拆分（停止原因: {stop.stop_reason}），将单独重新推理")
+        logger.info(f"📦 打包推理完成，页数: {len(requests)}，分块数: {patches}")
+        return results
+    
+    def build_region_requests(self, regions: List[Region], crops: List[Tuple[torch.Tensor, Dict[str, Any]]],
+                              prompt_type: str = "general", start_time: Optional[datetime] = None,
+                              cancel_scope: Optional[CancelScope] = None) -> List["OCRRequest"]:
+        """由预处理后的各区域生成待推理的请求（未指定提示词类型的区域使用prompt_type）"""
+        requests = []
+        for region, (pixel_values, info) in zip(regions, crops):
+            request = self.build_request(
+                pixel_values, info["image_size"], Config.get_prompt(region.prompt_type or prompt_type),
+                start_time, info["tiles"], info["tile_keys"])
+            request.cancel_scope = cancel_scope
+            requests.append(request)
+        return requests
+    
+    def process_layout(self, image: Image.Image, tile_preset: Optional[str] = None) -> Dict[str, Any]:
+        """
+        版面预分割后只识别文字块、表格与插图区域，按阅读顺序拼接结果
+        
+        与process_image相同在调用线程中同步执行（供基准测试与脚本使用）
+        """
+        if not self.is_loaded:
+            raise RuntimeError("模型未加载")
+        start_time = datetime.now()
+        regions, crops, page_size, _ = preprocess_layout(
+            None, self.tile_settings(tile_preset), CONFIG["ROI_MAX_TILES"], self.layout_settings,
+            CONFIG["ROI_MAX_REGIONS"], image)
+        requests = self.build_region_requests(regions, crops, start_time=start_time)
+        return self.process_regions(requests, regions, page_size)
+    
+    def process_image(self, image: Image.Image, prompt: Optional[str] = None) -> Dict[str, Any]:
+        """处理图片，返回OCR结果"""
+        if not self.is_loaded:
+            raise RuntimeError("模型未加载")
+        
+        request = self.prepare_request(image, prompt)
+        return self.process_batch([request])[0]
+    
+    def build_result(self, request: "OCRRequest", response: str, batch_size: int = 1,
+                     stop: Optional[StopInfo] = None) -> Dict[str, Any]:
+        """构建单个请求的返回结果（stop为生成的停止信息，同时计入停止原因统计）"""
+        # 计算处理时间（含排队等待）
+        processing_time = (datetime.now() - request.start_time).total_seconds()
+        
+        # 解析结构化内容（简单示例）
+        structured_content = self._parse_structured_content(response)
+        
+        # 构建返回结果
+        result = {
+            "status": "success",
+            "raw_text": response,
+            # token概率的几何平均（见token_confidence.py），没有停止信息时未知
+            "confidence": stop.confidence if stop is not None else None,
+            "stop_reason": stop.stop_reason if stop is not None else None,
+            "metadata": {
+                "model": self.model_version,
+                "device": self.device,
+                "prompt": request.prompt,
+                "processing_time": processing_time,
+                "image_patches": request.num_patches,
+                "image_size": request.image_size,
+                "batch_size": batch_size,
+                "tiles": request.tile_info
+            },
+            "structured_content": structured_content
+        }
+        if stop is not None:
+            self.stop_stats.record(stop)
+            result["metadata"]["generated_tokens"] = stop.generated_tokens
+            result["metadata"]["tokens_saved"] = stop.tokens_saved
+        
+        logger.info(f"✅ 图片处理完成，耗时: {processing_time:.2f}秒")
+        return result
     
     def _parse_structured_content(self, text: str) -> Dict[str, List]:
         """简单解析结构化内容"""
@@ -296,20 +904,680 @@ class InterVLModelManager:
                 "specifications": []
             }
 
-# 全局模型管理器实例
+class ModelRegistry:
+    """
+    模型注册表与级联路由（见model_router.py）
+    
+    CASCADE_MODELS中较小的模型与主模型（最大一级）按从小到大组成级联。预处理时提取页面特征，
+    按特征与优先级为每页选择一级模型；回答置信度偏低时复用已预处理的分块交给更大一级重新生成。
+    只有主模型时路由不生效，行为与单模型相同。尚未加载完成的模型不参与路由。
+    """
+    
+    def __init__(self, primary: InterVLModelManager, smaller: List[InterVLModelManager]):
+        self.primary = primary
+        self.tiers = list(smaller) + [primary]
+        self.managers = {manager.model_version: manager for manager in self.tiers}
+        self.settings = router_settings(CONFIG)
+        self.stats = {manager.model_version: ModelStats() for manager in self.tiers}
+    
+    @classmethod
+    def from_config(cls, primary: InterVLModelManager) -> "ModelRegistry":
+        smaller = [
+            InterVLModelManager(spec["name"], spec["path"], spec.get("backend"), spec.get("options"))
+            for spec in CONFIG["CASCADE_MODELS"]
+        ]
+        return cls(primary, smaller)
+    
+    @property
+    def cascade(self) -> bool:
+        return len(self.tiers) > 1
+    
+    def manager(self, name: Optional[str]) -> InterVLModelManager:
+        return self.primary if name is None else self.managers[name]
+    
+    def _available(self) -> List[InterVLModelManager]:
+        return [manager for manager in self.tiers if manager.is_loaded]
+    
+    def load_all(self):
+        """先加载主模型（加载完成即可服务），再依次加载较小的模型"""
+        for manager in [self.primary] + self.tiers[:-1]:
+            manager.load_model()
+            if manager.is_loaded:
+                self.stats[manager.model_version].record_load(manager.load_timings["total"])
+    
+    def version(self, priority: str) -> str:
+        """缓存键中的模型版本：级联生效时为各级模型、路由参数与优先级的组合"""
+        if not self.cascade:
+            return self.primary.model_version
+        return json.dumps({
+            "models": [manager.model_version for manager in self.tiers],
+            "router": self.settings._asdict(),
+            "priority": priority
+        }, sort_keys=True)
+    
+    def cache_key(self, file_content: bytes, prompt: Optional[str] = None,
+                  tile_preset: Optional[str] = None, priority: str = PRIORITY_AUTO) -> str:
+        return self.primary.cache_key(file_content, prompt, tile_preset, self.version(priority))
+    
+    def tile_settings(self, tile_preset: Optional[str] = None) -> Dict[str, Any]:
+        """预处理设置，级联生效时同时提取路由特征"""
+        return dict(self.primary.tile_settings(tile_preset), route=self.cascade)
+    
+    def route(self, request: "OCRRequest", features: Optional[Dict[str, Any]], priority: str):
+        """为请求选择模型（写入request.model与request.route）"""
+        if not self.cascade:
+            return
+        available = self._available()
+        position, reason = route(features, priority, len(available), self.settings)
+        manager = available[position]
+        request.model = manager.model_version
+        request.route = {"priority": priority, "reason": reason, "features": features}
+        self.stats[manager.model_version].record_route(reason)
+    
+    def escalation(self, request: "OCRRequest", result: Dict[str, Any]) -> Optional["OCRRequest"]:
+        """回答置信度偏低时返回交给更大一级模型的请求（复用已预处理的分块），否则返回None"""
+        if request.route is None:
+            return None
+        available = self._available()
+        manager = self.manager(request.model)
+        position = available.index(manager) if manager in available else len(available) - 1
+        if not should_escalate(result.get("confidence"), position, len(available), request.route["priority"],
+                               self.settings):
+            return None
+        self.stats[manager.model_version].record_escalation()
+        target = available[position + 1]
+        escalated = target.build_request(request.pixel_values, request.image_size, request.prompt,
+                                         request.start_time, request.tile_info, request.tile_keys)
+        escalated.cancel_scope = request.cancel_scope
+        escalated.model = target.model_version
+        escalated.route = request.route
+        logger.info(f"⬆️ {manager.model_version} 置信度 {result.get('confidence')} 偏低，升级到 {target.model_version}")
+        return escalated
+    
+    def record_page(self, request: "OCRRequest", seconds: float):
+        self.stats[self.manager(request.model).model_version].record_page(seconds)
+    
+    def process_batch(self, requests: List["OCRRequest"]) -> List[Any]:
+        """交给请求所选模型批量处理（同一批的模型相同，由batch_key保证；供推理调度器调用）"""
+        return self.manager(requests[0].model).process_batch(requests)
+    
+    def process_image(self, image: Image.Image, prompt: Optional[str] = None,
+                      priority: str = PRIORITY_AUTO) -> Dict[str, Any]:
+        """同步处理一张图片：路由、推理并按需升级（不经过推理调度器，供基准测试使用）"""
+        request = self.primary.prepare_request(image, prompt)
+        self.route(request, page_features(image) if self.cascade else None, priority)
+        escalated_from = []
+        while True:
+            started = time.perf_counter()
+            result = self.process_batch([request])[0]
+            if isinstance(result, Exception):
+                raise result
+            self.record_page(request, time.perf_counter() - started)
+            escalated = self.escalation(request, result)
+            if escalated is None:
+                break
+            escalated_from.append({"model": request.model, "confidence": result.get("confidence")})
+            request = escalated
+        return self.annotate(request, result, escalated_from)
+    
+    def annotate(self, request: "OCRRequest", result: Dict[str, Any],
+                 escalated_from: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """在结果中记录路由信息（metadata.routing）"""
+        if request.route is not None:
+            result["metadata"]["routing"] = dict(request.route, escalated_from=escalated_from)
+        return result
+    
+    def describe(self) -> List[Dict[str, Any]]:
+        """各级模型（从小到大）的名称、后端与加载状态"""
+        return [{
+            "name": manager.model_version,
+            "path": str(manager.model_path),
+            "backend": manager.backend_name,
+            "state": manager.state,
+            "loaded": manager.is_loaded
+        } for manager in self.tiers]
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "cascade": self.cascade,
+            "models": {name: dict(stats.get_metrics(), state=self.managers[name].state)
+                       for name, stats in self.stats.items()}
+        }
+
+async def run_preprocess(fn, *args):
+    """在辅助线程池中执行文件读取/PDF解析等CPU任务"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(preprocess_executor, functools.partial(fn, *args))
+
+def resolve_tile_preset(tile_preset: Optional[str]) -> Optional[str]:
+    """校验请求指定的分块预设，无效时返回400"""
+    if tile_preset is None:
+        return None
+    try:
+        return validate_preset(tile_preset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def resolve_priority(priority: Optional[str]) -> Optional[str]:
+    """校验请求指定的模型级联优先级，无效时返回400"""
+    if priority is None:
+        return None
+    try:
+        return validate_priority(priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def request_cancel_scope(http_request: Request) -> CancelScope:
+    """由X-Request-Deadline请求头（Unix时间戳，秒）创建本请求的取消状态，格式无效返回400，已过期返回504"""
+    try:
+        deadline = parse_deadline(http_request.headers.get(DEADLINE_HEADER))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的 {DEADLINE_HEADER}: {http_request.headers.get(DEADLINE_HEADER)}")
+    scope = CancelScope(deadline)
+    if scope.cancelled:
+        raise HTTPException(status_code=504, detail="请求已超过截止时间")
+    return scope
+
+def disconnect_watch(http_request: Request, cancel_scope: CancelScope):
+    """请求处理期间轮询客户端连接，断开时取消推理"""
+    return watch_disconnect(http_request, cancel_scope, CONFIG["DISCONNECT_POLL_INTERVAL"])
+
+def cancelled_http_error(e: RequestCancelled) -> HTTPException:
+    """超过截止时间返回504；客户端已断开时返回499（不会被收到，仅用于日志）"""
+    return HTTPException(status_code=504 if e.reason == CANCEL_DEADLINE else 499, detail=str(e))
+
+async def wait_inference(future, cancel_scope: Optional[CancelScope] = None):
+    """等待推理结果，超过调用方的截止时间时抛出RequestCancelled（推理线程按同一取消状态停止）"""
+    timeout = cancel_scope.remaining() if cancel_scope is not None else None
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        raise RequestCancelled(CANCEL_DEADLINE)
+
+async def prepare_source(source: ImageSource, prompt: Optional[str] = None,
+                         tile_preset: Optional[str] = None,
+                         cancel_scope: Optional[CancelScope] = None,
+                         priority: Optional[str] = None) -> "OCRRequest":
+    """
+    在预处理流水线中解码并预处理图片，生成待推理的请求（附带调用方的取消状态）
+    
+    priority非空时按页面特征与优先级路由到级联中的某一级模型，否则交给主模型
+    """
+    start_time = datetime.now()
+    tile_settings = model_registry.tile_settings(tile_preset) if priority else model_manager.tile_settings(tile_preset)
+    try:
+        pixel_values, info = await preprocess_pipeline.run(source, tile_settings)
+    except SourceDecodeError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"无法打开图片文件: {e}"
+        )
+    request = model_manager.build_request(pixel_values, info["image_size"], prompt, start_time, info["tiles"],
+                                          info["tile_keys"])
+    request.cancel_scope = cancel_scope
+    if priority:
+        model_registry.route(request, info.get("route"), priority)
+    return request
+
+async def run_inference(request: "OCRRequest") -> Dict[str, Any]:
+    """提交到推理队列（可与其他请求合并成批）并等待结果，队列满时返回429"""
+    if request.cancelled:
+        raise model_manager.cancelled_error(request)
+    try:
+        if continuous_engine is not None and request.model in (None, model_manager.model_version):
+            future = continuous_engine.submit(request)
+        else:
+            future = inference_scheduler.submit_batch_item(request, batch_key=request.batch_key)
+    except QueueFullError as e:
+        logger.warning(f"⚠️ {e}，建议 {e.retry_after} 秒后重试")
+        raise HTTPException(
+            status_code=429,
+            detail=f"服务繁忙，推理队列已满，请 {e.retry_after} 秒后重试",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    return await wait_inference(future, request.cancel_scope)
+
+class SingleFlight:
+    """
+    合并并发的相同请求
+    
+    同一键同时只执行一次，重复的调用方等待同一个任务的结果而不是重新入队。
+    任务独立于发起它的请求运行（asyncio.shield），即使第一个调用方断开连接，
+    推理也会继续完成并交付给其余等待者（同时写入结果缓存）。
+    任务的取消状态为各调用方共享（SharedCancelScope）：全部调用方都超时或断开后推理才停止；
+    单个调用方超过自己的截止时间时只有它返回超时。
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[str, tuple] = {}  # key -> (任务, 共享的取消状态)
+        self.executed = 0
+        self.deduplicated = 0
+    
+    async def run(self, key: str, coro_factory, cancel_scope: Optional[CancelScope] = None) -> tuple:
+        """
+        执行或等待键为key的任务
+        
+        Args:
+            coro_factory: 以共享的取消状态为参数，返回执行任务的协程
+            cancel_scope: 本调用方的取消状态
+        
+        Returns:
+            (结果副本, 是否复用了其他请求的任务)
+        
+        Raises:
+            RequestCancelled: 本调用方超过截止时间
+        """
+        task, shared_scope = self._inflight.get(key, (None, None))
+        # 已被全部调用方取消的任务不再复用
+        shared = task is not None and not shared_scope.cancelled
+        if shared:
+            self.deduplicated += 1
+            logger.info(f"🔗 合并重复请求: {key[:16]}")
+        else:
+            self.executed += 1
+            shared_scope = SharedCancelScope()
+            task = asyncio.get_running_loop().create_task(coro_factory(shared_scope))
+            self._inflight[key] = (task, shared_scope)
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        shared_scope.add(cancel_scope)
+        
+        timeout = cancel_scope.remaining() if cancel_scope is not None else None
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            raise RequestCancelled(CANCEL_DEADLINE)
+        # 每个调用方拿到独立副本，避免互相修改metadata/file_info
+        return copy.deepcopy(result), shared
+    
+    def _on_done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key, (None,))[0] is task:
+            self._inflight.pop(key)
+        # 所有调用方都已断开时，避免"Task exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ 请求 {key[:16]} 处理失败: {task.exception()}")
+    
+    def get_metrics(self) -> Dict[str, int]:
+        return {
+            "inflight": len(self._inflight),
+            "executed": self.executed,
+            "deduplicated": self.deduplicated
+        }
+
+async def run_ocr(file_content: bytes, prompt: Optional[str] = None,
+                  tile_preset: Optional[str] = None, cancel_scope: Optional[CancelScope] = None,
+                  priority: Optional[str] = None) -> Dict[str, Any]:
+    """对上传的图片执行OCR"""
+    return await run_cached_ocr(file_content, prompt, ImageSource("image", file_content), tile_preset, cancel_scope,
+                                priority)
+
+async def run_pdf_page_ocr(document: SharedDocument, digest: bytes, page_index: int,
+                           prompt: Optional[str] = None, tile_preset: Optional[str] = None,
+                           cancel_scope: Optional[CancelScope] = None,
+                           priority: Optional[str] = None, infer=None) -> Dict[str, Any]:
+    """在服务端光栅化PDF的一页并执行OCR（缓存键基于PDF摘要与页码）"""
+    key_material, source = pdf_page_source(document, digest, page_index)
+    return await run_cached_ocr(key_material, prompt, source, tile_preset, cancel_scope, priority, infer)
+
+def share_pdf(pdf_bytes: bytes) -> SharedDocument:
+    """把上传的PDF写入共享内存（每个请求一次），各页来源只携带块名称与页码"""
+    return SharedDocument(pdf_bytes, CONFIG["PDF_MIN_ZOOM"], CONFIG["PDF_MAX_ZOOM"])
+
+def pdf_page_source(document: SharedDocument, digest: bytes, page_index: int) -> Tuple[bytes, ImageSource]:
+    """PDF一页的缓存键内容（PDF摘要+页码）与图片来源"""
+    return digest + f":page={page_index}".encode(), document.page(page_index)
+
+async def run_cached_ocr(key_material: bytes, prompt: Optional[str], source: ImageSource,
+                         tile_preset: Optional[str] = None,
+                         cancel_scope: Optional[CancelScope] = None,
+                         priority: Optional[str] = None, infer=None) -> Dict[str, Any]:
+    """
+    OCR主流程：查询结果缓存 -> 合并并发重复请求 -> 加载图片 -> 路由 -> 推理（按需升级） -> 写入缓存
+    
+    Args:
+        key_material: 用于计算缓存键的内容（图片字节或PDF摘要+页码）
+        prompt: 提示词
+        source: 图片来源（图片字节或PDF页面），仅在缓存未命中时送入预处理流水线
+        tile_preset: 分块预设，默认使用CONFIG["TILE_PRESET"]
+        cancel_scope: 调用方的截止时间与断开状态，超时或断开时抛出RequestCancelled
+        priority: 模型级联的优先级 speed / auto / quality，默认CONFIG["ROUTER_DEFAULT_PRIORITY"]
+        infer: 推理单个请求的协程函数，默认run_inference（PDF多页打包时为PagePacker）
+    """
+    priority = priority or CONFIG["ROUTER_DEFAULT_PRIORITY"]
+    cache_key = await run_in_threadpool(model_registry.cache_key, key_material, prompt, tile_preset, priority)
+    if result_cache is not None:
+        cached, tier = await run_in_threadpool(result_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"⚡ 命中OCR结果缓存 ({tier})")
+            cached["metadata"]["cache"] = {"hit": True, "tier": tier, "key": cache_key}
+            return cached
+    
+    result, shared = await single_flight.run(
+        cache_key, lambda scope: _infer_and_cache(cache_key, source, prompt, tile_preset, scope, priority, infer),
+        cancel_scope)
+    result["metadata"]["cache"] = {"hit": False, "key": cache_key}
+    result["metadata"]["deduplicated"] = shared
+    return result
+
+async def _infer_and_cache(cache_key: str, source: ImageSource, prompt: Optional[str],
+                           tile_preset: Optional[str] = None,
+                           cancel_scope: Optional[CancelScope] = None,
+                           priority: str = PRIORITY_AUTO, infer=None) -> Dict[str, Any]:
+    """预处理、推理并写入结果缓存（被取消的请求以RequestCancelled结束，不写入缓存）"""
+    request = await prepare_source(source, prompt, tile_preset, cancel_scope, priority)
+    result = await run_routed_inference(request, infer)
+    if result_cache is not None:
+        await run_in_threadpool(result_cache.put, cache_key, result, result["metadata"]["model"])
+    return result
+
+async def run_routed_inference(request: "OCRRequest", infer=None, escalated_infer=None) -> Dict[str, Any]:
+    """
+    推理并记录所选模型的延迟；回答置信度偏低时交给级联中更大一级的模型重新生成
+    
+    infer为第一次推理所用的协程函数（默认run_inference），升级后的请求单独推理（escalated_infer，默认run_inference）
+    """
+    escalated_from = []
+    infer = infer or run_inference
+    while True:
+        started = time.perf_counter()
+        result = await infer(request)
+        model_registry.record_page(request, time.perf_counter() - started)
+        escalated = model_registry.escalation(request, result)
+        if escalated is None:
+            return model_registry.annotate(request, result, escalated_from)
+        escalated_from.append({"model": request.model, "confidence": result.get("confidence")})
+        request = escalated
+        infer = escalated_infer or run_inference
+
+async def run_progressive_ocr(key_material: bytes, prompt: Optional[str], source: ImageSource,
+                              cancel_scope: Optional[CancelScope] = None,
+                              refine_scope: Optional[CancelScope] = None,
+                              priority: Optional[str] = None,
+                              infer=None) -> Tuple[Dict[str, Any], Optional[asyncio.Task]]:
+    """
+    渐进式OCR：以draft预设识别并立即返回初稿，置信度低或密集表格的页面在后台以高分辨率细化
+    
+    Args:
+        cancel_scope: 调用方的取消状态（只作用于初稿）
+        refine_scope: 细化任务的取消状态，默认不设截止时间（细化独立于本请求运行）
+        priority: 模型级联的优先级（初稿与细化相同）
+        infer: 初稿推理所用的协程函数（见run_cached_ocr），细化单独推理
+    
+    Returns:
+        (结果, 细化任务)；初稿缓存已被细化结果替换或无需细化时细化任务为None，
+        细化任务完成时返回细化结果，失败时返回None
+    """
+    settings = model_manager.progressive_settings
+    result = await run_cached_ocr(key_material, prompt, source, settings.draft_preset, cancel_scope, priority, infer)
+    progressive = result["metadata"].get("progressive")
+    if progressive is not None and progressive["stage"] == STAGE_REFINED:
+        return result, None
+    
+    reason = refinement_reason(result, settings)
+    progressive_stats.record_draft(result.get("confidence"), reason)
+    progressive = {"stage": STAGE_DRAFT, "reason": reason, "refinement_id": None}
+    result["metadata"]["progressive"] = progressive
+    if reason is None:
+        return result, None
+    
+    refinement_id = refinement_registry.create(reason, result.get("confidence"))
+    progressive["refinement_id"] = refinement_id
+    logger.info(f"🔍 初稿需要细化 ({reason}, 置信度 {result.get('confidence')}): {refinement_id}")
+    task = asyncio.get_running_loop().create_task(_refine_progressive(
+        refinement_id, result["metadata"]["cache"]["key"], result, key_material, prompt, source,
+        refine_scope or CancelScope(), priority))
+    refinement_tasks.add(task)
+    task.add_done_callback(refinement_tasks.discard)
+    return result, task
+
+async def _refine_progressive(refinement_id: str, draft_key: str, draft: Dict[str, Any], key_material: bytes,
+                              prompt: Optional[str], source: ImageSource, refine_scope: CancelScope,
+                              priority: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """以高分辨率重新识别，细化结果写入初稿的缓存键（就地替换初稿）"""
+    settings = model_manager.progressive_settings
+    try:
+        result = await run_cached_ocr(key_material, prompt, source, settings.refine_preset, refine_scope, priority)
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.warning(f"⚠️ 细化失败 {refinement_id}: {error}")
+        progressive_stats.record_failed()
+        refinement_registry.fail(refinement_id, error)
+        return None
+    
+    result["metadata"]["progressive"] = {
+        "stage": STAGE_REFINED,
+        "reason": draft["metadata"]["progressive"]["reason"],
+        "refinement_id": refinement_id,
+        "draft_confidence": draft.get("confidence"),
+        "draft_tile_preset": settings.draft_preset
+    }
+    progressive_stats.record_refined(result.get("confidence"))
+    if result_cache is not None:
+        await run_in_threadpool(result_cache.put, draft_key, result, result["metadata"]["model"])
+    refinement_registry.complete(refinement_id, result)
+    logger.info(f"✅ 细化完成 {refinement_id}: 置信度 {draft.get('confidence')} -> {result.get('confidence')}")
+    return result
+
+class PagePacker:
+    """
+    一份PDF内的多页打包（见page_packing.py）
+    
+    分块数不超过PACK_MAX_PAGE_PATCHES的页面完成预处理后进入所选模型的等待组；组内再加一页会超过
+    分块预算或页数上限、第一页已等待PACK_MAX_WAIT_MS、或已没有其他页面会到达时，整组作为一次
+    多图推理提交到推理调度器（独占任务）。分块较多的页面、只有一页的组与拆分失败的页面按普通方式推理。
+    结果仍按页写入结果缓存：打包与微批处理一样只是执行方式，不影响缓存键。
+    """
+    
+    def __init__(self, settings: PackSettings):
+        self.settings = settings
+        self._tickets = itertools.count()
+        self._waiting = set()  # 已调度、尚未到达推理的页面的票据
+        self._groups: Dict[Optional[str], List[Tuple["OCRRequest", asyncio.Future]]] = {}  # 模型 -> 等待组
+        self._timers: Dict[Optional[str], asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self._closed = False
+    
+    def expect(self) -> int:
+        """调度一页时登记，返回该页的票据"""
+        ticket = next(self._tickets)
+        self._waiting.add(ticket)
+        return ticket
+    
+    def release(self, ticket: int):
+        """页面处理结束时注销（命中缓存、合并到其他请求或出错的页面不会到达推理）"""
+        self._waiting.discard(ticket)
+        self._flush_idle()
+    
+    def close(self):
+        """全部页面都已调度"""
+        self._closed = True
+        self._flush_idle()
+    
+    def bind(self, ticket: int):
+        """某一页的推理函数（run_cached_ocr的infer参数）"""
+        return functools.partial(self.infer, ticket=ticket)
+    
+    async def infer(self, request: "OCRRequest", ticket: int) -> Dict[str, Any]:
+        """推理一页：可打包的页面进入等待组并等待整组的结果，其余页面直接提交推理"""
+        self._waiting.discard(ticket)
+        if not (model_registry.manager(request.model).supports_packing
+                and packable(request.num_patches, self.settings)):
+            pack_stats.record_unpacked(dense=True)
+            self._flush_idle()
+            return await run_inference(request)
+        
+        group = self._groups.get(request.model, [])
+        if group and not fits(sum(r.num_patches for r, _ in group), len(group), request.num_patches, self.settings):
+            self._flush(request.model)
+        group = self._groups.setdefault(request.model, [])
+        future = asyncio.get_running_loop().create_future()
+        group.append((request, future))
+        if len(group) == 1:
+            self._timers[request.model] = asyncio.get_running_loop().call_later(
+                self.settings.max_wait_ms / 1000, self._flush, request.model)
+        if not fits(sum(r.num_patches for r, _ in group), len(group), 1, self.settings):
+            self._flush(request.model)
+        else:
+            self._flush_idle()
+        return await future
+    
+    def _flush_idle(self):
+        # 全部页面都已调度且都已到达（或已结束）时不再等待
+        if self._closed and not self._waiting:
+            for model in list(self._groups):
+                self._flush(model)
+    
+    def _flush(self, model: Optional[str]):
+        group = self._groups.pop(model, None)
+        timer = self._timers.pop(model, None)
+        if timer is not None:
+            timer.cancel()
+        if group:
+            task = asyncio.ensure_future(self._run_group(group))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run_group(self, group: List[Tuple["OCRRequest", asyncio.Future]]):
+        # 等待期间调用方已放弃的页面不再推理
+        group = [(request, future) for request, future in group if not future.done()]
+        if len(group) == 1:
+            pack_stats.record_unpacked(dense=False)
+        if len(group) <= 1:
+            await asyncio.gather(*[self._deliver(future, run_inference(request)) for request, future in group])
+            return
+        
+        requests = [request for request, _ in group]
+        process_packed = preprocess_pipeline.metrics.track(
+            "generate", model_registry.manager(requests[0].model).process_packed)
+        try:
+            try:
+                future = inference_scheduler.submit(process_packed, requests)
+            except QueueFullError as e:
+                logger.warning(f"⚠️ {e}，建议 {e.retry_after} 秒后重试")
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"服务繁忙，推理队列已满，请 {e.retry_after} 秒后重试",
+                    headers={"Retry-After": str(e.retry_after)}
+                )
+            results = await wait_inference(future)
+        except Exception as e:
+            for _, page_future in group:
+                if not page_future.done():
+                    page_future.set_exception(e)
+            return
+        
+        pack_stats.record_pack(len(requests), sum(r.num_patches for r in requests))
+        pack_stats.record_split_failures(results.count(None))
+        retries = []
+        for (request, page_future), result in zip(group, results):
+            if page_future.done():
+                continue
+            if result is None:
+                retries.append(self._deliver(page_future, run_inference(request)))
+            else:
+                page_future.set_result(result)
+        await asyncio.gather(*retries)
+    
+    @staticmethod
+    async def _deliver(future: asyncio.Future, coro):
+        try:
+            result = await coro
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+# 全局模型管理器实例（主模型）与模型级联注册表
 model_manager = InterVLModelManager()
+model_registry = ModelRegistry.from_config(model_manager)
+
+# 文件读取/PDF解析等辅助线程池（预处理进程池未启用时也用于图片预处理）
+preprocess_executor = ThreadPoolExecutor(
+    max_workers=CONFIG["PREPROCESS_WORKERS"],
+    thread_name_prefix="preprocess"
+)
+
+# 预处理流水线（进程池解码/分块，经共享内存交付，与推理重叠执行）
+preprocess_pipeline = PreprocessPipeline(
+    processes=CONFIG["PREPROCESS_PROCESSES"],
+    max_patches=CONFIG["MAX_IMAGE_PATCHES"] + 1,  # 含缩略图
+    image_size=CONFIG["IMAGE_SIZE"],
+    thread_executor=preprocess_executor,
+    pin_memory=CONFIG["DEVICE"] == "cuda"
+)
+
+# 并发重复请求合并
+single_flight = SingleFlight()
+
+# 渐进式识别的细化任务（保留引用直到完成）与可查询的细化状态
+refinement_tasks = set()
+refinement_registry = RefinementRegistry(CONFIG["PROGRESSIVE_MAX_JOBS"])
+progressive_stats = ProgressiveStats()
+
+# 多页打包统计
+pack_stats = PackStats()
+
+# 全局OCR结果缓存（内存LRU + 磁盘SQLite），在启动事件中创建，导入本模块不会打开磁盘缓存文件
+result_cache: Optional[OCRResultCache] = None
+
+def create_result_cache() -> Optional[OCRResultCache]:
+    """按CONFIG创建OCR结果缓存，未启用时返回None"""
+    if not CONFIG["RESULT_CACHE_ENABLED"]:
+        return None
+    return OCRResultCache(
+        memory_max_entries=CONFIG["RESULT_CACHE_MEMORY_ITEMS"],
+        memory_max_bytes=CONFIG["RESULT_CACHE_MEMORY_MB"] * 1024 * 1024,
+        disk_path=CONFIG["RESULT_CACHE_DB_PATH"],
+        disk_max_bytes=CONFIG["RESULT_CACHE_DISK_MB"] * 1024 * 1024
+    )
+
+# 全局推理调度器（专用推理线程 + 动态微批处理，避免阻塞事件循环）
+inference_scheduler = InferenceScheduler(
+    max_queue_size=CONFIG["INFERENCE_QUEUE_SIZE"],
+    initial_service_time=CONFIG["INITIAL_SERVICE_TIME"],
+    batch_handler=preprocess_pipeline.metrics.track("generate", model_registry.process_batch),
+    max_batch_size=CONFIG["MAX_BATCH_SIZE"],
+    batch_window_ms=CONFIG["BATCH_WINDOW_MS"]
+)
+
+# 连续批处理引擎（BATCHING_MODE为continuous时替代微批处理；stub后端不提供language_model，仍用微批处理）
+continuous_engine = ContinuousBatchingEngine(
+    model_manager,
+    max_batch_size=CONFIG["CONTINUOUS_MAX_SEQUENCES"],
+    max_queue_size=CONFIG["INFERENCE_QUEUE_SIZE"],
+    initial_service_time=CONFIG["INITIAL_SERVICE_TIME"]
+) if CONFIG["BATCHING_MODE"] == "continuous" and get_backend_class(CONFIG["BACKEND"]).supports_continuous_batching else None
+
+# 后台模型加载任务
+model_load_future: Optional[asyncio.Future] = None
 
 @app.on_event("startup")
 async def startup_event():
-    """应用启动时加载模型"""
+    """应用启动时在后台加载模型，端口立即开放，/health 报告加载进度"""
+    global model_load_future, result_cache
     try:
         logger.info("🚀 启动InterVL OCR服务...")
-        model_manager.load_model()
-        logger.info("🎉 服务启动完成")
+        result_cache = create_result_cache()
+        preprocess_pipeline.start()
+        inference_scheduler.start()
+        if continuous_engine is not None:
+            continuous_engine.start()
+        model_load_future = asyncio.get_running_loop().run_in_executor(None, model_registry.load_all)
+        logger.info("🎉 服务启动完成，模型在后台加载")
     except Exception as e:
         logger.error(f"❌ 服务启动失败: {e}")
         # 可以选择继续启动但标记为不可用状态
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止推理线程"""
+    inference_scheduler.stop()
+    if continuous_engine is not None:
+        continuous_engine.stop()
+    preprocess_pipeline.stop()
+    preprocess_executor.shutdown(wait=False)
+
 @app.get("/")
 async def root():
     """根路径 - 服务信息"""
@@ -317,19 +1585,26 @@ async def root():
         "service": "InterVL OCR Service",
         "version": "1.0.0",
         "model": "internvl3-8b",
-        "status": "ready" if model_manager.is_loaded else "loading",
+        "status": model_manager.state,
         "device": CONFIG["DEVICE"],
         "timestamp": datetime.now().isoformat()
     }
 
 @app.get("/health")
 async def health_check():
-    """健康检查接口"""
+    """
+    健康检查接口
+    
+    state: loading（加载tokenizer/权重/移动到设备）/ warming（预热推理）/ ready /
+    reloading（热重载中，旧模型继续服务）/ failed，
+    progress为0~1的加载进度，timings为已完成各阶段的冷启动耗时（秒）
+    """
     return {
         "status": "healthy" if model_manager.is_loaded else "unhealthy",
         "service": "InterVL OCR",
         "model": "internvl3-8b",
         "model_loaded": model_manager.is_loaded,
+        **model_manager.get_load_status(),
         "device": CONFIG["DEVICE"],
         "gpu_available": torch.cuda.is_available(),
         "timestamp": datetime.now().isoformat()
@@ -337,8 +1612,13 @@ async def health_check():
 
 @app.post("/ocr/process")
 async def process_document(
+    http_request: Request,
     file: UploadFile = File(...),
-    prompt: Optional[str] = None
+    prompt: Optional[str] = Form(None),
+    page: int = Form(1),
+    tile_preset: Optional[str] = Form(None),
+    progressive: bool = Form(False),
+    priority: Optional[str] = Form(None)
 ):
     """
     处理上传的文档/图片，进行OCR识别
@@ -346,6 +1626,13 @@ async def process_document(
     参数:
     - file: 上传的文件（图片或PDF）
     - prompt: 可选的自定义提示词
+    - page: PDF文件的页码（从1开始），多页处理请使用 /ocr/pdf
+    - tile_preset: 分块预设 draft / fast / balanced / accurate，默认balanced
+    - progressive: 渐进式识别（忽略tile_preset）：以draft预设快速返回初稿，需要时在后台高分辨率细化，
+      metadata.progressive.refinement_id 可通过 /ocr/refinements/{refinement_id} 查询细化结果
+    - priority: 模型级联的优先级 speed / auto / quality，默认CONFIG["ROUTER_DEFAULT_PRIORITY"]
+      （配置了CASCADE_MODELS时生效，metadata.routing给出所选模型、路由原因与升级记录）
+    - X-Request-Deadline请求头: 可选的截止时间（Unix时间戳，秒），超过时停止推理并返回504
     
     返回:
     - OCR识别结果，包含文本、结构化内容等
@@ -358,6 +1645,10 @@ async def process_document(
                 detail="模型未加载，请稍后重试"
             )
         
+        tile_preset = resolve_tile_preset(tile_preset)
+        priority = resolve_priority(priority)
+        cancel_scope = request_cancel_scope(http_request)
+        
         # 验证文件大小
         if file.size and file.size > CONFIG["MAX_FILE_SIZE"]:
             raise HTTPException(
@@ -376,24 +1667,31 @@ async def process_document(
         # 读取文件内容
         file_content = await file.read()
         
-        # 转换为PIL图片
-        try:
-            image = Image.open(io.BytesIO(file_content))
-            # 转换为RGB模式（如果不是的话）
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"无法打开图片文件: {e}"
-            )
-        
         # 记录处理开始
         start_time = datetime.now()
         logger.info(f"开始处理文件: {file.filename}")
         
-        # 调用模型处理
-        result = model_manager.process_image(image, prompt)
+        # 查询缓存或提交到推理线程处理（客户端断开或超过截止时间时停止推理）
+        async with disconnect_watch(http_request, cancel_scope):
+            if file_ext == ".pdf":
+                document = share_pdf(file_content)
+                total_pages = await run_in_threadpool(document.page_count)
+                if page < 1 or page > total_pages:
+                    raise HTTPException(status_code=400, detail=f"页码 {page} 超出范围，PDF共 {total_pages} 页")
+                digest = await run_in_threadpool(pdf_digest, file_content)
+                if progressive:
+                    key_material, source = pdf_page_source(document, digest, page - 1)
+                    result, _ = await run_progressive_ocr(key_material, prompt, source, cancel_scope, priority=priority)
+                else:
+                    result = await run_pdf_page_ocr(document, digest, page - 1, prompt, tile_preset, cancel_scope,
+                                                    priority)
+                result["metadata"]["page"] = page
+                result["metadata"]["total_pages"] = total_pages
+            elif progressive:
+                result, _ = await run_progressive_ocr(file_content, prompt, ImageSource("image", file_content),
+                                                      cancel_scope, priority=priority)
+            else:
+                result = await run_ocr(file_content, prompt, tile_preset, cancel_scope, priority)
         
         # 计算处理时间
         processing_time = (datetime.now() - start_time).total_seconds()
@@ -404,7 +1702,7 @@ async def process_document(
             "filename": file.filename,
             "size": file.size,
             "format": file_ext,
-            "image_size": f"{image.width}x{image.height}"
+            "image_size": result["metadata"].get("image_size")
         }
         
         logger.info(f"✅ 文件处理完成: {file.filename}, 耗时: {processing_time:.2f}秒")
@@ -413,59 +1711,940 @@ async def process_document(
         
     except HTTPException:
         raise
+    except RequestCancelled as e:
+        logger.info(f"🚫 文档处理已取消: {file.filename}, {e}")
+        raise cancelled_http_error(e)
     except Exception as e:
         logger.error(f"❌ 处理文档时出错: {e}")
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
-@app.post("/ocr/batch")
-async def batch_process_documents(
-    files: List[UploadFile] = File(...),
-    prompt: Optional[str] = None
+@app.get("/ocr/refinements/{refinement_id}")
+async def get_refinement(refinement_id: str):
+    """
+    查询渐进式识别的细化结果
+    
+    返回:
+    - status: pending（排队/识别中）/ done（result为细化结果，字段同/ocr/process）/ failed（error为原因）
+    - reason: 细化原因 low_confidence / dense_table；draft_confidence: 初稿置信度
+    """
+    job = refinement_registry.get(refinement_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"细化任务不存在或已过期: {refinement_id}")
+    return JSONResponse(content=job)
+
+@app.post("/ocr/analyze")
+async def analyze_document(
+    http_request: Request,
+    file: UploadFile = File(...),
+    prompt_types: str = Form(",".join(Config.ENGINEERING_PROMPTS)),
+    page: int = Form(1),
+    tile_preset: Optional[str] = Form(None),
+    priority: Optional[str] = Form(None)
 ):
     """
-    批量处理多个文档
+    多提示词分析：同一张图片按多个工程提示词类型一次性识别
+    
+    图片只预处理、视觉编码一次，各提示词在同一批中生成，代替对同一文件多次调用 /ocr/process
+    
+    参数:
+    - file: 上传的文件（图片或PDF）
+    - prompt_types: 逗号分隔的提示词类型（general / table / diagram / specification），默认全部
+    - page: PDF文件的页码（从1开始）
+    - tile_preset: 分块预设 fast / balanced / accurate，默认balanced
+    - priority: 模型级联的优先级 speed / auto / quality，同/ocr/process（合并置信度偏低时整组提示词交给更大一级模型）
+    - X-Request-Deadline请求头: 可选的截止时间（Unix时间戳，秒）
+    
+    返回:
+    - answers: 各提示词类型的回答与结构化内容
+    - raw_text: 按类型分节合并的文本；structured_content: 合并后的结构化内容（source标注来源）
     """
+    if not model_manager.is_loaded:
+        raise HTTPException(status_code=503, detail="模型未加载，请稍后重试")
+    
+    types = [t.strip() for t in prompt_types.split(",") if t.strip()]
+    types = list(dict.fromkeys(types))
+    unknown = [t for t in types if t not in Config.ENGINEERING_PROMPTS]
+    if not types or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"无效的提示词类型: {unknown or prompt_types}，支持: {list(Config.ENGINEERING_PROMPTS)}"
+        )
+    tile_preset = resolve_tile_preset(tile_preset)
+    priority = resolve_priority(priority) or CONFIG["ROUTER_DEFAULT_PRIORITY"]
+    cancel_scope = request_cancel_scope(http_request)
+    
+    if file.size and file.size > CONFIG["MAX_FILE_SIZE"]:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件过大，最大支持 {CONFIG['MAX_FILE_SIZE'] // (1024*1024)}MB"
+        )
+    file_ext = Path(file.filename).suffix.lower()
+    if file_ext not in CONFIG["SUPPORTED_FORMATS"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的文件格式: {file_ext}，支持: {CONFIG['SUPPORTED_FORMATS']}"
+        )
+    
+    async def infer_multi_prompt(request: "OCRRequest") -> Dict[str, Any]:
+        """交给请求所选模型，以独占任务一次生成全部提示词"""
+        manager = model_registry.manager(request.model)
+        process_multi_prompt = preprocess_pipeline.metrics.track("generate", manager.process_multi_prompt)
+        try:
+            future = inference_scheduler.submit(process_multi_prompt, request, types)
+        except QueueFullError as e:
+            raise HTTPException(
+                status_code=429,
+                detail=f"服务繁忙，推理队列已满，请 {e.retry_after} 秒后重试",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        return await wait_inference(future, cancel_scope)
+    
     try:
-        if not model_manager.is_loaded:
-            raise HTTPException(status_code=503, detail="模型未加载")
+        file_content = await file.read()
+        start_time = datetime.now()
+        logger.info(f"开始多提示词分析: {file.filename}, 提示词: {types}")
         
-        if len(files) > 10:  # 限制批量处理数量
-            raise HTTPException(status_code=400, detail="批量处理最多支持10个文件")
+        total_pages = None
+        if file_ext == ".pdf":
+            document = share_pdf(file_content)
+            total_pages = await run_in_threadpool(document.page_count)
+            if page < 1 or page > total_pages:
+                raise HTTPException(status_code=400, detail=f"页码 {page} 超出范围，PDF共 {total_pages} 页")
+            source = document.page(page - 1)
+        else:
+            source = ImageSource("image", file_content)
         
-        results = []
-        for file in files:
+        async with disconnect_watch(http_request, cancel_scope):
+            request = await prepare_source(source, None, tile_preset, cancel_scope, priority)
+            result = await run_routed_inference(request, infer_multi_prompt, infer_multi_prompt)
+        if total_pages is not None:
+            result["metadata"]["page"] = page
+            result["metadata"]["total_pages"] = total_pages
+        
+        processing_time = (datetime.now() - start_time).total_seconds()
+        result["metadata"]["total_processing_time"] = processing_time
+        result["file_info"] = {
+            "filename": file.filename,
+            "size": file.size,
+            "format": file_ext,
+            "image_size": result["metadata"].get("image_size")
+        }
+        logger.info(f"✅ 多提示词分析完成: {file.filename}, 耗时: {processing_time:.2f}秒")
+        return JSONResponse(content=result)
+    
+    except HTTPException:
+        raise
+    except RequestCancelled as e:
+        logger.info(f"🚫 多提示词分析已取消: {file.filename}, {e}")
+        raise cancelled_http_error(e)
+    except Exception as e:
+        logger.error(f"❌ 多提示词分析出错: {e}")
+        raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+
+@app.post("/ocr/regions")
+async def process_regions(
+    http_request: Request,
+    file: UploadFile = File(...),
+    regions: str = Form(...),
+    prompt_type: str = Form("general"),
+    units: str = Form("ratio"),
+    page: int = Form(1),
+    tile_preset: Optional[str] = Form(None)
+):
+    """
+    区域识别：只识别图纸中指定的若干区域（标题栏、某张表格等）
+    
+    各区域从原始分辨率的来源中裁剪，按区域尺寸选择分块数（不超过ROI_MAX_TILES），
+    全部区域合并为一次批量生成，比整页12分块识别少得多的视觉token
+    
+    参数:
+    - file: 上传的文件（图片或PDF）
+    - regions: JSON列表，如 [{"bbox": [0.7, 0.85, 1.0, 1.0], "prompt_type": "table"}, [0, 0, 0.5, 0.3]]
+    - prompt_type: 未单独指定提示词类型的区域使用的类型，默认general
+    - units: 边界框坐标单位 ratio（相对页面宽高，0~1）/ pixel（图片像素，PDF为pt）
+    - page: PDF文件的页码（从1开始）
+    - tile_preset: 分块预设 fast / balanced / accurate，在区域分块上限内按内容密度自适应
+    - X-Request-Deadline请求头: 可选的截止时间（Unix时间戳，秒）
+    
+    返回:
+    - regions: 各区域的回答、停止原因、裁剪尺寸与分块信息
+    - raw_text: 按区域分节合并的文本；structured_content: 合并后的结构化内容（region标注来源）
+    """
+    if not model_manager.is_loaded:
+        raise HTTPException(status_code=503, detail="模型未加载，请稍后重试")
+    
+    if prompt_type not in Config.ENGINEERING_PROMPTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"无效的提示词类型: {prompt_type}，支持: {list(Config.ENGINEERING_PROMPTS)}"
+        )
+    if units not in ROI_UNITS:
+        raise HTTPException(status_code=400, detail=f"无效的坐标单位: {units}，支持: {list(ROI_UNITS)}")
+    try:
+        region_list = parse_regions(regions, list(Config.ENGINEERING_PROMPTS), CONFIG["ROI_MAX_REGIONS"])
+    except RegionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    tile_preset = resolve_tile_preset(tile_preset)
+    cancel_scope = request_cancel_scope(http_request)
+    
+    if file.size and file.size > CONFIG["MAX_FILE_SIZE"]:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件过大，最大支持 {CONFIG['MAX_FILE_SIZE'] // (1024*1024)}MB"
+        )
+    file_ext = Path(file.filename).suffix.lower()
+    if file_ext not in CONFIG["SUPPORTED_FORMATS"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的文件格式: {file_ext}，支持: {CONFIG['SUPPORTED_FORMATS']}"
+        )
+    
+    try:
+        file_content = await file.read()
+        start_time = datetime.now()
+        logger.info(f"开始区域识别: {file.filename}, 区域数: {len(region_list)}")
+        
+        total_pages = None
+        if file_ext == ".pdf":
+            document = share_pdf(file_content)
+            total_pages = await run_in_threadpool(document.page_count)
+            if page < 1 or page > total_pages:
+                raise HTTPException(status_code=400, detail=f"页码 {page} 超出范围，PDF共 {total_pages} 页")
+            source = document.page(page - 1)
+        else:
+            source = ImageSource("image", file_content)
+        
+        # 裁剪与分块在辅助线程中执行（需要原始分辨率的整页，不经过预处理进程的固定大小槽位）
+        with preprocess_pipeline.metrics.stage("preprocess"):
             try:
-                # 重用单文件处理逻辑
-                file_content = await file.read()
-                image = Image.open(io.BytesIO(file_content))
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                result = model_manager.process_image(image, prompt)
-                result["file_info"] = {
-                    "filename": file.filename,
-                    "size": file.size
-                }
-                results.append(result)
-                
-            except Exception as e:
-                results.append({
-                    "status": "error",
-                    "filename": file.filename,
-                    "error": str(e)
-                })
+                crops, page_size, timings = await run_preprocess(
+                    preprocess_regions, source, region_list, units,
+                    model_manager.tile_settings(tile_preset), CONFIG["ROI_MAX_TILES"])
+            except RegionError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except SourceDecodeError as e:
+                raise HTTPException(status_code=400, detail=f"无法打开图片文件: {e}")
+        preprocess_pipeline.metrics.add_step_time(timings)
+        
+        requests = model_manager.build_region_requests(region_list, crops, prompt_type, start_time, cancel_scope)
+        
+        async with disconnect_watch(http_request, cancel_scope):
+            process = preprocess_pipeline.metrics.track("generate", model_manager.process_regions)
+            try:
+                future = inference_scheduler.submit(process, requests, region_list, page_size)
+            except QueueFullError as e:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"服务繁忙，推理队列已满，请 {e.retry_after} 秒后重试",
+                    headers={"Retry-After": str(e.retry_after)}
+                )
+            result = await wait_inference(future, cancel_scope)
+        result["metadata"]["units"] = units
+        if total_pages is not None:
+            result["metadata"]["page"] = page
+            result["metadata"]["total_pages"] = total_pages
+        
+        processing_time = (datetime.now() - start_time).total_seconds()
+        result["metadata"]["total_processing_time"] = processing_time
+        result["file_info"] = {
+            "filename": file.filename,
+            "size": file.size,
+            "format": file_ext,
+            "image_size": page_size
+        }
+        logger.info(f"✅ 区域识别完成: {file.filename}, 分块数: {result['metadata']['image_patches']}, "
+                    f"耗时: {processing_time:.2f}秒")
+        return JSONResponse(content=result)
+    
+    except HTTPException:
+        raise
+    except RequestCancelled as e:
+        logger.info(f"🚫 区域识别已取消: {file.filename}, {e}")
+        raise cancelled_http_error(e)
+    except Exception as e:
+        logger.error(f"❌ 区域识别出错: {e}")
+        raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+
+@app.post("/ocr/layout")
+async def process_layout(
+    http_request: Request,
+    file: UploadFile = File(...),
+    page: int = Form(1),
+    tile_preset: Optional[str] = Form(None)
+):
+    """
+    版面预分割识别：先用OpenCV找出文字块、表格与插图，只把这些区域交给模型
+    
+    各区域按类别使用对应的工程提示词（文字 general / 表格 table / 插图 diagram），
+    按原始分辨率裁剪后合并为一次批量生成，结果按阅读顺序拼接
+    
+    参数:
+    - file: 上传的文件（图片或PDF）
+    - page: PDF文件的页码（从1开始）
+    - tile_preset: 分块预设 fast / balanced / accurate，在区域分块上限内按内容密度自适应
+    - X-Request-Deadline请求头: 可选的截止时间（Unix时间戳，秒）
+    
+    返回:
+    - 同 /ocr/regions，regions按阅读顺序排列，label为区域类别
+    """
+    if not model_manager.is_loaded:
+        raise HTTPException(status_code=503, detail="模型未加载，请稍后重试")
+    
+    tile_preset = resolve_tile_preset(tile_preset)
+    cancel_scope = request_cancel_scope(http_request)
+    
+    if file.size and file.size > CONFIG["MAX_FILE_SIZE"]:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件过大，最大支持 {CONFIG['MAX_FILE_SIZE'] // (1024*1024)}MB"
+        )
+    file_ext = Path(file.filename).suffix.lower()
+    if file_ext not in CONFIG["SUPPORTED_FORMATS"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的文件格式: {file_ext}，支持: {CONFIG['SUPPORTED_FORMATS']}"
+        )
+    
+    try:
+        file_content = await file.read()
+        start_time = datetime.now()
+        logger.info(f"开始版面分割识别: {file.filename}")
         
-        return JSONResponse(content={
-            "status": "completed",
-            "total_files": len(files),
-            "results": results
-        })
+        total_pages = None
+        if file_ext == ".pdf":
+            document = share_pdf(file_content)
+            total_pages = await run_in_threadpool(document.page_count)
+            if page < 1 or page > total_pages:
+                raise HTTPException(status_code=400, detail=f"页码 {page} 超出范围，PDF共 {total_pages} 页")
+            source = document.page(page - 1)
+        else:
+            source = ImageSource("image", file_content)
+        
+        with preprocess_pipeline.metrics.stage("preprocess"):
+            try:
+                region_list, crops, page_size, timings = await run_preprocess(
+                    preprocess_layout, source, model_manager.tile_settings(tile_preset), CONFIG["ROI_MAX_TILES"],
+                    model_manager.layout_settings, CONFIG["ROI_MAX_REGIONS"])
+            except SourceDecodeError as e:
+                raise HTTPException(status_code=400, detail=f"无法打开图片文件: {e}")
+        preprocess_pipeline.metrics.add_step_time(timings)
+        requests = model_manager.build_region_requests(region_list, crops, start_time=start_time,
+                                                       cancel_scope=cancel_scope)
+        
+        async with disconnect_watch(http_request, cancel_scope):
+            process = preprocess_pipeline.metrics.track("generate", model_manager.process_regions)
+            try:
+                future = inference_scheduler.submit(process, requests, region_list, page_size)
+            except QueueFullError as e:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"服务繁忙，推理队列已满，请 {e.retry_after} 秒后重试",
+                    headers={"Retry-After": str(e.retry_after)}
+                )
+            result = await wait_inference(future, cancel_scope)
+        result["metadata"]["layout_time"] = timings["layout"]
+        if total_pages is not None:
+            result["metadata"]["page"] = page
+            result["metadata"]["total_pages"] = total_pages
         
+        processing_time = (datetime.now() - start_time).total_seconds()
+        result["metadata"]["total_processing_time"] = processing_time
+        result["file_info"] = {
+            "filename": file.filename,
+            "size": file.size,
+            "format": file_ext,
+            "image_size": page_size
+        }
+        logger.info(f"✅ 版面分割识别完成: {file.filename}, 区域数: {len(region_list)}, "
+                    f"分块数: {result['metadata']['image_patches']}, 耗时: {processing_time:.2f}秒")
+        return JSONResponse(content=result)
+    
     except HTTPException:
         raise
+    except RequestCancelled as e:
+        logger.info(f"🚫 版面分割识别已取消: {file.filename}, {e}")
+        raise cancelled_http_error(e)
+    except Exception as e:
+        logger.error(f"❌ 版面分割识别出错: {e}")
+        raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+
+@app.post("/ocr/pdf")
+async def process_pdf(
+    http_request: Request,
+    file: UploadFile = File(...),
+    prompt: Optional[str] = Form(None),
+    pages: Optional[str] = Form(None),
+    tile_preset: Optional[str] = Form(None),
+    skip_blank: Optional[bool] = Form(None),
+    dedup_distance: Optional[int] = Form(None),
+    progressive: bool = Form(False),
+    priority: Optional[str] = Form(None),
+    pack: Optional[bool] = Form(None)
+):
+    """
+    在服务端光栅化PDF并逐页OCR，以NDJSON流式返回
+    
+    参数:
+    - file: PDF文件
+    - prompt: 可选的自定义提示词
+    - pages: 页码范围（从1开始），如 "1-3,5"；为空时处理全部页面
+    - tile_preset: 分块预设 draft / fast / balanced / accurate，默认balanced
+    - skip_blank: 是否跳过空白页，默认CONFIG["PDF_SKIP_BLANK_PAGES"]
+    - dedup_distance: 近似重复页的汉明距离阈值，-1表示不去重，默认CONFIG["PDF_DEDUP_MAX_DISTANCE"]；
+      哈希相近的页面以OCR分辨率逐像素确认内容相同后才复用，因此只复用完全相同的页面（重复插入的同一页）；
+      重新扫描或重新导出的同一页渲染结果有差别，仍逐页识别
+    - progressive: 渐进式识别（忽略tile_preset）：各页先以draft预设输出初稿，全部初稿输出后，
+      需要细化的页面再以同页码的新行输出高分辨率结果（metadata.progressive.stage为refined），替换此前的初稿
+    - priority: 模型级联的优先级 speed / auto / quality，同/ocr/process，各页分别路由
+    - pack: 是否把分块较少的稀疏页面打包为一次多图推理（结果仍逐页输出，打包的页面在metadata.packed中注明），
+      默认CONFIG["PACK_ENABLED"]；渐进式识别时只打包初稿
+    - X-Request-Deadline请求头: 可选的整份文档截止时间（Unix时间戳，秒），超过后其余页面以error返回
+    
+    返回（每行一个JSON对象）:
+    - {"type": "document", ...}: 文档信息与待处理页码
+    - {"type": "page", "page": n, ...}: 单页OCR结果（字段同/ocr/process），失败时status为error；
+      空白页status为skipped，近似重复页复用此前页面的结果并在metadata.reused_from中注明
+    - {"type": "summary", ...}: 处理汇总，含跳过、复用与（渐进式识别时）细化的页码
+    """
+    if not model_manager.is_loaded:
+        raise HTTPException(status_code=503, detail="模型未加载，请稍后重试")
+    
+    if Path(file.filename).suffix.lower() != ".pdf":
+        raise HTTPException(status_code=400, detail="仅支持PDF文件")
+    tile_preset = resolve_tile_preset(tile_preset)
+    priority = resolve_priority(priority)
+    cancel_scope = request_cancel_scope(http_request)
+    
+    pdf_bytes = await file.read()
+    # 各页的预处理、预览与去重确认共用同一份共享内存中的文档，每个进程只解析一次
+    document = share_pdf(pdf_bytes)
+    try:
+        total_pages = await run_in_threadpool(document.page_count)
+        page_indices = parse_page_range(pages or "", total_pages)
+    except PageRangeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"❌ 批量处理失败: {e}")
-        raise HTTPException(status_code=500, detail=f"批量处理失败: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"无法打开PDF文件: {e}")
+    
+    digest = await run_in_threadpool(pdf_digest, pdf_bytes)
+    logger.info(f"开始处理PDF: {file.filename}, 共 {total_pages} 页，待处理 {len(page_indices)} 页")
+    
+    if skip_blank is None:
+        skip_blank = CONFIG["PDF_SKIP_BLANK_PAGES"]
+    if dedup_distance is None:
+        dedup_distance = CONFIG["PDF_DEDUP_MAX_DISTANCE"]
+    deduplicator = PageDeduplicator(dedup_distance) if dedup_distance >= 0 else None
+    originals: Dict[int, asyncio.Future] = {}
+    skipped_pages: List[int] = []
+    reused_pages: Dict[int, int] = {}
+    refinements: Dict[int, asyncio.Task] = {}  # 页码下标 -> 细化任务
+    # 细化在全部初稿输出后进行，只受整份文档的截止时间与客户端断开约束
+    refine_scope = CancelScope(cancel_scope.deadline)
+    if pack is None:
+        pack = CONFIG["PACK_ENABLED"]
+    packer = PagePacker(model_manager.pack_settings) if pack else None
+    lookahead = CONFIG["PDF_PAGE_LOOKAHEAD"]
+    if packer is not None:
+        # 同时在途的页面足够凑满一次打包
+        lookahead = max(lookahead, packer.settings.max_pages)
+    
+    async def process_page(page_index: int, ticket: Optional[int] = None) -> Dict[str, Any]:
+        if packer is not None and ticket is None:
+            ticket = packer.expect()
+        infer = packer.bind(ticket) if packer is not None else None
+        try:
+            if progressive:
+                key_material, source = pdf_page_source(document, digest, page_index)
+                result, refinement = await run_progressive_ocr(key_material, prompt, source, cancel_scope,
+                                                               refine_scope, priority, infer)
+                if refinement is not None:
+                    refinements[page_index] = refinement
+            else:
+                result = await run_pdf_page_ocr(document, digest, page_index, prompt, tile_preset, cancel_scope,
+                                                priority, infer)
+        except HTTPException as e:
+            return {"type": "page", "page": page_index + 1, "status": "error", "error": e.detail}
+        except RequestCancelled as e:
+            return {"type": "page", "page": page_index + 1, "status": "error", "error": str(e), "cancelled": e.reason}
+        except Exception as e:
+            logger.error(f"❌ PDF第 {page_index + 1} 页处理失败: {e}")
+            return {"type": "page", "page": page_index + 1, "status": "error", "error": str(e)}
+        finally:
+            if packer is not None:
+                packer.release(ticket)
+        result["type"] = "page"
+        result["page"] = page_index + 1
+        return result
+    
+    def page_fingerprint(page_index: int):
+        return fingerprint(render_preview(document.document, page_index))
+    
+    def render_page(page_index: int):
+        return render_full_gray(document.document, page_index, CONFIG["IMAGE_SIZE"], CONFIG["MAX_IMAGE_PATCHES"],
+                                CONFIG["PDF_MIN_ZOOM"], CONFIG["PDF_MAX_ZOOM"])
+    
+    def confirm_duplicate(page_index: int, source_index: int) -> bool:
+        """哈希只是候选：以OCR分辨率渲染两页，逐像素没有差别才视为重复"""
+        return same_content(render_page(page_index), render_page(source_index))
+    
+    async def reuse_page(page_index: int, source_index: int, distance: int) -> Dict[str, Any]:
+        # shield：本页被取消时不能连带取消被复用的原始页面
+        source = await asyncio.shield(originals[source_index])
+        if source.get("status") != "success":
+            return await process_page(page_index)
+        line = copy.deepcopy(source)
+        line["page"] = page_index + 1
+        line["metadata"]["reused_from"] = source_index + 1
+        line["metadata"]["hash_distance"] = distance
+        return line
+    
+    async def schedule_page(page_index: int) -> asyncio.Future:
+        """按页码顺序调度：空白页直接跳过，近似重复页复用更早页面的结果，其余页面提交OCR"""
+        page_fp = None
+        if skip_blank or deduplicator is not None:
+            try:
+                page_fp = await run_preprocess(page_fingerprint, page_index)
+            except Exception as e:
+                logger.warning(f"⚠️ PDF第 {page_index + 1} 页指纹计算失败，按普通页面处理: {e}")
+        
+        if page_fp is not None and skip_blank and page_fp.blank:
+            skipped_pages.append(page_index + 1)
+            future = asyncio.get_running_loop().create_future()
+            future.set_result({
+                "type": "page",
+                "page": page_index + 1,
+                "status": "skipped",
+                "raw_text": "",
+                "metadata": {"skipped": "blank", "page_hash": describe(page_fp)}
+            })
+            return future
+        
+        if page_fp is not None and deduplicator is not None:
+            for source_index, distance in deduplicator.candidates(page_fp):
+                try:
+                    confirmed = await run_preprocess(confirm_duplicate, page_index, source_index)
+                except Exception as e:
+                    logger.warning(f"⚠️ PDF第 {page_index + 1} 页重复确认失败，按普通页面处理: {e}")
+                    break
+                if confirmed:
+                    reused_pages[page_index + 1] = source_index + 1
+                    return asyncio.ensure_future(reuse_page(page_index, source_index, distance))
+                logger.info(f"🔍 PDF第 {page_index + 1} 页与第 {source_index + 1} 页哈希相近但内容不同，不复用")
+            deduplicator.add(page_index, page_fp)
+        
+        # 票据在调度时登记，打包据此判断是否还有页面会到达
+        ticket = packer.expect() if packer is not None else None
+        task = asyncio.ensure_future(process_page(page_index, ticket))
+        originals[page_index] = task
+        return task
+    
+    async def ndjson_stream():
+        start_time = datetime.now()
+        yield json.dumps({
+            "type": "document",
+            "filename": file.filename,
+            "total_pages": total_pages,
+            "pages": [index + 1 for index in page_indices]
+        }, ensure_ascii=False) + "\n"
+        
+        # 同时提交若干页，使其能在推理调度器中合并为一批（或打包）；结果按页码顺序输出
+        remaining = iter(page_indices)
+        tasks = deque()
+        succeeded = 0
+        refined_pages: List[int] = []
+        
+        async def schedule_next(page_index: int):
+            tasks.append(await schedule_page(page_index))
+            if packer is not None and page_index == page_indices[-1]:
+                packer.close()
+        
+        try:
+            for index in itertools.islice(remaining, lookahead):
+                await schedule_next(index)
+            while tasks:
+                line = await tasks.popleft()
+                next_index = next(remaining, None)
+                if next_index is not None:
+                    await schedule_next(next_index)
+                if line.get("status") == "success":
+                    succeeded += 1
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+            
+            # 细化结果按完成顺序输出，复用了被细化页面的近似重复页一并替换
+            async def refined_page(page_index: int):
+                return page_index + 1, await refinements[page_index]
+            
+            for pending in asyncio.as_completed([refined_page(index) for index in refinements]):
+                source_page, result = await pending
+                if result is None:
+                    continue
+                reusing = sorted(page for page, source in reused_pages.items() if source == source_page)
+                for page_number in [source_page] + reusing:
+                    line = copy.deepcopy(result)
+                    line["type"] = "page"
+                    line["page"] = page_number
+                    if page_number != source_page:
+                        line["metadata"]["reused_from"] = source_page
+                    refined_pages.append(page_number)
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时不再提交后续页面，并停止正在推理的页面与细化
+            if tasks:
+                cancel_scope.cancel(CANCEL_DISCONNECTED)
+            for task in tasks:
+                task.cancel()
+            if any(not task.done() for task in refinements.values()):
+                refine_scope.cancel(CANCEL_DISCONNECTED)
+        
+        yield json.dumps({
+            "type": "summary",
+            "total_pages": total_pages,
+            "processed_pages": len(page_indices),
+            "succeeded_pages": succeeded,
+            "skipped_pages": skipped_pages,
+            "reused_pages": reused_pages,
+            "refined_pages": sorted(refined_pages),
+            "total_processing_time": (datetime.now() - start_time).total_seconds()
+        }, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ocr/stream")
+async def stream_document(
+    http_request: Request,
+    file: UploadFile = File(...),
+    prompt: Optional[str] = Form(None),
+    page: int = Form(1),
+    tile_preset: Optional[str] = Form(None),
+    priority: Optional[str] = Form(None)
+):
+    """
+    流式OCR：以SSE逐段推送生成的文本
+    
+    参数:
+    - file: 上传的文件（图片或PDF）
+    - prompt: 可选的自定义提示词
+    - page: PDF文件的页码（从1开始），超出范围返回400
+    - tile_preset: 分块预设 draft / fast / balanced / accurate，默认balanced
+    - priority: 模型级联的优先级 speed / auto / quality，同/ocr/process；已推送的文本无法撤回，置信度偏低时不升级
+    
+    事件类型:
+    - phase: 阶段计时（preprocess / first_token / done），elapsed_ms为自请求开始的毫秒数
+    - token: 新生成的文本片段
+    - result: 完整的OCR结果（与/ocr/process一致）
+    - error: 处理失败；超过X-Request-Deadline截止时间时带cancelled字段
+    
+    客户端断开时停止生成。
+    """
+    if not model_manager.is_loaded:
+        raise HTTPException(status_code=503, detail="模型未加载，请稍后重试")
+    
+    file_ext = Path(file.filename).suffix.lower()
+    if file_ext not in CONFIG["SUPPORTED_FORMATS"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的文件格式: {file_ext}，支持: {CONFIG['SUPPORTED_FORMATS']}"
+        )
+    tile_preset = resolve_tile_preset(tile_preset)
+    priority = resolve_priority(priority) or CONFIG["ROUTER_DEFAULT_PRIORITY"]
+    cancel_scope = request_cancel_scope(http_request)
+    
+    # 开始推送前先检查队列，满时直接返回429
+    if inference_scheduler.queue_depth >= inference_scheduler.max_queue_size:
+        retry_after = inference_scheduler.estimate_retry_after()
+        raise HTTPException(
+            status_code=429,
+            detail=f"服务繁忙，推理队列已满，请 {retry_after} 秒后重试",
+            headers={"Retry-After": str(retry_after)}
+        )
+    
+    file_content = await file.read()
+    total_pages = None
+    if file_ext == ".pdf":
+        # 页码在开始推送前校验，错误以HTTP状态码返回而不是error事件
+        document = share_pdf(file_content)
+        try:
+            total_pages = await run_in_threadpool(document.page_count)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"无法打开PDF文件: {e}")
+        if page < 1 or page > total_pages:
+            raise HTTPException(status_code=400, detail=f"页码 {page} 超出范围，PDF共 {total_pages} 页")
+        source = document.page(page - 1)
+    else:
+        source = ImageSource("image", file_content)
+    start = time.perf_counter()
+    
+    def phase(name: str) -> str:
+        return sse_event("phase", {"phase": name, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)})
+    
+    async def event_stream():
+        finished = False
+        try:
+            request = await prepare_source(source, prompt, tile_preset, cancel_scope, priority)
+            yield phase("preprocess")
+            
+            text_queue: asyncio.Queue = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            
+            def on_text(text: str, stream_end: bool):
+                # 在推理线程中调用，投递到事件循环的队列
+                loop.call_soon_threadsafe(text_queue.put_nowait, (text, stream_end))
+            
+            manager = model_registry.manager(request.model)
+            process_stream = preprocess_pipeline.metrics.track("generate", manager.process_stream)
+            generate_start = time.perf_counter()
+            future = asyncio.wrap_future(inference_scheduler.submit(process_stream, request, on_text))
+            
+            first_token = True
+            stream_end = False
+            while not stream_end:
+                # 同时等待文本片段和推理任务，任务异常结束时不会一直阻塞
+                get_text = asyncio.ensure_future(text_queue.get())
+                done, _ = await asyncio.wait({get_text, future}, return_when=asyncio.FIRST_COMPLETED,
+                                             timeout=cancel_scope.remaining())
+                if not done:
+                    # 超过截止时间：停止条件会在下一个解码步结束生成
+                    get_text.cancel()
+                    raise RequestCancelled(CANCEL_DEADLINE)
+                if get_text not in done:
+                    get_text.cancel()
+                    break
+                text, stream_end = get_text.result()
+                if text:
+                    if first_token:
+                        first_token = False
+                        yield phase("first_token")
+                    yield sse_event("token", {"text": text})
+            
+            # 推送任务结束前已生成但尚未发送的片段
+            while not text_queue.empty():
+                text, _ = text_queue.get_nowait()
+                if text:
+                    yield sse_event("token", {"text": text})
+            
+            result = await future
+            model_registry.record_page(request, time.perf_counter() - generate_start)
+            result = model_registry.annotate(request, result, [])
+            if total_pages is not None:
+                result["metadata"]["page"] = page
+                result["metadata"]["total_pages"] = total_pages
+            result["file_info"] = {
+                "filename": file.filename,
+                "size": file.size,
+                "format": file_ext,
+                "image_size": result["metadata"].get("image_size")
+            }
+            yield phase("done")
+            finished = True
+            yield sse_event("result", result)
+        except QueueFullError as e:
+            yield sse_event("error", {"error": f"服务繁忙，请 {e.retry_after} 秒后重试", "retry_after": e.retry_after})
+        except RequestCancelled as e:
+            cancel_scope.cancel(e.reason)
+            yield sse_event("error", {"error": str(e), "cancelled": e.reason})
+        except Exception as e:
+            logger.error(f"❌ 流式处理失败: {e}")
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            # 客户端断开时生成器被关闭，停止仍在进行的生成
+            if not finished:
+                cancel_scope.cancel(CANCEL_DISCONNECTED)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def estimate_item_memory_bytes() -> int:
+    """估算单个在途页面占用的内存：解码后的原图、缩放网格与float32的pixel_values"""
+    tile_pixels = 3 * CONFIG["IMAGE_SIZE"] * CONFIG["IMAGE_SIZE"]
+    grid_bytes = CONFIG["MAX_IMAGE_PATCHES"] * tile_pixels  # uint8
+    pixel_values_bytes = (CONFIG["MAX_IMAGE_PATCHES"] + 1) * tile_pixels * 4  # float32，含缩略图
+    # 原图按网格大小的2倍估计（扫描件通常比缩放后的网格更大）
+    return pixel_values_bytes + 3 * grid_bytes
+
+def batch_concurrency() -> int:
+    """按内存预算计算批量处理的并发度，不超过推理队列容量"""
+    by_memory = CONFIG["BATCH_MEMORY_BUDGET_MB"] * 1024 * 1024 // estimate_item_memory_bytes()
+    return max(1, min(by_memory, CONFIG["BATCH_MAX_CONCURRENCY"], CONFIG["INFERENCE_QUEUE_SIZE"]))
+
+def _read_spooled(spooled) -> bytes:
+    spooled.seek(0)
+    return spooled.read()
+
+@app.post("/ocr/batch")
+async def batch_process_documents(
+    http_request: Request,
+    files: List[UploadFile] = File(...),
+    prompt: Optional[str] = Form(None),
+    tile_preset: Optional[str] = Form(None)
+):
+    """
+    批量处理多个文档，以NDJSON流式返回每项结果
+    
+    各文件（PDF按页）并行解码和预处理，推理时由调度器合并为批；同时在途的页面数
+    按内存预算限制，上传内容暂存在磁盘临时文件中，轮到处理时才读入内存。
+    
+    返回（每行一个JSON对象，按完成顺序输出）:
+    - {"type": "batch", ...}: 文件数与并发度
+    - {"type": "item", "index": i, "filename": ..., ...}: 单项结果，index为文件的原始序号；
+      PDF每页一行并带page字段；失败时status为error
+    - {"type": "summary", ...}: 处理汇总
+    
+    X-Request-Deadline请求头给出整批的截止时间；客户端断开时停止正在推理的项目。
+    """
+    if not model_manager.is_loaded:
+        raise HTTPException(status_code=503, detail="模型未加载")
+    
+    tile_preset = resolve_tile_preset(tile_preset)
+    cancel_scope = request_cancel_scope(http_request)
+    if len(files) > CONFIG["BATCH_MAX_FILES"]:
+        raise HTTPException(status_code=400, detail=f"批量处理最多支持{CONFIG['BATCH_MAX_FILES']}个文件")
+    
+    total_size = sum(file.size or 0 for file in files)
+    if total_size > CONFIG["BATCH_MAX_TOTAL_MB"] * 1024 * 1024:
+        raise HTTPException(
+            status_code=413,
+            detail=f"批量上传总大小超过 {CONFIG['BATCH_MAX_TOTAL_MB']}MB"
+        )
+    
+    # 响应开始流式输出前上传文件会被关闭，先转存到自有的磁盘临时文件
+    spooled_files = []
+    try:
+        for file in files:
+            spooled = tempfile.TemporaryFile()
+            await run_in_threadpool(shutil.copyfileobj, file.file, spooled)
+            spooled_files.append((file.filename, file.size, spooled))
+    except Exception:
+        for _, _, spooled in spooled_files:
+            spooled.close()
+        raise
+    
+    concurrency = batch_concurrency()
+    slots = asyncio.Semaphore(concurrency)
+    lines: asyncio.Queue = asyncio.Queue()
+    logger.info(f"开始批量处理: {len(files)} 个文件，并发度 {concurrency}")
+    
+    def error_line(index: int, filename: str, error: str, page: Optional[int] = None) -> Dict[str, Any]:
+        line = {"type": "item", "index": index, "filename": filename, "status": "error", "error": error}
+        if page is not None:
+            line["page"] = page
+        return line
+    
+    async def process_image_item(index: int, filename: str, size: int, spooled):
+        async with slots:
+            try:
+                file_content = await run_preprocess(_read_spooled, spooled)
+                result = await run_ocr(file_content, prompt, tile_preset, cancel_scope)
+            except HTTPException as e:
+                return await lines.put(error_line(index, filename, e.detail))
+            except RequestCancelled as e:
+                return await lines.put(error_line(index, filename, str(e)))
+            except Exception as e:
+                logger.error(f"❌ 批量处理第 {index} 项失败: {e}")
+                return await lines.put(error_line(index, filename, str(e)))
+        result.update({"type": "item", "index": index, "filename": filename})
+        result["file_info"] = {
+            "filename": filename,
+            "size": size,
+            "image_size": result["metadata"].get("image_size")
+        }
+        await lines.put(result)
+    
+    async def process_pdf_page(index: int, filename: str, document: SharedDocument, digest: bytes,
+                               page_index: int, total_pages: int):
+        async with slots:
+            try:
+                result = await run_pdf_page_ocr(document, digest, page_index, prompt, tile_preset, cancel_scope)
+            except HTTPException as e:
+                return await lines.put(error_line(index, filename, e.detail, page_index + 1))
+            except RequestCancelled as e:
+                return await lines.put(error_line(index, filename, str(e), page_index + 1))
+            except Exception as e:
+                logger.error(f"❌ 批量处理第 {index} 项第 {page_index + 1} 页失败: {e}")
+                return await lines.put(error_line(index, filename, str(e), page_index + 1))
+        result.update({"type": "item", "index": index, "filename": filename, "page": page_index + 1})
+        result["metadata"]["total_pages"] = total_pages
+        await lines.put(result)
+    
+    async def process_pdf_item(index: int, filename: str, spooled):
+        # PDF本身不占用并发名额，各页分别排队，避免PDF占着名额等待自己的页面
+        try:
+            pdf_bytes = await run_preprocess(_read_spooled, spooled)
+            document = share_pdf(pdf_bytes)
+            total_pages = await run_preprocess(document.page_count)
+            digest = await run_preprocess(pdf_digest, pdf_bytes)
+        except Exception as e:
+            return await lines.put(error_line(index, filename, f"无法打开PDF文件: {e}"))
+        await asyncio.gather(*(
+            process_pdf_page(index, filename, document, digest, page_index, total_pages)
+            for page_index in range(total_pages)
+        ))
+    
+    async def process_item(index: int, filename: str, size: int, spooled):
+        file_ext = Path(filename or "").suffix.lower()
+        if file_ext not in CONFIG["SUPPORTED_FORMATS"]:
+            await lines.put(error_line(index, filename, f"不支持的文件格式: {file_ext}"))
+        elif file_ext == ".pdf":
+            await process_pdf_item(index, filename, spooled)
+        else:
+            await process_image_item(index, filename, size, spooled)
+    
+    async def ndjson_stream():
+        start_time = datetime.now()
+        yield json.dumps({
+            "type": "batch",
+            "total_files": len(spooled_files),
+            "concurrency": concurrency
+        }, ensure_ascii=False) + "\n"
+        
+        tasks = [
+            asyncio.ensure_future(process_item(index, filename, size, spooled))
+            for index, (filename, size, spooled) in enumerate(spooled_files)
+        ]
+        all_done = asyncio.ensure_future(asyncio.gather(*tasks))
+        succeeded = failed = 0
+        try:
+            while not (all_done.done() and lines.empty()):
+                if all_done.done():
+                    line = lines.get_nowait()
+                else:
+                    line_task = asyncio.ensure_future(lines.get())
+                    await asyncio.wait({line_task, all_done}, return_when=asyncio.FIRST_COMPLETED)
+                    if not line_task.done():
+                        line_task.cancel()
+                        continue
+                    line = line_task.result()
+                if line.get("status") == "success":
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时取消尚未完成的项目（包括正在推理的）并删除临时文件
+            if not all_done.done():
+                cancel_scope.cancel(CANCEL_DISCONNECTED)
+            all_done.cancel()
+            for task in tasks:
+                task.cancel()
+            for _, _, spooled in spooled_files:
+                spooled.close()
+        
+        yield json.dumps({
+            "type": "summary",
+            "total_files": len(spooled_files),
+            "total_items": succeeded + failed,
+            "succeeded": succeeded,
+            "failed": failed,
+            "total_processing_time": (datetime.now() - start_time).total_seconds()
+        }, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
 
 @app.get("/model/info")
 async def get_model_info():
@@ -476,22 +2655,77 @@ async def get_model_info():
         "device": CONFIG["DEVICE"],
         "is_loaded": model_manager.is_loaded,
         "supported_formats": CONFIG["SUPPORTED_FORMATS"],
+        "tile_presets": list(TILE_PRESETS),
+        "default_tile_preset": CONFIG["TILE_PRESET"],
+        "backend": model_manager.backend.describe() if model_manager.backend is not None else {"name": CONFIG["BACKEND"]},
+        "models": model_registry.describe(),
+        "priorities": list(PRIORITIES),
+        "default_priority": CONFIG["ROUTER_DEFAULT_PRIORITY"],
+        "packing": dict(model_manager.pack_settings._asdict(), supported=model_manager.supports_packing),
         "max_file_size_mb": CONFIG["MAX_FILE_SIZE"] // (1024 * 1024),
         "gpu_available": torch.cuda.is_available(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """获取推理队列运行指标"""
+    return {
+        "model_loaded": model_manager.is_loaded,
+        "batching_mode": CONFIG["BATCHING_MODE"],
+        "scheduler": inference_scheduler.get_metrics(),
+        "continuous": continuous_engine.get_metrics() if continuous_engine is not None else None,
+        "result_cache": result_cache.get_metrics() if result_cache is not None else None,
+        "single_flight": single_flight.get_metrics(),
+        "pipeline": preprocess_pipeline.get_metrics(),
+        "model_gate": model_manager.gate.get_metrics(),
+        "vision_cache": model_manager.feature_cache.get_metrics(),
+        "generation": model_manager.stop_stats.get_metrics(),
+        "cancellation": model_manager.cancel_stats.get_metrics(),
+        "models": model_registry.get_metrics(),
+        "progressive": dict(progressive_stats.get_metrics(), pending=refinement_registry.pending()),
+        "packing": pack_stats.get_metrics(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.delete("/admin/cache")
+async def purge_result_cache(model_version: Optional[str] = None):
+    """按模型版本清除OCR结果缓存（不指定版本时清空全部）"""
+    if result_cache is None:
+        raise HTTPException(status_code=404, detail="OCR结果缓存未启用")
+    purged = await run_in_threadpool(result_cache.purge, model_version)
+    return {
+        "status": "success",
+        "model_version": model_version,
+        "purged": purged,
+        "timestamp": datetime.now().isoformat()
+    }
+
 @app.post("/model/reload")
-async def reload_model():
-    """重新加载模型"""
+async def reload_model(strategy: str = "auto"):
+    """
+    热重载模型（请求不会因重载失败，只会短暂排队）
+    
+    strategy: auto（按空闲显存/内存自动选择）/ double_buffer（新旧模型并存，排空后原子交换）/
+    pause（排空后暂停推理，替换模型后恢复）
+    """
+    if strategy not in STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"未知的重载策略: {strategy}，支持: {list(STRATEGIES)}")
     try:
         logger.info("🔄 重新加载模型...")
-        model_manager.load_model()
+        used_strategy = await run_in_threadpool(model_manager.reload_model, strategy)
+        if model_manager.state == "failed":
+            raise RuntimeError(model_manager.load_error)
         return {
             "status": "success",
             "message": "模型重新加载成功",
+            "strategy": used_strategy,
+            "timings": model_manager.get_load_status()["timings"],
+            "gate": model_manager.gate.get_metrics(),
             "timestamp": datetime.now().isoformat()
         }
+    except ReloadInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.error(f"❌ 模型重新加载失败: {e}")
         raise HTTPException(status_code=500, detail=f"模型重新加载失败: {str(e)}")
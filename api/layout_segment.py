@@ -0,0 +1,304 @@
+"""
+版面预分割
+
+整页识别时12个分块覆盖的是缩小后的整张页面，大片空白与图框也占用视觉token。
+这里先用OpenCV做一次快速的版面分析，找出文字块、表格（横竖线网格）与插图区域，
+只把这些区域按各自合适的提示词（文字 general / 表格 table / 插图 diagram）
+交给VLM批量识别，再按阅读顺序拼接结果。
+
+- 表格：形态学开运算提取长横线与长竖线，两个方向都有多条线的网格区域即为表格；
+  覆盖大半页面的网格视为图框，剥掉外框后在其内部继续查找
+- 文字块 / 插图：去掉表格与图框线后膨胀合并相邻笔画，按连通块的尺寸区分：
+  字符高度的小连通块组成的区域为文字，含大连通块（图形轮廓）的区域为插图
+- 阅读顺序：对区域做递归XY切分（先按水平空白带分行，再按竖直空白带分栏）
+
+分析在最长边 analysis_size 的灰度图上进行，输出相对坐标（0~1）的区域，
+由roi_crop按原始分辨率裁剪（PDF只渲染区域本身）。
+"""
+
+import io
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from roi_crop import Region, preprocess_regions
+from preprocess_pipeline import ImageSource, SourceDecodeError, source_pdf
+
+LABEL_TEXT = "text"
+LABEL_TABLE = "table"
+LABEL_FIGURE = "figure"
+
+# 各区域类别使用的提示词类型（config.py的ENGINEERING_PROMPTS）
+LABEL_PROMPT_TYPES: Dict[str, str] = {
+    LABEL_TEXT: "general",
+    LABEL_TABLE: "table",
+    LABEL_FIGURE: "diagram",
+}
+
+
+class LayoutSettings(NamedTuple):
+    """版面分析参数（长度按分析图尺寸的比例给出）"""
+    analysis_size: int = 1600  # 分析图的最长边（像素）
+    line_ratio: float = 1 / 30  # 表格线的最短长度（相对页宽/页高）
+    frame_line_ratio: float = 0.5  # 图框线的最短长度，找文字块与插图前去除
+    min_table_lines: int = 3  # 表格在一个方向上至少的线数（另一方向至少2条）
+    frame_ratio: float = 0.5  # 面积超过页面该比例的网格视为图框
+    min_area_ratio: float = 0.0005  # 区域的最小面积（相对页面）
+    figure_height_ratio: float = 0.04  # 连通块高度超过页高该比例视为图形而非字符
+    padding_ratio: float = 0.006  # 裁剪时向外扩展的边距（相对页宽/页高）
+
+
+class LayoutBox(NamedTuple):
+    label: str
+    box: Tuple[int, int, int, int]  # 分析图上的 (x0, y0, x1, y1)
+
+
+def _area(box: Tuple[int, int, int, int]) -> int:
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def _overlaps(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _union(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def _count_lines(mask: np.ndarray, axis: int) -> int:
+    """统计掩码中沿axis方向排列的线条数（连续的非零行/列算作一条）"""
+    present = mask.any(axis=axis).astype(np.int8)
+    return int(np.count_nonzero(np.diff(present, prepend=0) == 1))
+
+
+def _binarize(gray: np.ndarray) -> np.ndarray:
+    """墨迹为255的二值图，自适应阈值兼容扫描件的不均匀底色"""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 15)
+
+
+def _line_masks(binary: np.ndarray, ratio: float) -> Tuple[np.ndarray, np.ndarray]:
+    """长度不小于页宽/页高ratio倍的横线与竖线"""
+    height, width = binary.shape
+    h_len = max(10, int(width * ratio))
+    v_len = max(10, int(height * ratio))
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (h_len, 1)))
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, v_len)))
+    return horizontal, vertical
+
+
+def find_tables(horizontal: np.ndarray, vertical: np.ndarray,
+                settings: LayoutSettings) -> List[Tuple[int, int, int, int]]:
+    """在横竖线掩码中查找表格网格"""
+    height, width = horizontal.shape
+    page_area = height * width
+    grid = cv2.dilate(cv2.bitwise_or(horizontal, vertical), np.ones((3, 3), np.uint8), iterations=2)
+
+    tables = []
+    pending = [(0, 0, width, height)]
+    for _ in range(2):  # 图框内最多再剥一层（图框 -> 标题栏/明细表）
+        frames = []
+        for x0, y0, x1, y1 in pending:
+            contours, _ = cv2.findContours(grid[y0:y1, x0:x1], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            for contour in contours:
+                x, y, w, h = cv2.boundingRect(contour)
+                box = (x0 + x, y0 + y, x0 + x + w, y0 + y + h)
+                if w * h < settings.min_area_ratio * page_area:
+                    continue
+                if w * h > settings.frame_ratio * page_area:
+                    frames.append(box)
+                    continue
+                n_horizontal = _count_lines(horizontal[box[1]:box[3], box[0]:box[2]], axis=1)
+                n_vertical = _count_lines(vertical[box[1]:box[3], box[0]:box[2]], axis=0)
+                if (min(n_horizontal, n_vertical) >= 2
+                        and max(n_horizontal, n_vertical) >= settings.min_table_lines):
+                    tables.append(box)
+        # 剥掉图框的外框线后在内部继续查找
+        pending = []
+        for x0, y0, x1, y1 in frames:
+            band = 8
+            if x1 - x0 > 2 * band and y1 - y0 > 2 * band:
+                pending.append((x0 + band, y0 + band, x1 - band, y1 - band))
+        if not pending:
+            break
+    return tables
+
+
+def _classify_block(binary: np.ndarray, box: Tuple[int, int, int, int], figure_height: int) -> str:
+    """含图形轮廓（高度超过字符的大连通块）的区域为插图，否则为文字"""
+    x0, y0, x1, y1 = box
+    count, _, stats, _ = cv2.connectedComponentsWithStats(binary[y0:y1, x0:x1], connectivity=8)
+    if count <= 1:
+        return LABEL_TEXT
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    large = (heights > figure_height) | (widths > figure_height * 4)
+    return LABEL_FIGURE if areas[large].sum() > 0.3 * areas.sum() else LABEL_TEXT
+
+
+def find_blocks(binary: np.ndarray, lines: np.ndarray, tables: Sequence[Tuple[int, int, int, int]],
+                settings: LayoutSettings) -> List[LayoutBox]:
+    """去掉表格与图框线后，查找文字块与插图"""
+    height, width = binary.shape
+    content = cv2.bitwise_and(binary, cv2.bitwise_not(lines))
+    for x0, y0, x1, y1 in tables:
+        content[y0:y1, x0:x1] = 0
+    # 去除扫描噪点
+    content = cv2.morphologyEx(content, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+
+    # 横向膨胀把字符连成行，纵向少量膨胀把相邻行连成段落
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, width // 80), max(3, height // 150)))
+    merged = cv2.dilate(content, kernel)
+    contours, _ = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h >= settings.min_area_ratio * height * width:
+            boxes.append((x, y, x + w, y + h))
+    boxes = _merge_overlapping(boxes)
+
+    figure_height = max(8, int(height * settings.figure_height_ratio))
+    return [LayoutBox(_classify_block(content, box, figure_height), box) for box in boxes]
+
+
+def _merge_overlapping(boxes: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+    merged = True
+    while merged:
+        merged = False
+        result: List[Tuple[int, int, int, int]] = []
+        for box in boxes:
+            for index, other in enumerate(result):
+                if _overlaps(box, other):
+                    result[index] = _union(box, other)
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+
+def reading_order(items: List[LayoutBox]) -> List[LayoutBox]:
+    """递归XY切分：先找贯穿全部区域的水平空白带从上到下分组，找不到再按竖直空白带从左到右分栏"""
+    if len(items) <= 1:
+        return list(items)
+    for axis in (1, 0):  # 1: 按y分行；0: 按x分栏
+        groups, current, end = [], [], None
+        for item in sorted(items, key=lambda item: (item.box[axis], item.box[axis + 2])):
+            start, stop = item.box[axis], item.box[axis + 2]
+            if current and start >= end:
+                groups.append(current)
+                current, end = [], None
+            current.append(item)
+            end = stop if end is None else max(end, stop)
+        groups.append(current)
+        if len(groups) > 1:
+            return [item for group in groups for item in reading_order(group)]
+    return sorted(items, key=lambda item: (item.box[1], item.box[0]))
+
+
+def limit_regions(items: List[LayoutBox], max_regions: int) -> List[LayoutBox]:
+    """区域数超过上限时，按阅读顺序合并相邻的文字块（合并后面积最小者优先）"""
+    items = list(items)
+    while len(items) > max_regions:
+        candidates = [index for index in range(len(items) - 1)
+                      if items[index].label == items[index + 1].label == LABEL_TEXT]
+        if not candidates:
+            candidates = list(range(len(items) - 1))
+        index = min(candidates, key=lambda i: _area(_union(items[i].box, items[i + 1].box)))
+        first, second = items[index], items[index + 1]
+        label = first.label if first.label == second.label else LABEL_FIGURE
+        items[index:index + 2] = [LayoutBox(label, _union(first.box, second.box))]
+    return items
+
+
+def segment_layout(image: Image.Image, settings: Optional[LayoutSettings] = None,
+                   max_regions: int = 16) -> List[Region]:
+    """
+    版面分析，按阅读顺序返回待识别的区域（相对坐标，附提示词类型与类别）
+
+    没有找到任何内容时返回空列表
+    """
+    settings = settings or LayoutSettings()
+    scale = min(1.0, settings.analysis_size / max(image.size))
+    gray = image.convert("L")
+    if scale < 1.0:
+        gray = gray.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR)
+    gray = np.asarray(gray, dtype=np.uint8)
+    height, width = gray.shape
+
+    binary = _binarize(gray)
+    horizontal, vertical = _line_masks(binary, settings.line_ratio)
+    tables = find_tables(horizontal, vertical, settings)
+    frame_lines = cv2.bitwise_or(*_line_masks(binary, settings.frame_line_ratio))
+    blocks = find_blocks(binary, frame_lines, tables, settings)
+    # 表格内部的文字随表格一起识别
+    blocks = [block for block in blocks if not any(_overlaps(block.box, table) for table in tables)]
+
+    items = reading_order([LayoutBox(LABEL_TABLE, box) for box in tables] + blocks)
+    items = limit_regions(items, max_regions)
+
+    pad_x, pad_y = settings.padding_ratio, settings.padding_ratio
+    regions = []
+    for item in items:
+        x0, y0, x1, y1 = item.box
+        bbox = (max(0.0, x0 / width - pad_x), max(0.0, y0 / height - pad_y),
+                min(1.0, x1 / width + pad_x), min(1.0, y1 / height + pad_y))
+        regions.append(Region(bbox, LABEL_PROMPT_TYPES[item.label], item.label))
+    return regions
+
+
+def load_layout_source(source: ImageSource, analysis_size: int = 1600) -> Tuple[Image.Image, Optional[Image.Image]]:
+    """
+    读取版面分析所需的图片
+
+    Returns:
+        (分析用图片, 原图)：图片来源的原图即为分析用图片；PDF只渲染较低分辨率的预览，
+        原图为None（区域由roi_crop按区域渲染）
+    """
+    try:
+        if source.kind == "pdf":
+            from pdf_ingest import render_preview
+            preview = render_preview(source_pdf(source), source.page_index, analysis_size)
+            return preview, None
+        image = Image.open(io.BytesIO(source.data))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image, image
+    except Exception as e:
+        raise SourceDecodeError(str(e)) from e
+
+
+def preprocess_layout(source: Optional[ImageSource], tile_settings: Dict[str, Any], max_tiles: int,
+                      settings: Optional[LayoutSettings] = None, max_regions: int = 16,
+                      image: Optional[Image.Image] = None
+                      ) -> Tuple[List[Region], List[Tuple[torch.Tensor, Dict[str, Any]]], str, Dict[str, float]]:
+    """
+    版面分析并按原始分辨率裁剪、预处理各区域（image为已解码的原图时不再读取source）
+
+    没有找到任何区域时整页作为一个文字区域
+
+    Returns:
+        (按阅读顺序的区域, [(pixel_values, info), ...], 页面尺寸, 各步骤耗时)
+    """
+    settings = settings or LayoutSettings()
+    started = time.perf_counter()
+    if image is None:
+        analysis_image, image = load_layout_source(source, settings.analysis_size)
+    else:
+        analysis_image = image
+    decoded = time.perf_counter()
+    regions = segment_layout(analysis_image, settings, max_regions)
+    if not regions:
+        regions = [Region((0.0, 0.0, 1.0, 1.0), LABEL_PROMPT_TYPES[LABEL_TEXT], LABEL_TEXT)]
+    analyzed = time.perf_counter()
+
+    crops, page_size, timings = preprocess_regions(source, regions, "ratio", tile_settings, max_tiles, image)
+    timings["decode"] += decoded - started
+    timings["layout"] = analyzed - decoded
+    return regions, crops, page_size, timings
@@ -0,0 +1,129 @@
+"""
+模型热重载
+
+新模型在后台加载、预热完成后才与旧模型交换。推理代码在ModelGate的共享区间内
+访问模型；交换时获取独占区间：先阻止新的推理进入，等待进行中的推理全部结束
+（排空），再原子地替换model/tokenizer引用。等待期间新请求只是排队，不会失败。
+
+显存（或内存）放不下两份模型时退化为暂停-交换-恢复：排空后先把旧模型移出
+推理设备，再加载新模型；新模型加载失败时把旧模型恢复回去继续服务。
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import torch
+
+STRATEGIES = ("auto", "double_buffer", "pause")
+MEMORY_HEADROOM = 1.2  # 双缓冲所需的空闲内存 = 模型大小 × 该系数（激活值、KV缓存等余量）
+
+
+class ReloadInProgressError(RuntimeError):
+    """已有加载或热重载在进行"""
+
+    def __init__(self):
+        super().__init__("模型正在加载或重载中")
+
+
+class ModelGate:
+    """
+    模型读写闸门
+
+    推理为共享（可多个并存），交换为独占；一旦有交换在等待，新的共享请求
+    阻塞到交换完成，保证排空能够结束。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._swap_pending = False
+        self._swaps = 0
+        self._paused_time = 0.0
+
+    @property
+    def swap_pending(self) -> bool:
+        return self._swap_pending
+
+    def acquire_shared(self, timeout: Optional[float] = None) -> bool:
+        """进入推理区间；交换进行中时等待，超时返回False"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._swap_pending, timeout=timeout):
+                return False
+            self._active += 1
+            return True
+
+    def release_shared(self):
+        with self._cond:
+            self._active -= 1
+            if self._active == 0:
+                self._cond.notify_all()
+
+    @contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+    @contextmanager
+    def exclusive(self):
+        """阻止新的推理进入并等待进行中的推理结束，区间内可安全替换模型"""
+        with self._cond:
+            self._cond.wait_for(lambda: not self._swap_pending)
+            self._swap_pending = True
+            self._cond.wait_for(lambda: self._active == 0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._swap_pending = False
+                self._swaps += 1
+                self._paused_time += time.perf_counter() - started
+                self._cond.notify_all()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "active": self._active,
+                "swap_pending": self._swap_pending,
+                "swaps": self._swaps,
+                "paused_time": round(self._paused_time, 3),
+            }
+
+
+def model_nbytes(model) -> int:
+    """模型参数与缓冲区占用的字节数"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def available_memory_bytes(device: str) -> Optional[int]:
+    """推理设备上可用于加载第二份模型的内存，无法获取时返回None"""
+    if device == "cuda":
+        free, _ = torch.cuda.mem_get_info()
+        return free
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    if hasattr(os, "sysconf") and "SC_AVPHYS_PAGES" in os.sysconf_names:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    return None
+
+
+def choose_strategy(requested: str, device: str, current_nbytes: int) -> str:
+    """auto时按空闲内存能否容纳第二份模型（current_nbytes为当前模型大小）选择double_buffer或pause"""
+    if requested not in STRATEGIES:
+        raise ValueError(f"未知的重载策略: {requested}，支持: {list(STRATEGIES)}")
+    if requested != "auto":
+        return requested
+    available = available_memory_bytes(device)
+    if available is None:
+        return "pause"
+    return "double_buffer" if available >= current_nbytes * MEMORY_HEADROOM else "pause"
@@ -0,0 +1,155 @@
+"""
+模型级联路由
+
+同时加载若干个InternVL模型（例如1~2B与8B），按从小到大排成若干级。简单的打字文本页面不需要8B模型：
+预处理时在缩略图上提取廉价的页面特征（笔画密度、表格线），路由器据此与用户指定的优先级为每页选择
+一级模型；小模型回答的置信度（token概率的几何平均，见token_confidence.py）偏低时升级到更大一级重新生成。
+
+优先级:
+- speed: 始终使用最小的模型，不升级
+- auto: 有表格或笔画密集的页面直接用最大的模型，其余页面先用最小的模型，置信度低时逐级升级
+- quality: 始终使用最大的模型
+"""
+
+import threading
+from collections import deque
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from inference_scheduler import percentile
+from tile_budget import ANALYSIS_SIZE, INK_CONTRAST, analyze_density
+
+PRIORITY_SPEED = "speed"
+PRIORITY_AUTO = "auto"
+PRIORITY_QUALITY = "quality"
+PRIORITIES = (PRIORITY_SPEED, PRIORITY_AUTO, PRIORITY_QUALITY)
+
+ROUTE_PRIORITY = "priority"
+ROUTE_TABLE = "table"
+ROUTE_DENSE = "dense_text"
+ROUTE_SPARSE = "sparse_text"
+ROUTE_NO_FEATURES = "no_features"
+
+TABLE_LINE_RATIO = 0.4  # 墨迹占整行（列）宽度的比例超过该值视为一条表格线
+LATENCY_WINDOW = 256  # 延迟分位数统计的样本数
+
+
+class RouterSettings(NamedTuple):
+    """路由参数"""
+    dense_edge_ratio: float = 0.05  # 笔画边缘占比不低于该值视为密集小字，使用最大的模型
+    min_table_lines: int = 3  # 横线与竖线都不少于该数量时视为表格，使用最大的模型
+    min_confidence: float = 0.85  # 回答置信度低于该值时升级到更大一级
+
+
+def settings_from_config(config: Dict) -> RouterSettings:
+    defaults = RouterSettings()
+    return RouterSettings(
+        dense_edge_ratio=config.get("ROUTER_DENSE_EDGE_RATIO", defaults.dense_edge_ratio),
+        min_table_lines=config.get("ROUTER_MIN_TABLE_LINES", defaults.min_table_lines),
+        min_confidence=config.get("CASCADE_MIN_CONFIDENCE", defaults.min_confidence),
+    )
+
+
+def validate_priority(priority: str) -> str:
+    if priority not in PRIORITIES:
+        raise ValueError(f"未知的优先级: {priority}，支持: {list(PRIORITIES)}")
+    return priority
+
+
+def _count_lines(mask: np.ndarray) -> int:
+    """相邻的线行合并为一条线后计数"""
+    return int(np.count_nonzero(np.diff(mask.astype(np.int8), prepend=0) == 1))
+
+
+def page_features(image: Image.Image) -> Dict[str, Any]:
+    """在缩小的灰度图上提取路由特征：墨迹/笔画密度与横竖表格线数"""
+    stats = analyze_density(image)
+    factor = max(1, max(image.size) // ANALYSIS_SIZE)
+    small = image.reduce(factor) if factor > 1 else image
+    gray = np.asarray(small.convert("L"), dtype=np.int16)
+    ink = gray < np.percentile(gray, 90) - INK_CONTRAST
+    return {
+        "ink_ratio": round(stats.ink_ratio, 4),
+        "edge_ratio": round(stats.edge_ratio, 4),
+        "content_ratio": round(stats.content_ratio, 4),
+        "horizontal_lines": _count_lines(ink.mean(axis=1) > TABLE_LINE_RATIO),
+        "vertical_lines": _count_lines(ink.mean(axis=0) > TABLE_LINE_RATIO),
+    }
+
+
+def route(features: Optional[Dict[str, Any]], priority: str, tiers: int,
+          settings: RouterSettings) -> Tuple[int, str]:
+    """
+    为页面选择模型级别（0为最小的模型，tiers - 1为最大的模型）
+
+    Returns:
+        (级别, 路由原因)
+    """
+    largest = tiers - 1
+    if priority == PRIORITY_QUALITY:
+        return largest, ROUTE_PRIORITY
+    if priority == PRIORITY_SPEED:
+        return 0, ROUTE_PRIORITY
+    if features is None:
+        return largest, ROUTE_NO_FEATURES
+    if min(features["horizontal_lines"], features["vertical_lines"]) >= settings.min_table_lines:
+        return largest, ROUTE_TABLE
+    if features["edge_ratio"] >= settings.dense_edge_ratio:
+        return largest, ROUTE_DENSE
+    return 0, ROUTE_SPARSE
+
+
+def should_escalate(confidence: Optional[float], tier: int, tiers: int, priority: str,
+                    settings: RouterSettings) -> bool:
+    """auto优先级下非最大一级的回答置信度偏低时升级（置信度未知时不升级）"""
+    return (priority == PRIORITY_AUTO and tier < tiers - 1
+            and confidence is not None and confidence < settings.min_confidence)
+
+
+class ModelStats:
+    """单个模型的加载耗时、路由与处理页数、每页延迟（含排队）与升级率（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.load_time: Optional[float] = None
+        self._routed: Dict[str, int] = {}
+        self._pages = 0
+        self._latency_sum = 0.0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._escalated = 0
+
+    def record_load(self, seconds: float):
+        with self._lock:
+            self.load_time = seconds
+
+    def record_route(self, reason: str):
+        with self._lock:
+            self._routed[reason] = self._routed.get(reason, 0) + 1
+
+    def record_page(self, seconds: float):
+        with self._lock:
+            self._pages += 1
+            self._latency_sum += seconds
+            self._latencies.append(seconds)
+
+    def record_escalation(self):
+        with self._lock:
+            self._escalated += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "load_time": round(self.load_time, 3) if self.load_time is not None else None,
+                "routed": dict(self._routed),
+                "pages": self._pages,
+                "latency": {
+                    "mean": round(self._latency_sum / self._pages, 4) if self._pages else None,
+                    "p50": round(percentile(latencies, 50), 4) if latencies else None,
+                    "p95": round(percentile(latencies, 95), 4) if latencies else None,
+                },
+                "escalated": self._escalated,
+                "escalation_rate": round(self._escalated / self._pages, 4) if self._pages else 0.0,
+            }
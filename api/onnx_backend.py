@@ -0,0 +1,91 @@
+"""
+ONNX Runtime CPU后端
+
+视觉编码器（InternViT + pixel shuffle + mlp1投影，即model.extract_feature）导出为ONNX，
+由ONNX Runtime在CPU上执行；chat/batch_chat内部调用extract_feature时改走ORT会话。
+
+语言模型仍由torch执行（可叠加CPU_INT8_DYNAMIC等CPU优化）：InternVL的生成以
+inputs_embeds（图像特征填入文本embedding）为输入并依赖KV缓存，现成的ORT生成封装
+不支持这种输入方式，逐步解码的手工导出收益有限，暂不导出。
+
+ONNX文件默认位于 MODEL_PATH/onnx/vision_encoder.onnx（ONNX_VISION_PATH可指定），
+不存在时首次加载自动导出。
+"""
+
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import torch
+
+from inference_backend import HFBackend, PhaseFn
+
+logger = logging.getLogger(__name__)
+
+ONNX_OPSET = 17
+
+
+class _VisionEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.extract_feature(pixel_values)
+
+
+def export_vision_encoder(model, path: Path, image_size: int = 448):
+    """把float32模型的extract_feature导出为ONNX（分块数为动态维度）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    dummy = torch.zeros(1, 3, image_size, image_size, dtype=torch.float32)
+    with torch.no_grad():
+        torch.onnx.export(
+            _VisionEncoder(model), (dummy,), str(path),
+            input_names=["pixel_values"],
+            output_names=["vit_embeds"],
+            dynamic_axes={"pixel_values": {0: "patches"}, "vit_embeds": {0: "patches"}},
+            opset_version=ONNX_OPSET
+        )
+    logger.info(f"✅ 视觉编码器已导出为ONNX: {path}")
+
+
+class OnnxRuntimeBackend(HFBackend):
+    """视觉编码器走ONNX Runtime（CPUExecutionProvider），语言模型走torch"""
+
+    name = "onnx"
+
+    def __init__(self, model_path, device: str = "cpu", options: Optional[Dict[str, Any]] = None):
+        if device != "cpu":
+            logger.warning(f"⚠️ onnx后端只支持CPU推理，忽略设备 {device}")
+        super().__init__(model_path, "cpu", options)
+        self.session = None
+        self.onnx_path = Path(self.options.get("ONNX_VISION_PATH") or Path(model_path) / "onnx" / "vision_encoder.onnx")
+
+    def _on_weights_loaded(self, model, phase: PhaseFn):
+        import onnxruntime as ort
+
+        with phase("onnx"):
+            if not self.onnx_path.exists():
+                export_vision_encoder(model, self.onnx_path, self.options.get("IMAGE_SIZE", 448))
+            session_options = ort.SessionOptions()
+            session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session_options.intra_op_num_threads = self.options.get("CPU_INTRA_OP_THREADS", 0)
+            session_options.inter_op_num_threads = self.options.get("CPU_INTER_OP_THREADS", 0)
+            self.session = ort.InferenceSession(str(self.onnx_path), session_options,
+                                                providers=["CPUExecutionProvider"])
+            # chat/batch_chat与连续批处理引擎都通过model.extract_feature编码图像
+            model.extract_feature = self._extract_feature
+
+    def _extract_feature(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        array = pixel_values.detach().to(torch.float32).cpu().numpy()
+        vit_embeds, = self.session.run(None, {"pixel_values": array})
+        return torch.from_numpy(vit_embeds)
+
+    def offload(self) -> bool:
+        self.session = None
+        return super().offload()
+
+    def describe(self) -> Dict[str, Any]:
+        info = super().describe()
+        info["onnx_vision_encoder"] = str(self.onnx_path)
+        return info
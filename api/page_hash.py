@@ -0,0 +1,123 @@
+"""
+页面感知哈希
+
+为文档页面计算dHash与pHash（各64位），用于跳过空白分隔页、查找文档内近似重复的
+页面（重复的标题栏页）。64位哈希看不出图号、修订号这类小字的差别，哈希相近只是候选：
+复用此前页面的结果前须以OCR分辨率渲染两页逐像素确认内容相同（same_content）。
+确认只容忍抗锯齿级别的灰度差，只有重复插入的同一页会被复用，重新扫描的同一页不会。
+"""
+
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+PHASH_HIGHFREQ_FACTOR = 4
+INK_CONTRAST = 40  # 比纸面背景暗多少（灰度级）算作墨迹
+BLANK_INK_RATIO = 0.0005  # 墨迹占比低于该值视为空白页（只有页码的页面也算空白）
+CONFIRM_DIFF = INK_CONTRAST  # 逐像素确认时灰度差超过该值的像素视为不同
+
+
+class PageFingerprint(NamedTuple):
+    dhash: int
+    phash: int
+    ink_ratio: float
+
+    @property
+    def blank(self) -> bool:
+        return self.ink_ratio < BLANK_INK_RATIO
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SIZE * PHASH_HIGHFREQ_FACTOR)
+
+
+def dhash(gray: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """差值哈希：比较缩小后水平相邻像素的明暗"""
+    pixels = np.asarray(gray.resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(gray: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """感知哈希：缩小图二维DCT的低频系数与其中位数比较"""
+    size = hash_size * PHASH_HIGHFREQ_FACTOR
+    pixels = np.asarray(gray.resize((size, size), Image.LANCZOS), dtype=np.float64)
+    dct = _DCT @ pixels @ _DCT.T
+    low = dct[:hash_size, :hash_size]
+    return _bits_to_int(low > np.median(low))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def fingerprint(image: Image.Image) -> PageFingerprint:
+    """计算页面指纹（哈希与墨迹占比）"""
+    gray = image if image.mode == "L" else image.convert("L")
+    pixels = np.asarray(gray, dtype=np.int16)
+    background = np.percentile(pixels, 90)
+    ink_ratio = float((pixels < background - INK_CONTRAST).mean())
+    return PageFingerprint(dhash(gray), phash(gray), ink_ratio)
+
+
+class PageDeduplicator:
+    """
+    文档内近似重复页面的候选查找
+
+    只有dHash与pHash的汉明距离都不超过阈值才是候选；候选须再经same_content确认，
+    版式相同、只有图号或修订号不同的页面哈希距离可能为0。
+    """
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        self._pages: List[Tuple[int, PageFingerprint]] = []
+
+    def candidates(self, page_fingerprint: PageFingerprint) -> List[Tuple[int, int]]:
+        """哈希距离不超过阈值的已登记页面，按距离从近到远返回 [(页索引, 汉明距离)]"""
+        found = []
+        for page_index, known in self._pages:
+            distance = max(hamming(known.dhash, page_fingerprint.dhash),
+                           hamming(known.phash, page_fingerprint.phash))
+            if distance <= self.max_distance:
+                found.append((page_index, distance))
+        return sorted(found, key=lambda item: item[1])
+
+    def add(self, page_index: int, page_fingerprint: PageFingerprint):
+        self._pages.append((page_index, page_fingerprint))
+
+
+def same_content(a: Image.Image, b: Image.Image) -> bool:
+    """两页的渲染结果是否相同：尺寸一致且没有灰度差超过CONFIRM_DIFF的像素"""
+    if a.size != b.size:
+        return False
+    pixels_a = np.asarray(a.convert("L"), dtype=np.int16)
+    pixels_b = np.asarray(b.convert("L"), dtype=np.int16)
+    return not bool((np.abs(pixels_a - pixels_b) > CONFIRM_DIFF).any())
+
+
+def format_hash(value: int) -> str:
+    return f"{value:016x}"
+
+
+def describe(page_fingerprint: PageFingerprint) -> Dict[str, object]:
+    """报告用的指纹信息"""
+    return {
+        "dhash": format_hash(page_fingerprint.dhash),
+        "phash": format_hash(page_fingerprint.phash),
+        "ink_ratio": round(page_fingerprint.ink_ratio, 5),
+    }
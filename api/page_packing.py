@@ -0,0 +1,161 @@
+"""
+多页打包：若干稀疏页面合并为一次多图推理
+
+手册中很多页面只有半页内容，自适应分块预算（tile_budget.py）只给它们1~6个分块，
+但每页仍要单独付出一次对话模板、提示词与生成启动的开销。打包把分块数不超过
+max_page_patches 的页面按分块预算合并为一次InternVL多图对话：
+
+    Image-1: <image>
+    Image-2: <image>
+    {提示词}
+    {按图片分节作答的说明}
+
+模型按 "=== Image-k ===" 标记行分节作答，回答按标记拆回各页。标记缺失、重复或乱序、
+分节为空，以及生成未正常结束（截断）时的最后一节视为拆分失败，该页单独重新推理，
+不会把一页的内容错配给另一页：某一页的标记缺失时，它前面一节的结尾无法确定
+（可能混入缺失页的内容），前面一节同样视为失败。
+"""
+
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+PACK_MARKER = "=== Image-{index} ==="
+_MARKER_LINE = re.compile(r"^[ \t]*=+[ \t]*Image-(\d+)[ \t]*=+[ \t]*$", re.MULTILINE)
+_IMAGE_LINE = re.compile(r"^Image-\d+: <image>$")
+_INSTRUCTION = "请依次识别以上{count}张图片，每张图片的回答以单独一行的 " + PACK_MARKER.format(index="k") + \
+               " 开头（k为图片序号），不同图片的内容不要合并。"
+
+
+class PackSettings(NamedTuple):
+    """打包参数"""
+    enabled: bool = False  # /ocr/pdf未指定pack时是否打包
+    patch_budget: int = 13  # 一次打包推理的分块总数上限（默认与单页最多分块数+缩略图相同）
+    max_page_patches: int = 6  # 分块数不超过该值的页面才参与打包
+    max_pages: int = 4  # 一次打包推理的最多页数
+    max_wait_ms: float = 100  # 第一页到达后最多等待其余页面的时间
+    marker_tokens: int = 16  # 每页分节标记额外预留的生成token数
+
+
+def settings_from_config(config: Dict) -> PackSettings:
+    defaults = PackSettings()
+    return PackSettings(
+        enabled=config.get("PACK_ENABLED", defaults.enabled),
+        patch_budget=config.get("PACK_PATCH_BUDGET", defaults.patch_budget),
+        max_page_patches=config.get("PACK_MAX_PAGE_PATCHES", defaults.max_page_patches),
+        max_pages=config.get("PACK_MAX_PAGES", defaults.max_pages),
+        max_wait_ms=config.get("PACK_MAX_WAIT_MS", defaults.max_wait_ms),
+        marker_tokens=config.get("PACK_MARKER_TOKENS", defaults.marker_tokens),
+    )
+
+
+def packable(num_patches: int, settings: PackSettings) -> bool:
+    """页面是否足够稀疏、可以参与打包"""
+    return num_patches <= min(settings.max_page_patches, settings.patch_budget)
+
+
+def fits(group_patches: int, group_pages: int, num_patches: int, settings: PackSettings) -> bool:
+    """页面能否加入已有group_pages页、共group_patches个分块的打包"""
+    return group_pages < settings.max_pages and group_patches + num_patches <= settings.patch_budget
+
+
+def pack_marker(index: int) -> str:
+    """第index张图片（从1开始）回答的分节标记"""
+    return PACK_MARKER.format(index=index)
+
+
+def build_packed_question(prompt: str, count: int) -> str:
+    """count张图片共用提示词的多图问题（每张图片一个<image>占位，顺序与num_patches_list一致）"""
+    images = "\n".join(f"Image-{index}: <image>" for index in range(1, count + 1))
+    return f"{images}\n{prompt}\n{_INSTRUCTION.format(count=count)}"
+
+
+def packed_prompt(question: str) -> str:
+    """从多图问题中取回原提示词（build_packed_question的逆过程）"""
+    lines = question.split("\n")
+    while lines and _IMAGE_LINE.match(lines[0]):
+        lines.pop(0)
+    return "\n".join(lines[:-1])
+
+
+def split_packed_answer(text: str, count: int, complete: bool = True) -> List[Optional[str]]:
+    """
+    按分节标记把打包推理的回答拆回各页
+
+    标记须按序号递增出现；重复或乱序的标记不作为分节，它所在的一节无法确定归属，视为拆分失败。
+    一节只有在紧接着下一页的标记（最后一页则到回答结尾）时才有效：中间缺失标记时，
+    缺失页的内容会并入前一节，前一节视为拆分失败；最后一个标记不是第count页时同理。
+    第一个标记之前的文字丢弃。
+
+    Args:
+        text: 打包推理的回答
+        count: 图片数
+        complete: 生成是否正常结束；未正常结束时最后一节可能被截断，视为拆分失败
+
+    Returns:
+        各页的回答，拆分失败的页面为None
+    """
+    starts = []  # (序号, 标记行起点, 标记行终点)
+    stray = []  # 重复或乱序的标记行起点
+    last = 0
+    for match in _MARKER_LINE.finditer(text):
+        index = int(match.group(1))
+        if last < index <= count:
+            starts.append((index, match.start(), match.end()))
+            last = index
+        else:
+            stray.append(match.start())
+
+    answers: List[Optional[str]] = [None] * count
+    for position, (index, _, end) in enumerate(starts):
+        if position + 1 < len(starts):
+            next_index, stop, _ = starts[position + 1]
+        else:
+            next_index, stop = count + 1, len(text)
+        if next_index != index + 1:
+            continue
+        if any(end <= start < stop for start in stray):
+            continue
+        answer = text[end:stop].strip()
+        answers[index - 1] = answer or None
+    if not complete and starts:
+        answers[starts[-1][0] - 1] = None
+    return answers
+
+
+class PackStats:
+    """打包次数、每次的页数与分块数、拆分失败与未打包的页数（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._packs = 0
+        self._packed_pages = 0
+        self._packed_patches = 0
+        self._split_failures = 0
+        self._unpacked = {"dense": 0, "alone": 0}
+
+    def record_pack(self, pages: int, patches: int):
+        with self._lock:
+            self._packs += 1
+            self._packed_pages += pages
+            self._packed_patches += patches
+
+    def record_split_failures(self, pages: int):
+        with self._lock:
+            self._split_failures += pages
+
+    def record_unpacked(self, dense: bool):
+        """未打包的页面：dense为分块数超过上限，否则为等待期间没有可合并的页面"""
+        with self._lock:
+            self._unpacked["dense" if dense else "alone"] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "packs": self._packs,
+                "packed_pages": self._packed_pages,
+                "mean_pages_per_pack": round(self._packed_pages / self._packs, 2) if self._packs else None,
+                "mean_patches_per_pack": round(self._packed_patches / self._packs, 2) if self._packs else None,
+                "split_failures": self._split_failures,
+                "unpacked_pages": dict(self._unpacked),
+            }
@@ -0,0 +1,141 @@
+"""
+PDF页面光栅化
+
+服务端直接读取上传的PDF，按分块网格推算渲染分辨率：页面恰好渲染到
+(列数×448, 行数×448) 左右的像素尺寸，避免过度渲染或渲染不足，
+并直接生成RGB图像，无需JPEG重新编码。
+
+渲染函数接受PDF字节（每次调用打开一次文档）或PdfDocument（已解析的文档，同一份PDF的多页共用）。
+"""
+
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import List, Tuple, Union
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from image_preprocess import select_grid
+
+
+class PageRangeError(ValueError):
+    """页码范围格式错误"""
+
+
+def parse_page_range(spec: str, total_pages: int) -> List[int]:
+    """
+    解析页码范围（从1开始），返回从0开始的页索引列表
+
+    支持 "1-3,5,8-" 形式；空字符串表示全部页面
+    """
+    if not spec or not spec.strip():
+        return list(range(total_pages))
+
+    pages: List[int] = []
+    seen = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start_str, end_str = part.split("-", 1)
+                start = int(start_str) if start_str.strip() else 1
+                end = int(end_str) if end_str.strip() else total_pages
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise PageRangeError(f"无效的页码范围: {part}")
+        if start < 1 or end > total_pages or start > end:
+            raise PageRangeError(f"页码范围 {part} 超出文档页数 1-{total_pages}")
+        for page in range(start - 1, end):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+    return pages
+
+
+class PdfDocument:
+    """已解析的PDF，各页渲染共用（MuPDF文档不能被多个线程同时使用，取页渲染时加锁）"""
+
+    def __init__(self, pdf_bytes: bytes):
+        self._doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc)
+
+    @contextmanager
+    def page(self, page_index: int):
+        with self._lock:
+            yield self._doc[page_index]
+
+
+PdfInput = Union[bytes, PdfDocument]
+
+
+@contextmanager
+def open_page(pdf: PdfInput, page_index: int):
+    """取得PDF的一页（PDF字节时临时打开文档，退出时关闭）"""
+    if isinstance(pdf, PdfDocument):
+        with pdf.page(page_index) as page:
+            yield page
+        return
+    with fitz.open(stream=pdf, filetype="pdf") as doc:
+        yield doc[page_index]
+
+
+def render_zoom(page_width: float, page_height: float, image_size: int = 448, max_num: int = 12,
+                min_zoom: float = 1.0, max_zoom: float = 4.0) -> float:
+    """按页面尺寸（pt）选出的分块网格计算渲染缩放倍数"""
+    cols, rows = select_grid(max(1, round(page_width)), max(1, round(page_height)), image_size, max_num)
+    zoom = max(cols * image_size / page_width, rows * image_size / page_height)
+    return min(max_zoom, max(min_zoom, zoom))
+
+
+def pdf_digest(pdf_bytes: bytes) -> bytes:
+    """PDF内容摘要，用于生成各页的缓存键"""
+    return hashlib.sha256(pdf_bytes).digest()
+
+
+def count_pages(pdf: PdfInput) -> int:
+    if isinstance(pdf, PdfDocument):
+        return len(pdf)
+    with fitz.open(stream=pdf, filetype="pdf") as doc:
+        return len(doc)
+
+
+def rasterize_page(pdf: PdfInput, page_index: int, image_size: int = 448, max_num: int = 12,
+                   min_zoom: float = 1.0, max_zoom: float = 4.0) -> Tuple[Image.Image, float]:
+    """
+    将PDF的一页渲染为RGB图片
+
+    Returns:
+        (图片, 实际使用的缩放倍数)
+    """
+    with open_page(pdf, page_index) as page:
+        rect = page.rect
+        zoom = render_zoom(rect.width, rect.height, image_size, max_num, min_zoom, max_zoom)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    return image, zoom
+
+
+def render_full_gray(pdf: PdfInput, page_index: int, image_size: int = 448, max_num: int = 12,
+                     min_zoom: float = 1.0, max_zoom: float = 4.0) -> Image.Image:
+    """以OCR所用的分辨率渲染PDF页面的灰度图（用于逐像素确认近似重复页）"""
+    with open_page(pdf, page_index) as page:
+        rect = page.rect
+        zoom = render_zoom(rect.width, rect.height, image_size, max_num, min_zoom, max_zoom)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def render_preview(pdf: PdfInput, page_index: int, max_side: int = 1024) -> Image.Image:
+    """以较低分辨率渲染PDF页面的灰度预览（用于空白检测与感知哈希）"""
+    with open_page(pdf, page_index) as page:
+        rect = page.rect
+        zoom = max_side / max(rect.width, rect.height)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
@@ -0,0 +1,426 @@
+"""
+CPU预处理流水线
+
+图片解码/PDF渲染、分块与归一化在独立的进程池中执行：推理线程生成第N个请求时，
+第N+1个请求已经在其他进程中完成预处理，GPU不再空等CPU。预处理结果写入父进程
+预先分配的共享内存槽位，进程间只传递槽位名称与张量形状，避免pickle传输大张量。
+上传的PDF每个请求只写入共享内存一次（SharedDocument），各页任务只携带块名称与页码；
+每个进程对同一份文档只复制、解析一次（open_document），之后各页直接渲染。
+
+各阶段（预处理、生成）的忙碌时间与二者重叠的时间由StageMetrics统计。
+"""
+
+import io
+import time
+import uuid
+import asyncio
+import weakref
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from PIL import Image
+
+from image_preprocess import load_image
+from model_router import page_features
+from pdf_ingest import PdfDocument, rasterize_page
+from tile_budget import plan_tiles, record_dropped_tiles
+from vision_cache import tile_hashes
+
+logger = logging.getLogger(__name__)
+
+
+class SourceDecodeError(ValueError):
+    """图片或PDF页面无法解码"""
+
+
+class ImageSource(NamedTuple):
+    """待预处理的图片来源（可跨进程传递）"""
+    kind: str  # "image" 或 "pdf"
+    data: bytes  # 图片或PDF内容；PDF放在共享内存中时为空
+    page_index: int = 0
+    min_zoom: float = 1.0
+    max_zoom: float = 4.0
+    document: Optional["SharedDocument"] = None  # 共享内存中的PDF（跨进程时只传递块名称）
+
+
+# 每个进程缓存最近打开的几份共享PDF（按块名称），同一请求的各页只解析一次
+DOCUMENT_CACHE_SIZE = 4
+_open_documents: "OrderedDict[str, PdfDocument]" = OrderedDict()
+_documents_lock = threading.Lock()
+
+
+def open_document(name: str, size: int) -> PdfDocument:
+    """按共享内存块名称取得已解析的PDF，本进程首次访问时从共享内存复制并解析"""
+    with _documents_lock:
+        document = _open_documents.get(name)
+        if document is not None:
+            _open_documents.move_to_end(name)
+            return document
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            data = bytes(block.buf[:size])
+        finally:
+            block.close()
+        document = PdfDocument(data)
+        _open_documents[name] = document
+        # 淘汰的文档不显式关闭：正在渲染它的线程仍持有引用，释放后由MuPDF回收
+        while len(_open_documents) > DOCUMENT_CACHE_SIZE:
+            _open_documents.popitem(last=False)
+        return document
+
+
+def _release_block(block: shared_memory.SharedMemory, name: str):
+    with _documents_lock:
+        _open_documents.pop(name, None)
+    block.close()
+    block.unlink()
+
+
+def _attach_document(name: str, size: int, min_zoom: float, max_zoom: float) -> "SharedDocument":
+    document = SharedDocument.__new__(SharedDocument)
+    document.name, document.size, document.min_zoom, document.max_zoom = name, size, min_zoom, max_zoom
+    return document
+
+
+class SharedDocument:
+    """
+    一次请求上传的PDF，只写入共享内存一次，各页的预处理任务按块名称取用
+
+    跨进程传递（pickle）时只携带块名称与字节数，不再随每页复制整份文档。父进程中最后一个引用
+    （请求本身、各页的ImageSource、细化与合并请求的任务）释放时归还共享内存，
+    因此请求结束后仍在进行的细化或被合并的推理不会读到已释放的文档。
+    """
+
+    def __init__(self, data: bytes, min_zoom: float = 1.0, max_zoom: float = 4.0):
+        # 名称唯一，工作进程按名称缓存的文档不会与之后的请求混淆
+        block = shared_memory.SharedMemory(name=f"pdf_{uuid.uuid4().hex[:24]}", create=True, size=max(1, len(data)))
+        block.buf[:len(data)] = data
+        self.name = block.name
+        self.size = len(data)
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        weakref.finalize(self, _release_block, block, self.name)
+
+    def __reduce__(self):
+        return _attach_document, (self.name, self.size, self.min_zoom, self.max_zoom)
+
+    @property
+    def document(self) -> PdfDocument:
+        """本进程中已解析的文档"""
+        return open_document(self.name, self.size)
+
+    def page_count(self) -> int:
+        return len(self.document)
+
+    def page(self, page_index: int) -> ImageSource:
+        """第page_index页（从0开始）的图片来源"""
+        return ImageSource("pdf", b"", page_index, self.min_zoom, self.max_zoom, self)
+
+
+def source_pdf(source: ImageSource) -> Union[bytes, PdfDocument]:
+    """PDF来源的文档：共享内存中的PDF返回已解析的文档，否则返回PDF字节"""
+    return source.document.document if source.document is not None else source.data
+
+
+def load_source(source: ImageSource, image_size: int = 448, max_num: int = 12) -> Image.Image:
+    """解码图片或渲染PDF页面，返回RGB图片"""
+    try:
+        if source.kind == "pdf":
+            image, _ = rasterize_page(source_pdf(source), source.page_index, image_size, max_num,
+                                      source.min_zoom, source.max_zoom)
+            return image
+        image = Image.open(io.BytesIO(source.data))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+    except Exception as e:
+        raise SourceDecodeError(str(e)) from e
+
+
+def preprocess_source(source: ImageSource,
+                      tile_settings: Dict[str, Any]) -> Tuple[torch.Tensor, Dict[str, Any], Dict[str, float]]:
+    """
+    解码并预处理
+
+    Args:
+        tile_settings: {"image_size", "max_num", "preset"}，preset非空时按内容密度选择分块数；
+            "route"为真时同时提取模型级联路由的页面特征（见model_router.py）
+
+    Returns:
+        (pixel_values, {"image_size": 原图尺寸"宽x高", "tiles": 分块信息, "tile_keys": 各分块内容哈希,
+         "route": 路由特征或None}, 各步骤耗时)
+    """
+    image_size, max_num = tile_settings["image_size"], tile_settings["max_num"]
+    started = time.perf_counter()
+    image = load_source(source, image_size, max_num)
+    decoded = time.perf_counter()
+
+    drop_blank_tiles, tile_info = False, None
+    if tile_settings.get("preset"):
+        max_num, drop_blank_tiles, tile_info = plan_tiles(image, tile_settings["preset"], image_size, max_num)
+    route_features = page_features(image) if tile_settings.get("route") else None
+    planned = time.perf_counter()
+
+    pixel_values = load_image(image, input_size=image_size, max_num=max_num, drop_blank_tiles=drop_blank_tiles)
+    if tile_info is not None:
+        record_dropped_tiles(tile_info, pixel_values.shape[0])
+    tiled = time.perf_counter()
+
+    # 视觉特征缓存的键，在预处理进程中计算，不占用推理线程
+    tile_keys = tile_hashes(pixel_values)
+
+    timings = {
+        "decode": decoded - started,
+        "analyze": planned - decoded,
+        "tile": tiled - planned,
+        "hash": time.perf_counter() - tiled,
+    }
+    info = {"image_size": f"{image.width}x{image.height}", "tiles": tile_info, "tile_keys": tile_keys,
+            "route": route_features}
+    return pixel_values, info, timings
+
+
+# ==================== 进程池工作进程 ====================
+
+_attached_slots: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def _init_worker(num_threads: int):
+    torch.set_num_threads(num_threads)
+
+
+def _attach_slot(name: str) -> shared_memory.SharedMemory:
+    slot = _attached_slots.get(name)
+    if slot is None:
+        slot = shared_memory.SharedMemory(name=name)
+        _attached_slots[name] = slot
+    return slot
+
+
+def _preprocess_into_slot(source: ImageSource, tile_settings: Dict[str, Any],
+                          slot_name: str, slot_bytes: int) -> Dict[str, Any]:
+    """工作进程中执行预处理，并把结果写入共享内存槽位"""
+    pixel_values, info, timings = preprocess_source(source, tile_settings)
+    result = {"shape": tuple(pixel_values.shape), "info": info, "timings": timings}
+
+    if pixel_values.numel() * pixel_values.element_size() > slot_bytes:
+        # 超出槽位容量（分块上限高于槽位规格），退回pickle传输
+        result["pixel_values"] = pixel_values
+        return result
+
+    started = time.perf_counter()
+    slot = _attach_slot(slot_name)
+    target = np.ndarray(pixel_values.shape, dtype=np.float32, buffer=slot.buf)
+    target[...] = pixel_values.numpy()
+    del target
+    timings["write"] = time.perf_counter() - started
+    return result
+
+
+# ==================== 阶段统计 ====================
+
+class StageMetrics:
+    """统计各阶段的忙碌时间及所有阶段同时进行（重叠）的时间"""
+
+    def __init__(self, stages: Sequence[str]):
+        self.stages = tuple(stages)
+        self._lock = threading.Lock()
+        self._active = {stage: 0 for stage in self.stages}
+        self._busy = {stage: 0.0 for stage in self.stages}
+        self._count = {stage: 0 for stage in self.stages}
+        self._step_time: Dict[str, float] = {}
+        self._overlap = 0.0
+        self._started = self._last = time.perf_counter()
+
+    def _advance_locked(self) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        for stage, active in self._active.items():
+            if active:
+                self._busy[stage] += elapsed
+        if all(self._active.values()):
+            self._overlap += elapsed
+        self._last = now
+        return now
+
+    @contextmanager
+    def stage(self, name: str):
+        """标记一段处于name阶段的区间（可多个并发）"""
+        with self._lock:
+            self._advance_locked()
+            self._active[name] += 1
+            self._count[name] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._advance_locked()
+                self._active[name] -= 1
+
+    def track(self, name: str, fn):
+        """包装函数，使其执行期间计入name阶段"""
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def add_step_time(self, timings: Dict[str, float]):
+        """累计各步骤的实际耗时（解码、分块、共享内存读写等）"""
+        with self._lock:
+            for step, seconds in timings.items():
+                self._step_time[step] = self._step_time.get(step, 0.0) + seconds
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            now = self._advance_locked()
+            wall_time = now - self._started
+            busy = dict(self._busy)
+            stages = {
+                stage: {
+                    "count": self._count[stage],
+                    "active": self._active[stage],
+                    "busy_time": round(busy[stage], 3),
+                    "utilization": round(busy[stage] / wall_time, 4) if wall_time else 0.0,
+                }
+                for stage in self.stages
+            }
+            overlap = self._overlap
+            step_time = {step: round(seconds, 3) for step, seconds in self._step_time.items()}
+        shortest = min(busy.values()) if busy else 0.0
+        return {
+            "wall_time": round(wall_time, 3),
+            "stages": stages,
+            "overlap_time": round(overlap, 3),
+            # 较短阶段中与其他阶段重叠的比例，1.0表示完全被掩盖
+            "overlap_ratio": round(overlap / shortest, 4) if shortest else 0.0,
+            "step_time": step_time,
+        }
+
+
+# ==================== 流水线 ====================
+
+class PreprocessPipeline:
+    """
+    进程池预处理流水线
+
+    共享内存槽位数为进程数的2倍，使进程池始终有排队的任务；槽位在结果复制到
+    （CUDA可用时为锁页的）普通张量后立即归还。processes为0时退化为在线程池中预处理。
+    """
+
+    def __init__(self, processes: int = 2, max_patches: int = 13, image_size: int = 448,
+                 thread_executor=None, pin_memory: bool = False):
+        self.processes = processes
+        self.slot_bytes = max_patches * 3 * image_size * image_size * 4  # float32
+        self.thread_executor = thread_executor
+        self.pin_memory = pin_memory
+        self.metrics = StageMetrics(("preprocess", "generate"))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = []
+        self._free_slots: Optional[asyncio.Queue] = None
+
+    @property
+    def uses_processes(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """启动进程池并分配共享内存槽位（需在事件循环中调用）"""
+        if self.processes <= 0 or self._executor is not None:
+            return
+        try:
+            # spawn避免fork已初始化CUDA与多线程的父进程
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(1,)
+            )
+            self._slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+                           for _ in range(self.processes * 2)]
+        except Exception as e:
+            logger.warning(f"⚠️ 预处理进程池启动失败，改为线程池预处理: {e}")
+            self.stop()
+            return
+        self._free_slots = asyncio.Queue()
+        for index in range(len(self._slots)):
+            self._free_slots.put_nowait(index)
+        logger.info(f"✅ 预处理进程池已启动: {self.processes} 个进程，{len(self._slots)} 个共享内存槽位 "
+                    f"({self.slot_bytes / 1024 / 1024:.1f}MB/槽位)")
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []
+
+    async def run(self, source: ImageSource,
+                  tile_settings: Dict[str, Any]) -> Tuple[torch.Tensor, Dict[str, Any]]:
+        """预处理一张图片，返回 (pixel_values, {"image_size", "tiles"})"""
+        if self._executor is None:
+            loop = asyncio.get_running_loop()
+            with self.metrics.stage("preprocess"):
+                pixel_values, info, timings = await loop.run_in_executor(
+                    self.thread_executor, preprocess_source, source, tile_settings)
+            self.metrics.add_step_time(timings)
+            return pixel_values, info
+
+        slot_index = await self._free_slots.get()
+        slot = self._slots[slot_index]
+        future = self._executor.submit(
+            _preprocess_into_slot, source, tile_settings, slot.name, self.slot_bytes)
+        try:
+            with self.metrics.stage("preprocess"):
+                result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.done():
+                # 工作进程仍可能写入该槽位，待其结束后再归还
+                loop = asyncio.get_running_loop()
+                future.add_done_callback(
+                    lambda _: loop.call_soon_threadsafe(self._free_slots.put_nowait, slot_index))
+            else:
+                self._free_slots.put_nowait(slot_index)
+            raise
+        except BaseException:
+            self._free_slots.put_nowait(slot_index)
+            raise
+
+        try:
+            return self._take(slot, result), result["info"]
+        finally:
+            self._free_slots.put_nowait(slot_index)
+
+    def _take(self, slot: shared_memory.SharedMemory, result: Dict[str, Any]) -> torch.Tensor:
+        """把槽位中的结果复制到独立张量，之后槽位即可复用"""
+        timings = result["timings"]
+        if "pixel_values" in result:
+            self.metrics.add_step_time(timings)
+            return result["pixel_values"]
+
+        started = time.perf_counter()
+        view = np.ndarray(result["shape"], dtype=np.float32, buffer=slot.buf)
+        pixel_values = torch.empty(result["shape"], dtype=torch.float32, pin_memory=self.pin_memory)
+        pixel_values.copy_(torch.from_numpy(view))
+        del view
+        timings["read"] = time.perf_counter() - started
+        self.metrics.add_step_time(timings)
+        return pixel_values
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metrics = self.metrics.get_metrics()
+        metrics.update({
+            "mode": "process" if self.uses_processes else "thread",
+            "processes": self.processes if self.uses_processes else 0,
+            "slots": len(self._slots),
+            "free_slots": self._free_slots.qsize() if self._free_slots is not None else 0,
+        })
+        return metrics
@@ -0,0 +1,147 @@
+"""
+渐进式识别：低分辨率快速识别 + 按需高分辨率细化
+
+多数页面用1~4个分块就能读清，却总要为12个分块付出代价。渐进式识别先以较小的分块预算
+（draft预设）识别并立即返回初稿；置信度（token概率的几何平均，见token_confidence.py）偏低、
+或初稿/页面看起来是密集表格的页面，再排队以高分辨率（accurate预设）细化。细化结果就地替换初稿：
+写入初稿的结果缓存键，之后同一页面的渐进式请求直接得到细化结果；PDF的NDJSON流中以
+同页码的新行替换此前的初稿行。
+
+细化任务独立于返回初稿的请求运行（客户端通过refinement_id查询结果），
+RefinementRegistry只保留最近的若干个任务。
+"""
+
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+from tile_budget import DENSE_EDGE_RATIO
+
+REFINE_LOW_CONFIDENCE = "low_confidence"
+REFINE_DENSE_TABLE = "dense_table"
+REFINE_REASONS = (REFINE_LOW_CONFIDENCE, REFINE_DENSE_TABLE)
+
+STAGE_DRAFT = "draft"
+STAGE_REFINED = "refined"
+
+
+class ProgressiveSettings(NamedTuple):
+    """渐进式识别参数"""
+    draft_preset: str = "draft"  # 第一遍的分块预设
+    refine_preset: str = "accurate"  # 细化的分块预设
+    min_confidence: float = 0.85  # 初稿置信度低于该值时细化
+    table_rows: int = 8  # 初稿中的表格行（"|"开头）不少于该值时视为密集表格
+    dense_edge_ratio: float = DENSE_EDGE_RATIO  # 页面笔画边缘占比不低于该值且含表格时视为密集表格
+
+
+def settings_from_config(config: Dict) -> ProgressiveSettings:
+    defaults = ProgressiveSettings()
+    return ProgressiveSettings(
+        draft_preset=config.get("PROGRESSIVE_DRAFT_PRESET", defaults.draft_preset),
+        refine_preset=config.get("PROGRESSIVE_REFINE_PRESET", defaults.refine_preset),
+        min_confidence=config.get("PROGRESSIVE_MIN_CONFIDENCE", defaults.min_confidence),
+        table_rows=config.get("PROGRESSIVE_TABLE_ROWS", defaults.table_rows),
+        dense_edge_ratio=config.get("PROGRESSIVE_DENSE_EDGE_RATIO", defaults.dense_edge_ratio),
+    )
+
+
+def count_table_rows(text: str) -> int:
+    """回答中Markdown表格的行数"""
+    return sum(1 for line in text.splitlines() if line.lstrip().startswith("|"))
+
+
+def refinement_reason(result: Dict[str, Any], settings: ProgressiveSettings) -> Optional[str]:
+    """初稿是否需要高分辨率细化，需要时返回原因"""
+    confidence = result.get("confidence")
+    if confidence is not None and confidence < settings.min_confidence:
+        return REFINE_LOW_CONFIDENCE
+    table_rows = count_table_rows(result.get("raw_text", ""))
+    if table_rows >= settings.table_rows:
+        return REFINE_DENSE_TABLE
+    tiles = result.get("metadata", {}).get("tiles") or {}
+    if table_rows and tiles.get("edge_ratio", 0.0) >= settings.dense_edge_ratio:
+        return REFINE_DENSE_TABLE
+    return None
+
+
+class RefinementRegistry:
+    """细化任务的状态与结果（只保留最近max_jobs个，线程安全）"""
+
+    def __init__(self, max_jobs: int = 256):
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def create(self, reason: str, draft_confidence: Optional[float]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"status": "pending", "reason": reason, "draft_confidence": draft_confidence}
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return job_id
+
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(status="done", result=result)
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(status="failed", error=error)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, refinement_id=job_id) if job is not None else None
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] == "pending")
+
+
+class ProgressiveStats:
+    """初稿数、各原因的细化数与细化前后的平均置信度（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._drafts = 0
+        self._refinements = {reason: 0 for reason in REFINE_REASONS}
+        self._failed = 0
+        self._confidence_sum = {STAGE_DRAFT: 0.0, STAGE_REFINED: 0.0}
+        self._confidence_count = {STAGE_DRAFT: 0, STAGE_REFINED: 0}
+
+    def _add_confidence(self, stage: str, confidence: Optional[float]):
+        if confidence is not None:
+            self._confidence_sum[stage] += confidence
+            self._confidence_count[stage] += 1
+
+    def record_draft(self, confidence: Optional[float], reason: Optional[str]):
+        with self._lock:
+            self._drafts += 1
+            self._add_confidence(STAGE_DRAFT, confidence)
+            if reason is not None:
+                self._refinements[reason] += 1
+
+    def record_refined(self, confidence: Optional[float]):
+        with self._lock:
+            self._add_confidence(STAGE_REFINED, confidence)
+
+    def record_failed(self):
+        with self._lock:
+            self._failed += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            refined = sum(self._refinements.values())
+            return {
+                "drafts": self._drafts,
+                "refinements": dict(self._refinements),
+                "refine_rate": round(refined / self._drafts, 4) if self._drafts else 0.0,
+                "refine_failed": self._failed,
+                "mean_confidence": {
+                    stage: round(self._confidence_sum[stage] / count, 4) if count else None
+                    for stage, count in self._confidence_count.items()
+                },
+            }
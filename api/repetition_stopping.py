@@ -0,0 +1,193 @@
+"""
+重复循环检测与提前停止
+
+VLM偶尔会陷入循环，反复输出同一行表格直到max_new_tokens，浪费了最长的生成时间。
+RepetitionDetector在每个解码步增量维护各周期p的尾部匹配长度（t[i] == t[i-p]连续成立的
+位置数），尾部以周期p重复达到 min_repeats 次且跨度不少于 min_span 个token时判定为循环；
+只需O(max_ngram)的比较，不必每步重新扫描。
+
+判定为循环后停止该序列，并在最后一个完整重复处截断（丢弃末尾不完整的片段）。
+
+- 连续批处理引擎在逐token解码时直接使用RepetitionDetector
+- 其他路径通过transformers的StoppingCriteria（GenerationStoppingCriteria）按行停止，
+  生成结束后由finalize()给出各行的停止原因与截断后的token
+
+GenerationStoppingCriteria同时按行执行token预算，并检查各行请求的CancelScope
+（截止时间、客户端断开，见cancellation.py），取消原因即停止原因；
+附带TokenConfidence时finalize()同时给出各行的置信度（见token_confidence.py）。
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import torch
+from transformers import StoppingCriteria
+
+from token_confidence import TokenConfidence
+
+STOP_EOS = "eos"
+STOP_MAX_NEW_TOKENS = "max_new_tokens"
+STOP_REPETITION = "repetition"
+
+
+class RepetitionSettings(NamedTuple):
+    """重复检测参数"""
+    min_ngram: int = 4  # 参与检测的最短重复单元（token）
+    max_ngram: int = 128  # 参与检测的最长重复单元（一行表格通常几十个token）
+    min_repeats: int = 3  # 重复单元至少连续出现的次数
+    min_span: int = 64  # 重复部分的最少token数（避免把表格分隔线等短重复当作循环）
+
+
+class StopInfo(NamedTuple):
+    """单个序列的停止信息"""
+    stop_reason: str
+    generated_tokens: int  # 实际生成的token数（截断前）
+    tokens_saved: int  # 提前停止而未生成的token数
+    confidence: Optional[float] = None  # token概率的几何平均，后端未提供分数时为None
+
+
+def settings_from_config(config: Dict) -> Optional[RepetitionSettings]:
+    """从服务配置读取重复检测参数，未启用时返回None"""
+    if not config.get("REPETITION_STOP_ENABLED", True):
+        return None
+    defaults = RepetitionSettings()
+    return RepetitionSettings(
+        min_ngram=config.get("REPETITION_MIN_NGRAM", defaults.min_ngram),
+        max_ngram=config.get("REPETITION_MAX_NGRAM", defaults.max_ngram),
+        min_repeats=config.get("REPETITION_MIN_REPEATS", defaults.min_repeats),
+        min_span=config.get("REPETITION_MIN_SPAN", defaults.min_span),
+    )
+
+
+class RepetitionDetector:
+    """单个序列的增量重复检测器（settings为None时只记录token）"""
+
+    def __init__(self, settings: Optional[RepetitionSettings]):
+        self.settings = settings
+        self.tokens: List[int] = []
+        # runs[p]: 末尾连续满足 t[i] == t[i-p] 的位置数
+        self._runs = [0] * (settings.max_ngram + 1) if settings is not None else []
+        self.keep: Optional[int] = None  # 检测到循环后应保留的token数
+
+    def append(self, token_id: int) -> bool:
+        """追加一个token，返回是否检测到重复循环"""
+        tokens = self.tokens
+        tokens.append(token_id)
+        settings = self.settings
+        if settings is None:
+            return False
+        n = len(tokens)
+        found = None
+        for period in range(settings.min_ngram, min(settings.max_ngram, n - 1) + 1):
+            if tokens[-1] == tokens[-1 - period]:
+                self._runs[period] += 1
+                span = self._runs[period] + period
+                if found is None and span >= max(period * settings.min_repeats, settings.min_span):
+                    found = (period, span)
+            else:
+                self._runs[period] = 0
+        if found is None:
+            return False
+        # 在最后一个完整重复处截断：保留循环开始前的内容与完整的重复单元
+        period, span = found
+        self.keep = n - span + (span // period) * period
+        return True
+
+
+class GenerationStoppingCriteria(StoppingCriteria):
+    """
+    按行停止陷入循环、达到预算或已取消的序列（transformers >= 4.39的按行StoppingCriteria语义）
+
+    InternVL以inputs_embeds调用generate，input_ids只包含新生成的token。
+    max_new_tokens可以按行给出（同一批中不同提示词类型的token预算），
+    达到本行预算的行同样在此停止。
+    """
+
+    def __init__(self, settings: Optional[RepetitionSettings], batch_size: int, max_new_tokens: Union[int, Sequence[int]],
+                 stop_token_ids: Sequence[int] = (), cancel_scopes: Optional[Sequence[Any]] = None,
+                 confidence: Optional[TokenConfidence] = None):
+        """
+        Args:
+            settings: 重复检测参数，None表示不检测
+            batch_size: 批大小
+            max_new_tokens: token预算，可按行给出
+            stop_token_ids: 正常结束的token
+            cancel_scopes: 各行请求的CancelScope（可为None）
+            confidence: 同一次生成的TokenConfidence（作为logits_processor传给生成过程）
+        """
+        self.settings = settings
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * batch_size
+        self.max_new_tokens = list(max_new_tokens)
+        self.stop_token_ids = set(stop_token_ids)
+        self.cancel_scopes = list(cancel_scopes) if cancel_scopes is not None else [None] * batch_size
+        self._detectors = [RepetitionDetector(settings) for _ in range(batch_size)]
+        self._reasons: List[Optional[str]] = [None] * batch_size
+        self.confidence = confidence
+
+    def __call__(self, input_ids: torch.LongTensor, scores: Optional[torch.FloatTensor] = None, **kwargs) -> torch.BoolTensor:
+        done = []
+        for row, detector in enumerate(self._detectors):
+            scope = self.cancel_scopes[row]
+            if self._reasons[row] is None and scope is not None and scope.cancelled:
+                self._reasons[row] = scope.reason
+            if self._reasons[row] is None:
+                # 前面的步骤已追加过的token不再重复处理
+                for token_id in input_ids[row, len(detector.tokens):].tolist():
+                    if token_id in self.stop_token_ids:
+                        self._reasons[row] = STOP_EOS
+                        break
+                    if detector.append(token_id):
+                        self._reasons[row] = STOP_REPETITION
+                        break
+                    if len(detector.tokens) >= self.max_new_tokens[row]:
+                        self._reasons[row] = STOP_MAX_NEW_TOKENS
+                        break
+            done.append(self._reasons[row] is not None and self._reasons[row] != STOP_EOS)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def tokens(self, row: int) -> List[int]:
+        """该行已生成的token（不含结束token）"""
+        return self._detectors[row].tokens
+
+    def finalize(self, row: int, response: str,
+                 decode: Callable[[List[int]], str]) -> Tuple[str, StopInfo]:
+        """返回该行最终的回答（循环时重新解码截断后的token）与停止信息"""
+        detector = self._detectors[row]
+        generated = len(detector.tokens)
+        reason = self._reasons[row]
+        confidence = self.confidence.confidence(row, generated) if self.confidence is not None else None
+        if reason == STOP_REPETITION:
+            return decode(detector.tokens[:detector.keep]), StopInfo(
+                reason, generated, max(self.max_new_tokens[row] - generated, 0), confidence)
+        if reason is None:
+            reason = STOP_EOS
+        if reason in (STOP_EOS, STOP_MAX_NEW_TOKENS):
+            return response, StopInfo(reason, generated, 0, confidence)
+        # 已取消：回答只有部分内容
+        return decode(detector.tokens), StopInfo(
+            reason, generated, max(self.max_new_tokens[row] - generated, 0), confidence)
+
+
+class StopStats:
+    """按停止原因统计生成结束的序列数与提前停止节省的token数（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reasons: Dict[str, int] = {STOP_EOS: 0, STOP_MAX_NEW_TOKENS: 0, STOP_REPETITION: 0}
+        self._generated_tokens = 0
+        self._tokens_saved = 0
+
+    def record(self, info: StopInfo):
+        with self._lock:
+            self._reasons[info.stop_reason] = self._reasons.get(info.stop_reason, 0) + 1
+            self._generated_tokens += info.generated_tokens
+            self._tokens_saved += info.tokens_saved
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stop_reasons": dict(self._reasons),
+                "generated_tokens": self._generated_tokens,
+                "tokens_saved": self._tokens_saved,
+            }
@@ -0,0 +1,249 @@
+"""
+OCR结果缓存
+
+以 hash(图片字节, 提示词, 模型名称, 生成配置, 分块设置) 为键缓存OCR结果，
+分为两级：进程内存LRU（热数据）与磁盘SQLite（跨重启持久化），各自有容量上限并按
+最近最少使用淘汰。结果以JSON文本保存，命中时返回独立副本。
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(image_bytes: bytes, prompt: str, model_name: str,
+                   generation_config: Dict[str, Any], tile_settings: Dict[str, Any]) -> str:
+    """计算内容寻址的缓存键"""
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    params = json.dumps({
+        "prompt": prompt,
+        "model": model_name,
+        "generation_config": generation_config,
+        "tile_settings": tile_settings,
+    }, sort_keys=True, ensure_ascii=False)
+    digest.update(params.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class MemoryLRUCache:
+    """内存LRU缓存，按条目数和字节数双重限制"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value: str, model_version: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1].encode("utf-8"))
+            self._entries[key] = (model_version, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.encode("utf-8"))
+                self.evictions += 1
+
+    def purge(self, model_version: Optional[str] = None) -> int:
+        with self._lock:
+            keys = [k for k, (version, _) in self._entries.items()
+                    if model_version is None or version == model_version]
+            for key in keys:
+                _, value = self._entries.pop(key)
+                self._bytes -= len(value.encode("utf-8"))
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteResultCache:
+    """磁盘SQLite缓存，超出容量时按最近访问时间淘汰"""
+
+    def __init__(self, db_path: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_results ("
+            " key TEXT PRIMARY KEY,"
+            " model_version TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_results_accessed ON ocr_results(accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_results_model ON ocr_results(model_version)")
+        self._conn.commit()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """返回 (结果JSON, 模型版本)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, model_version FROM ocr_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE ocr_results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0], row[1]
+
+    def put(self, key: str, value: str, model_version: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_results (key, model_version, value, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_version, value, size, now, now)
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM ocr_results ORDER BY accessed_at ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM ocr_results WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def purge(self, model_version: Optional[str] = None) -> int:
+        with self._lock:
+            if model_version is None:
+                cursor = self._conn.execute("DELETE FROM ocr_results")
+            else:
+                cursor = self._conn.execute("DELETE FROM ocr_results WHERE model_version = ?", (model_version,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_results").fetchone()
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "path": str(self.db_path),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OCRResultCache:
+    """两级OCR结果缓存"""
+
+    def __init__(self, memory_max_entries: int = 256, memory_max_bytes: int = 64 * 1024 * 1024,
+                 disk_path: Optional[str] = None, disk_max_bytes: int = 1024 * 1024 * 1024):
+        self.memory = MemoryLRUCache(memory_max_entries, memory_max_bytes)
+        self.disk: Optional[SQLiteResultCache] = None
+        if disk_path:
+            try:
+                self.disk = SQLiteResultCache(disk_path, disk_max_bytes)
+            except Exception as e:
+                logger.warning(f"⚠️ 磁盘缓存初始化失败，仅使用内存缓存: {e}")
+        self._lock = threading.Lock()
+        self._hits = {"memory": 0, "disk": 0}
+        self._misses = 0
+
+    def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        查询缓存
+
+        Returns:
+            (结果副本, 命中层级"memory"/"disk")，未命中返回(None, None)
+        """
+        tier = "memory"
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            tier = "disk"
+            row = self.disk.get(key)
+            if row is not None:
+                # 磁盘命中后提升到内存层
+                value, model_version = row
+                self.memory.put(key, value, model_version)
+
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None, None
+            self._hits[tier] += 1
+        return json.loads(value), tier
+
+    def put(self, key: str, result: Dict[str, Any], model_version: str):
+        """写入两级缓存"""
+        value = json.dumps(result, ensure_ascii=False)
+        self.memory.put(key, value, model_version)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, value, model_version)
+            except Exception as e:
+                logger.warning(f"⚠️ 写入磁盘缓存失败: {e}")
+
+    def purge(self, model_version: Optional[str] = None) -> Dict[str, int]:
+        """按模型版本清除缓存条目，model_version为None时清空全部"""
+        purged = {"memory": self.memory.purge(model_version), "disk": 0}
+        if self.disk is not None:
+            purged["disk"] = self.disk.purge(model_version)
+        logger.info(f"🧹 已清除OCR结果缓存 (model_version={model_version}): {purged}")
+        return purged
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = dict(self._hits)
+            misses = self._misses
+        lookups = sum(hits.values()) + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(sum(hits.values()) / lookups, 4) if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
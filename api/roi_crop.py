@@ -0,0 +1,174 @@
+"""
+感兴趣区域（ROI）裁剪
+
+只需要图纸的标题栏或某一张表格时，不必对整张A0图纸按12个分块重新识别：
+按请求给出的多个边界框从原始分辨率的来源中裁出区域，每个区域按自身尺寸选择分块数，
+再合并为一次批量生成。
+
+- 图片：直接从解码后的原图裁剪，不经过缩放
+- PDF：只渲染边界框对应的区域（clip），缩放倍数按区域尺寸与分块上限推算，
+  不超过PDF_MAX_ZOOM，小区域因此以更高的分辨率渲染
+
+边界框默认使用相对坐标（0~1，相对于页面宽高）；units为pixel时使用像素坐标
+（PDF为72dpi下的页面坐标，即pt）。
+"""
+
+import io
+import json
+import math
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import torch
+from PIL import Image
+
+from image_preprocess import load_image
+from pdf_ingest import open_page, render_zoom
+from preprocess_pipeline import ImageSource, SourceDecodeError, source_pdf
+from tile_budget import plan_tiles, record_dropped_tiles
+from vision_cache import tile_hashes
+
+UNITS = ("ratio", "pixel")
+MIN_REGION_SIZE = 8  # 裁剪区域的最小边长（像素）
+
+
+class RegionError(ValueError):
+    """区域参数格式错误或超出页面范围"""
+
+
+class Region(NamedTuple):
+    """一个待识别的区域"""
+    bbox: Tuple[float, float, float, float]  # (x0, y0, x1, y1)
+    prompt_type: Optional[str] = None  # 为None时使用请求级的提示词类型
+    label: Optional[str] = None  # 版面分析得到的区域类别（text / table / figure），见layout_segment.py
+
+
+def parse_regions(spec: str, prompt_types: Sequence[str], max_regions: int) -> List[Region]:
+    """
+    解析区域列表（JSON）
+
+    支持 [{"bbox": [x0, y0, x1, y1], "prompt_type": "table"}, ...]，
+    不需要单独指定提示词类型的区域也可以直接写成 [x0, y0, x1, y1]
+    """
+    try:
+        items = json.loads(spec)
+    except ValueError as e:
+        raise RegionError(f"regions不是有效的JSON: {e}")
+    if not isinstance(items, list) or not items:
+        raise RegionError("regions必须是非空的列表")
+    if len(items) > max_regions:
+        raise RegionError(f"区域数 {len(items)} 超过上限 {max_regions}")
+
+    regions = []
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            bbox, prompt_type = item.get("bbox"), item.get("prompt_type")
+        else:
+            bbox, prompt_type = item, None
+        if (not isinstance(bbox, (list, tuple)) or len(bbox) != 4
+                or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in bbox)):
+            raise RegionError(f"第 {index + 1} 个区域的bbox必须是 [x0, y0, x1, y1]")
+        x0, y0, x1, y1 = map(float, bbox)
+        if x1 <= x0 or y1 <= y0:
+            raise RegionError(f"第 {index + 1} 个区域的bbox为空: {bbox}")
+        if prompt_type is not None and prompt_type not in prompt_types:
+            raise RegionError(f"第 {index + 1} 个区域的提示词类型无效: {prompt_type}，支持: {list(prompt_types)}")
+        regions.append(Region((x0, y0, x1, y1), prompt_type))
+    return regions
+
+
+def to_ratio_bbox(bbox: Tuple[float, float, float, float], units: str,
+                  width: float, height: float) -> Tuple[float, float, float, float]:
+    """换算为相对坐标并裁剪到页面范围内"""
+    x0, y0, x1, y1 = bbox
+    if units == "pixel":
+        x0, x1, y0, y1 = x0 / width, x1 / width, y0 / height, y1 / height
+    x0, y0 = max(0.0, x0), max(0.0, y0)
+    x1, y1 = min(1.0, x1), min(1.0, y1)
+    if x1 <= x0 or y1 <= y0:
+        raise RegionError(f"区域 {list(bbox)} 超出页面范围")
+    return x0, y0, x1, y1
+
+
+def native_tile_budget(image: Image.Image, image_size: int, max_tiles: int) -> int:
+    """区域按原始分辨率需要的分块数：小区域不放大到满分块"""
+    need = math.ceil(image.width / image_size) * math.ceil(image.height / image_size)
+    return max(1, min(max_tiles, need))
+
+
+def crop_regions(source: Optional[ImageSource], regions: Sequence[Region], units: str = "ratio",
+                 image_size: int = 448, max_tiles: int = 6,
+                 image: Optional[Image.Image] = None) -> Tuple[List[Image.Image], str]:
+    """
+    按原始分辨率裁出各区域
+
+    image为已解码的原图时直接从中裁剪（source可为None）
+
+    Returns:
+        (各区域图片, 页面尺寸"宽x高"：图片为像素，PDF为pt)
+    """
+    try:
+        if image is None and source.kind == "pdf":
+            import fitz  # PyMuPDF
+            with open_page(source_pdf(source), source.page_index) as page:
+                rect = page.rect
+                crops = []
+                for region in regions:
+                    x0, y0, x1, y1 = to_ratio_bbox(region.bbox, units, rect.width, rect.height)
+                    clip = fitz.Rect(rect.x0 + x0 * rect.width, rect.y0 + y0 * rect.height,
+                                     rect.x0 + x1 * rect.width, rect.y0 + y1 * rect.height)
+                    zoom = render_zoom(clip.width, clip.height, image_size, max_tiles,
+                                       source.min_zoom, source.max_zoom)
+                    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+                    crops.append(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+                return crops, f"{round(rect.width)}x{round(rect.height)}"
+
+        if image is None:
+            image = Image.open(io.BytesIO(source.data))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        crops = []
+        for region in regions:
+            x0, y0, x1, y1 = to_ratio_bbox(region.bbox, units, image.width, image.height)
+            box = (math.floor(x0 * image.width), math.floor(y0 * image.height),
+                   math.ceil(x1 * image.width), math.ceil(y1 * image.height))
+            crops.append(image.crop(box))
+        return crops, f"{image.width}x{image.height}"
+    except RegionError:
+        raise
+    except Exception as e:
+        raise SourceDecodeError(str(e)) from e
+
+
+def preprocess_regions(source: Optional[ImageSource], regions: Sequence[Region], units: str,
+                       tile_settings: Dict[str, Any], max_tiles: int, image: Optional[Image.Image] = None
+                       ) -> Tuple[List[Tuple[torch.Tensor, Dict[str, Any]]], str, Dict[str, float]]:
+    """
+    裁剪并预处理各区域
+
+    每个区域的分块上限取 min(max_tiles, 原始分辨率需要的分块数)，再按分块预设的内容密度自适应
+
+    Returns:
+        ([(pixel_values, {"image_size", "tiles", "tile_keys"}), ...], 页面尺寸, 各步骤耗时)
+    """
+    image_size = tile_settings["image_size"]
+    started = time.perf_counter()
+    crops, page_size = crop_regions(source, regions, units, image_size, max_tiles, image)
+    decoded = time.perf_counter()
+
+    results = []
+    for crop in crops:
+        if min(crop.size) < MIN_REGION_SIZE:
+            raise RegionError(f"区域过小: {crop.width}x{crop.height} 像素")
+        budget = native_tile_budget(crop, image_size, max_tiles)
+        max_num, drop_blank_tiles, tile_info = plan_tiles(crop, tile_settings["preset"], image_size, budget)
+        pixel_values = load_image(crop, input_size=image_size, max_num=max_num, drop_blank_tiles=drop_blank_tiles)
+        record_dropped_tiles(tile_info, pixel_values.shape[0])
+        results.append((pixel_values, {
+            "image_size": f"{crop.width}x{crop.height}",
+            "tiles": tile_info,
+            "tile_keys": tile_hashes(pixel_values),
+        }))
+
+    timings = {"decode": decoded - started, "tile": time.perf_counter() - decoded}
+    return results, page_size, timings
@@ -0,0 +1,50 @@
+"""
+测试公共设置：把api目录加入导入路径，并提供基于stub后端的模型管理器与服务
+
+用法:
+    cd api
+    pytest
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import intervl_service as service
+from inference_scheduler import InferenceScheduler
+
+
+@pytest.fixture
+def stub_manager():
+    """创建并加载stub后端的模型管理器：stub_manager(name, **options)"""
+
+    def build(name: str = "stub", **options) -> "service.InterVLModelManager":
+        manager = service.InterVLModelManager(name, None, "stub", options)
+        manager.load_model()
+        assert manager.is_loaded
+        return manager
+
+    return build
+
+
+@pytest.fixture
+def stub_service(stub_manager, monkeypatch):
+    """
+    不触发启动事件，把服务的全局对象换成stub模型：推理调度器已启动，预处理在线程池中执行，
+    结果缓存关闭，SingleFlight为新实例。返回模型管理器
+    """
+    manager = stub_manager(STUB_BASE_LATENCY_MS=200)
+    registry = service.ModelRegistry(manager, [])
+    scheduler = InferenceScheduler(batch_handler=registry.process_batch, max_batch_size=4, batch_window_ms=20)
+    for name, value in [("model_manager", manager), ("model_registry", registry), ("inference_scheduler", scheduler),
+                        ("continuous_engine", None), ("result_cache", None),
+                        ("single_flight", service.SingleFlight())]:
+        monkeypatch.setattr(service, name, value)
+    scheduler.start()
+    try:
+        yield manager
+    finally:
+        scheduler.stop()
@@ -0,0 +1,37 @@
+"""
+推理后端一致性检查（backend_conformance.py）按后端参数化
+
+stub后端始终运行；hf与onnx后端需要模型，设置INTERNVL_MODEL_PATH后运行，否则跳过：
+    INTERNVL_MODEL_PATH=/path/to/internvl3-8b pytest tests/test_backend_conformance.py
+"""
+
+import os
+
+import pytest
+import torch
+
+from backend_conformance import CHECKS, _sample_pages
+from inference_backend import BACKENDS, create_backend
+
+MODEL_PATH = os.environ.get("INTERNVL_MODEL_PATH", "")
+
+
+@pytest.fixture(scope="module", params=list(BACKENDS))
+def backend(request):
+    name = request.param
+    if name != "stub" and not MODEL_PATH:
+        pytest.skip(f"{name}后端需要设置INTERNVL_MODEL_PATH")
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    backend = create_backend(name, MODEL_PATH or None, device, {"IMAGE_SIZE": 448})
+    backend.load()
+    return backend
+
+
+@pytest.fixture(scope="module")
+def pages():
+    return _sample_pages()
+
+
+@pytest.mark.parametrize("check", [check for _, check in CHECKS], ids=[name for name, _ in CHECKS])
+def test_conformance(backend, pages, check):
+    check(backend, pages)
@@ -0,0 +1,92 @@
+"""截止时间与取消：请求头换算为单调时钟，共享推理在全部调用方取消后才取消"""
+
+import pytest
+
+import cancellation
+from cancellation import (CANCEL_DEADLINE, CANCEL_DISCONNECTED, CancelScope, RequestCancelled, SharedCancelScope,
+                          parse_deadline)
+
+
+class FakeClock:
+    """墙上时钟与单调时钟相差固定偏移，可手动前进"""
+
+    def __init__(self, wall: float = 1_700_000_000.0, monotonic: float = 500.0):
+        self._wall = wall
+        self._monotonic = monotonic
+
+    def time(self) -> float:
+        return self._wall
+
+    def monotonic(self) -> float:
+        return self._monotonic
+
+    def advance(self, seconds: float):
+        self._wall += seconds
+        self._monotonic += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cancellation, "time", fake)
+    return fake
+
+
+def test_parse_deadline_converts_to_monotonic(clock):
+    assert parse_deadline(str(clock.time() + 30)) == pytest.approx(clock.monotonic() + 30)
+    assert parse_deadline(str(clock.time() - 5)) == pytest.approx(clock.monotonic() - 5)
+    assert parse_deadline(None) is None
+    assert parse_deadline("  ") is None
+    with pytest.raises(ValueError):
+        parse_deadline("明天")
+
+
+def test_scope_cancels_when_deadline_passes(clock):
+    scope = CancelScope(parse_deadline(str(clock.time() + 10)))
+    assert not scope.cancelled and scope.remaining() == pytest.approx(10)
+
+    clock.advance(10)
+    assert scope.reason == CANCEL_DEADLINE and scope.remaining() == 0.0
+    with pytest.raises(RequestCancelled) as error:
+        scope.check()
+    assert error.value.reason == CANCEL_DEADLINE
+
+
+def test_shared_scope_cancels_only_after_all_members(clock):
+    first, second = CancelScope(), CancelScope(clock.monotonic() + 10)
+    shared = SharedCancelScope()
+    shared.add(first)
+    shared.add(second)
+
+    first.cancel(CANCEL_DISCONNECTED)
+    assert not shared.cancelled
+
+    clock.advance(10)
+    # 只要有一个调用方超时，原因记为deadline
+    assert shared.reason == CANCEL_DEADLINE
+
+
+def test_shared_scope_all_disconnected():
+    members = [CancelScope(), CancelScope()]
+    shared = SharedCancelScope()
+    for member in members:
+        shared.add(member)
+    for member in members:
+        member.cancel()
+    assert shared.reason == CANCEL_DISCONNECTED
+
+
+def test_member_without_scope_keeps_shared_run_alive(clock):
+    caller = CancelScope(clock.monotonic() + 1)
+    shared = SharedCancelScope()
+    shared.add(caller)
+    shared.add(None)
+
+    caller.cancel()
+    clock.advance(60)
+    assert caller.cancelled
+    assert not shared.cancelled
+
+
+def test_empty_shared_scope_is_not_cancelled():
+    assert not SharedCancelScope().cancelled
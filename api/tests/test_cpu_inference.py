@@ -0,0 +1,60 @@
+"""CPU推理优化：bf16默认关闭，autocast包装在连续批处理直接调用的解码器与lm_head上"""
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from cpu_inference import CpuSettings, language_model_parts, optimize_cpu_model, settings_from_config
+
+
+class TinyInternVL(torch.nn.Module):
+    def __init__(self, hidden_size: int = 64):
+        super().__init__()
+        self.vision_model = torch.nn.Linear(hidden_size, hidden_size)
+        self.mlp1 = torch.nn.Linear(hidden_size, hidden_size)
+        self.language_model = LlamaForCausalLM(LlamaConfig(
+            vocab_size=128, hidden_size=hidden_size, intermediate_size=hidden_size * 2, num_hidden_layers=1,
+            num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=64))
+
+
+def test_bf16_off_by_default():
+    assert settings_from_config({}).bf16 == "off"
+    assert optimize_cpu_model(TinyInternVL(), settings_from_config({}))["bf16"] is False
+
+
+def autocast_probe(module: torch.nn.Module) -> list:
+    """记录module每次前向时CPU autocast是否开启"""
+    states = []
+    module.register_forward_hook(lambda *_: states.append(torch.is_autocast_enabled("cpu")))
+    return states
+
+
+def test_bf16_applies_to_decoder_and_lm_head():
+    model = TinyInternVL()
+    optimize_cpu_model(model, CpuSettings(bf16="on"))
+    decoder, lm_head = language_model_parts(model.language_model)
+    in_decoder = autocast_probe(decoder.layers[0].mlp)
+    embeds = torch.randn(1, 3, 64)
+
+    with torch.no_grad():
+        # 与连续批处理相同，直接调用解码器与lm_head
+        logits = lm_head(decoder(inputs_embeds=embeds).last_hidden_state[:, -1, :])
+        full = model.language_model(inputs_embeds=embeds).logits
+
+    assert in_decoder == [True, True]
+    # lm_head的包装在其forward内，钩子看不到autocast，以输出精度判断
+    assert logits.dtype == torch.bfloat16
+    assert full.dtype == torch.bfloat16
+
+
+def test_int8_keeps_language_model_out_of_autocast():
+    model = TinyInternVL()
+    applied = optimize_cpu_model(model, CpuSettings(bf16="on", int8_dynamic=True))
+    decoder, _ = language_model_parts(model.language_model)
+    in_decoder = autocast_probe(decoder.layers[0].mlp)
+
+    with torch.no_grad():
+        decoder(inputs_embeds=torch.randn(1, 3, 64))
+
+    assert applied["int8_dynamic"]
+    assert in_decoder == [False]
+    assert model.vision_model(torch.randn(1, 64)).dtype == torch.bfloat16
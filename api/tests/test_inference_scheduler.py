@@ -0,0 +1,149 @@
+"""推理调度器：队列满时的429与Retry-After、微批处理按请求拆分结果"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+import intervl_service as service
+from inference_scheduler import InferenceScheduler, QueueFullError
+
+
+def page(size=(448, 448)) -> Image.Image:
+    return Image.new("RGB", size, "white")
+
+
+def test_queue_full_rejects_with_retry_after():
+    # 工作线程未启动，提交的任务一直排队
+    scheduler = InferenceScheduler(max_queue_size=2, initial_service_time=4.0)
+    scheduler.submit(lambda: None)
+    scheduler.submit(lambda: None)
+
+    with pytest.raises(QueueFullError) as error:
+        scheduler.submit(lambda: None)
+
+    assert error.value.queue_depth == 2
+    assert error.value.retry_after == 8  # 2个排队请求 × 4秒
+    assert scheduler.get_metrics()["rejected"] == 1
+
+
+def test_retry_after_counts_batches():
+    scheduler = InferenceScheduler(max_queue_size=8, initial_service_time=3.0,
+                                   batch_handler=lambda payloads: payloads, max_batch_size=4)
+    assert scheduler.estimate_retry_after(8) == 6  # 8个请求分2批
+    assert scheduler.estimate_retry_after(0) == 1
+
+
+def test_run_inference_returns_429_when_queue_full(stub_manager, monkeypatch):
+    manager = stub_manager()
+    full = InferenceScheduler(max_queue_size=1, initial_service_time=5.0, batch_handler=manager.process_batch)
+    full.submit(lambda: None)
+    monkeypatch.setattr(service, "inference_scheduler", full)
+    monkeypatch.setattr(service, "continuous_engine", None)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.run_inference(manager.prepare_request(page())))
+
+    assert error.value.status_code == 429
+    assert error.value.headers == {"Retry-After": "5"}
+
+
+def test_batch_results_split_per_request(stub_manager):
+    manager = stub_manager()
+    scheduler = InferenceScheduler(batch_handler=manager.process_batch, max_batch_size=4, batch_window_ms=200)
+    # 分块数不同的页面合并为一批，每个调用方只拿到自己的回答
+    requests = [manager.prepare_request(page(size), prompt=prompt)
+                for size, prompt in [((448, 448), "第一页"), ((1600, 900), "第二页"), ((448, 448), "第三页")]]
+    futures = [scheduler.submit_batch_item(request, batch_key=request.batch_key) for request in requests]
+    scheduler.start()
+    try:
+        results = [future.result(timeout=10) for future in futures]
+    finally:
+        scheduler.stop()
+
+    assert [result["raw_text"] for result in results] == [
+        "<image>\n第一页|patches=1", "<image>\n第二页|patches=3", "<image>\n第三页|patches=1"]
+    metrics = scheduler.get_metrics()
+    assert metrics["batches"] == 1
+    assert metrics["batch_size_histogram"] == {"3": 1}
+
+
+def test_batch_key_keeps_incompatible_requests_apart():
+    scheduler = InferenceScheduler(batch_handler=lambda payloads: [(p, len(payloads)) for p in payloads],
+                                   max_batch_size=4, batch_window_ms=200)
+    futures = [scheduler.submit_batch_item(payload, batch_key=key)
+               for payload, key in [("a", 1), ("b", 2), ("c", 1), ("d", 2)]]
+    scheduler.start()
+    try:
+        results = [future.result(timeout=10) for future in futures]
+    finally:
+        scheduler.stop()
+
+    assert results == [("a", 2), ("b", 2), ("c", 2), ("d", 2)]
+    assert scheduler.get_metrics()["batch_size_histogram"] == {"2": 2}
+
+
+def test_failed_batch_retries_items_one_by_one():
+    calls = []
+    lock = threading.Lock()
+
+    def handler(payloads):
+        with lock:
+            calls.append(list(payloads))
+        if len(payloads) > 1:
+            raise RuntimeError("显存不足")
+        if payloads[0] == "bad":
+            raise ValueError("损坏的页面")
+        return [payloads[0].upper()]
+
+    scheduler = InferenceScheduler(batch_handler=handler, max_batch_size=3, batch_window_ms=200)
+    futures = [scheduler.submit_batch_item(payload) for payload in ["a", "bad", "c"]]
+    scheduler.start()
+    try:
+        assert futures[0].result(timeout=10) == "A"
+        with pytest.raises(ValueError):
+            futures[1].result(timeout=10)
+        assert futures[2].result(timeout=10) == "C"
+    finally:
+        scheduler.stop()
+
+    assert calls == [["a", "bad", "c"], ["a"], ["bad"], ["c"]]
+    metrics = scheduler.get_metrics()
+    assert (metrics["completed"], metrics["failed"]) == (2, 1)
+
+
+def test_deferred_jobs_count_toward_queue_cap():
+    started, release = threading.Event(), threading.Event()
+
+    def handler(payloads):
+        started.set()
+        release.wait(timeout=10)
+        return payloads
+
+    scheduler = InferenceScheduler(max_queue_size=2, initial_service_time=1.0,
+                                   batch_handler=handler, max_batch_size=4, batch_window_ms=200)
+    scheduler.start()
+    try:
+        # 第一个任务凑批时取出另两个批次键不同的任务，它们被延后，队列本身已空
+        futures = [scheduler.submit_batch_item("a", batch_key=1)]
+        while scheduler.queue_depth:
+            time.sleep(0.01)
+        futures += [scheduler.submit_batch_item(payload, batch_key=2) for payload in ["b", "c"]]
+        assert started.wait(timeout=10)
+        assert scheduler.queue_depth == 2
+
+        with pytest.raises(QueueFullError) as error:
+            scheduler.submit_batch_item("d", batch_key=2)
+        assert error.value.queue_depth == 2
+
+        release.set()
+        assert [future.result(timeout=10) for future in futures] == ["a", "b", "c"]
+    finally:
+        release.set()
+        scheduler.stop()
+
+    metrics = scheduler.get_metrics()
+    assert (metrics["rejected"], metrics["queue_depth"]) == (1, 0)
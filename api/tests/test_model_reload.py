@@ -0,0 +1,87 @@
+"""热重载：同时只允许一次加载或重载，其余重载请求返回409；重载成功后清除本模型的结果缓存"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import intervl_service as service
+from model_reload import ReloadInProgressError
+from result_cache import OCRResultCache
+
+
+def test_concurrent_reload_is_rejected(stub_manager):
+    # 预热也走stub生成，每次加载约需0.3秒
+    manager = stub_manager(STUB_BASE_LATENCY_MS=300)
+    results = []
+    first = threading.Thread(target=lambda: results.append(manager.reload_model("double_buffer")))
+    first.start()
+    deadline = time.monotonic() + 5
+    while manager.state != "reloading" and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    with pytest.raises(ReloadInProgressError):
+        manager.reload_model("double_buffer")
+    first.join(timeout=10)
+
+    assert results == ["double_buffer"]
+    assert manager.state == "ready"
+    assert manager.reload_model("pause") == "pause"
+
+
+def test_reload_during_cold_load_is_rejected():
+    manager = service.InterVLModelManager("stub", None, "stub", {"STUB_BASE_LATENCY_MS": 300})
+    loader = threading.Thread(target=manager.load_model)
+    loader.start()
+    deadline = time.monotonic() + 5
+    while not manager.load_lock.locked() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    with pytest.raises(ReloadInProgressError):
+        manager.reload_model()
+    loader.join(timeout=10)
+    assert manager.is_loaded
+
+
+def test_reload_endpoint_returns_409(stub_manager, monkeypatch):
+    manager = stub_manager()
+    monkeypatch.setattr(service, "model_manager", manager)
+    with manager.load_lock:
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(service.reload_model("auto"))
+
+    assert error.value.status_code == 409
+    assert manager.state == "ready"
+
+
+def test_reload_purges_result_cache(stub_manager, monkeypatch):
+    manager = stub_manager()
+    cache = OCRResultCache(memory_max_entries=8)
+    cache.put("page-a", {"text": "旧权重的结果"}, manager.model_version)
+    cache.put("page-b", {"text": "其他模型的结果"}, "stub-large")
+    monkeypatch.setattr(service, "result_cache", cache)
+
+    manager.reload_model("double_buffer")
+
+    assert cache.get("page-a") == (None, None)
+    assert cache.get("page-b")[0] == {"text": "其他模型的结果"}
+
+
+def test_failed_reload_keeps_result_cache(stub_manager, monkeypatch):
+    manager = stub_manager()
+    cache = OCRResultCache(memory_max_entries=8)
+    cache.put("page-a", {"text": "旧权重的结果"}, manager.model_version)
+    monkeypatch.setattr(service, "result_cache", cache)
+
+    def broken_load():
+        raise RuntimeError("权重文件损坏")
+
+    monkeypatch.setattr(manager, "_load_backend", broken_load)
+
+    with pytest.raises(RuntimeError):
+        manager.reload_model("double_buffer")
+
+    assert manager.state == "ready"
+    assert cache.get("page-a")[0] == {"text": "旧权重的结果"}
@@ -0,0 +1,97 @@
+"""模型级联：两个stub模型之间的路由与低置信度升级"""
+
+import pytest
+from PIL import Image, ImageDraw
+
+import intervl_service as service
+from model_router import (PRIORITY_AUTO, PRIORITY_QUALITY, PRIORITY_SPEED, ROUTE_PRIORITY, ROUTE_SPARSE, ROUTE_TABLE,
+                          page_features)
+
+A4_150DPI = (1240, 1754)
+
+
+def text_page() -> Image.Image:
+    """几行打字文本"""
+    page = Image.new("RGB", A4_150DPI, "white")
+    draw = ImageDraw.Draw(page)
+    for line in range(12):
+        draw.text((120, 200 + line * 40), f"{line + 1}. Replace the seal kit on pump P-{101 + line}.", fill="black")
+    return page
+
+
+def table_page() -> Image.Image:
+    """带横竖表格线的页面"""
+    page = Image.new("RGB", A4_150DPI, "white")
+    draw = ImageDraw.Draw(page)
+    for row in range(11):
+        draw.line((100, 200 + row * 80, 1140, 200 + row * 80), fill="black", width=3)
+    for column in range(5):
+        draw.line((100 + column * 260, 200, 100 + column * 260, 1000), fill="black", width=3)
+    return page
+
+
+@pytest.fixture
+def registry(stub_manager):
+    """小模型回答置信度低（0.5 + 0.01 × 分块数），主模型使用stub默认值"""
+
+    def build(small_confidence_per_patch: float = 0.01) -> "service.ModelRegistry":
+        small = stub_manager("stub-small", STUB_CONFIDENCE_PER_PATCH=small_confidence_per_patch)
+        large = stub_manager("stub-large")
+        return service.ModelRegistry(large, [small])
+
+    return build
+
+
+def routed_model(registry, image, priority):
+    request = registry.primary.prepare_request(image)
+    registry.route(request, page_features(image), priority)
+    return request.model, request.route["reason"]
+
+
+def test_route_by_page_features(registry):
+    cascade = registry()
+    assert cascade.cascade
+    assert routed_model(cascade, text_page(), PRIORITY_AUTO) == ("stub-small", ROUTE_SPARSE)
+    assert routed_model(cascade, table_page(), PRIORITY_AUTO) == ("stub-large", ROUTE_TABLE)
+
+
+def test_route_by_priority(registry):
+    cascade = registry()
+    assert routed_model(cascade, table_page(), PRIORITY_SPEED) == ("stub-small", ROUTE_PRIORITY)
+    assert routed_model(cascade, text_page(), PRIORITY_QUALITY) == ("stub-large", ROUTE_PRIORITY)
+
+
+def test_low_confidence_escalates_to_large_model(registry):
+    cascade = registry()
+    result = cascade.process_image(text_page(), priority=PRIORITY_AUTO)
+
+    routing = result["metadata"]["routing"]
+    assert result["metadata"]["model"] == "stub-large"
+    assert [item["model"] for item in routing["escalated_from"]] == ["stub-small"]
+    assert routing["escalated_from"][0]["confidence"] < cascade.settings.min_confidence
+    metrics = cascade.get_metrics()["models"]
+    assert metrics["stub-small"]["escalation_rate"] == 1.0
+    assert (metrics["stub-small"]["pages"], metrics["stub-large"]["pages"]) == (1, 1)
+
+
+def test_confident_small_model_keeps_page(registry):
+    cascade = registry(small_confidence_per_patch=0.5)
+    result = cascade.process_image(text_page(), priority=PRIORITY_AUTO)
+
+    assert result["metadata"]["model"] == "stub-small"
+    assert result["metadata"]["routing"]["escalated_from"] == []
+    assert cascade.get_metrics()["models"]["stub-small"]["escalation_rate"] == 0.0
+
+
+def test_speed_priority_never_escalates(registry):
+    cascade = registry()
+    result = cascade.process_image(text_page(), priority=PRIORITY_SPEED)
+
+    assert result["metadata"]["model"] == "stub-small"
+    assert result["metadata"]["routing"]["escalated_from"] == []
+
+
+def test_unloaded_small_model_is_not_routed(stub_manager):
+    small = service.InterVLModelManager("stub-small", None, "stub", {})
+    cascade = service.ModelRegistry(stub_manager("stub-large"), [small])
+    assert routed_model(cascade, text_page(), PRIORITY_SPEED) == ("stub-large", ROUTE_PRIORITY)
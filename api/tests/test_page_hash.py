@@ -0,0 +1,90 @@
+"""PDF空白页跳过与重复页复用：哈希相近只是候选，逐像素确认相同才复用"""
+
+import json
+
+import fitz
+import pytest
+from fastapi.testclient import TestClient
+
+import intervl_service as service
+from page_hash import PageDeduplicator, fingerprint, same_content
+from pdf_ingest import render_full_gray, render_preview
+
+
+def add_drawing(doc, revision: str):
+    """带图框的文字页，右下角标题栏写图号与修订号"""
+    page = doc.new_page(width=595, height=842)
+    page.draw_rect(fitz.Rect(40, 40, 555, 802), width=2)
+    for line in range(20):
+        page.insert_text((70, 100 + line * 30), f"{line + 1}. Replace the seal kit on pump P-{101 + line}.",
+                         fontsize=12)
+    page.insert_text((420, 780), f"DWG 4711 REV {revision}", fontsize=10)
+
+
+@pytest.fixture(scope="module")
+def drawings_pdf() -> bytes:
+    """第1页图纸、第2页只有页码、第3页与第1页完全相同、第4页只有修订号不同"""
+    doc = fitz.open()
+    add_drawing(doc, "A")
+    doc.new_page(width=595, height=842).insert_text((290, 820), "2", fontsize=9)
+    add_drawing(doc, "A")
+    add_drawing(doc, "B")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def render(pdf_bytes: bytes, page_index: int):
+    return render_full_gray(pdf_bytes, page_index, 448, 12, 1.0, 4.0)
+
+
+def test_page_with_only_page_number_is_blank(drawings_pdf):
+    assert fingerprint(render_preview(drawings_pdf, 1)).blank
+    assert not fingerprint(render_preview(drawings_pdf, 0)).blank
+
+
+def test_revision_change_is_candidate_but_not_duplicate(drawings_pdf):
+    deduplicator = PageDeduplicator(max_distance=3)
+    deduplicator.add(0, fingerprint(render_preview(drawings_pdf, 0)))
+
+    # 修订号只占几十个像素，64位哈希看不出差别
+    assert deduplicator.candidates(fingerprint(render_preview(drawings_pdf, 2))) == [(0, 0)]
+    assert deduplicator.candidates(fingerprint(render_preview(drawings_pdf, 3))) == [(0, 0)]
+    assert same_content(render(drawings_pdf, 0), render(drawings_pdf, 2))
+    assert not same_content(render(drawings_pdf, 0), render(drawings_pdf, 3))
+
+
+def test_distant_page_is_not_candidate(drawings_pdf):
+    deduplicator = PageDeduplicator(max_distance=3)
+    deduplicator.add(0, fingerprint(render_preview(drawings_pdf, 0)))
+    assert deduplicator.candidates(fingerprint(render_preview(drawings_pdf, 1))) == []
+
+
+@pytest.fixture
+def pdf_client(stub_service):
+    return TestClient(service.app)
+
+
+def test_pdf_skips_blank_and_reuses_only_exact_duplicates(pdf_client, drawings_pdf):
+    response = pdf_client.post("/ocr/pdf", files={"file": ("drawings.pdf", drawings_pdf, "application/pdf")},
+                               data={"skip_blank": "true", "dedup_distance": "3", "pack": "false"})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    pages = {line["page"]: line for line in lines if line["type"] == "page"}
+    summary = lines[-1]
+
+    assert pages[2]["status"] == "skipped" and pages[2]["metadata"]["skipped"] == "blank"
+    assert pages[3]["metadata"]["reused_from"] == 1
+    assert pages[3]["raw_text"] == pages[1]["raw_text"]
+    assert "reused_from" not in pages[4]["metadata"]
+    assert summary["skipped_pages"] == [2]
+    assert summary["reused_pages"] == {"3": 1}
+
+
+def test_pdf_without_dedup_processes_every_page(pdf_client, drawings_pdf):
+    response = pdf_client.post("/ocr/pdf", files={"file": ("drawings.pdf", drawings_pdf, "application/pdf")},
+                               data={"skip_blank": "false", "dedup_distance": "-1", "pack": "false"})
+    pages = [json.loads(line) for line in response.text.splitlines() if json.loads(line)["type"] == "page"]
+
+    assert [page["status"] for page in pages] == ["success"] * 4
+    assert all("reused_from" not in page["metadata"] for page in pages)
@@ -0,0 +1,73 @@
+"""多页打包：回答按分节标记拆回各页，标记异常时相关页面拆分失败而不是错配"""
+
+from page_packing import (PackSettings, build_packed_question, fits, pack_marker, packable, packed_prompt,
+                          split_packed_answer)
+
+
+def packed(*sections) -> str:
+    """按(序号, 内容)拼出打包回答"""
+    return "\n".join(f"{pack_marker(index)}\n{body}" for index, body in sections)
+
+
+def test_split_in_order():
+    text = "好的，以下是识别结果。\n" + packed((1, "A"), (2, "B"), (3, "C"))
+    assert split_packed_answer(text, 3) == ["A", "B", "C"]
+
+
+def test_marker_variants_are_accepted():
+    text = "==Image-1==\nA\n  ===  Image-2  ===  \nB"
+    assert split_packed_answer(text, 2) == ["A", "B"]
+
+
+def test_missing_marker_fails_the_page_before_it():
+    # 第2页的标记缺失，其内容并入第1节，第1节不能交给第1页
+    text = "=== Image-1 ===\nA\nB text of page 2\n=== Image-3 ===\nC"
+    assert split_packed_answer(text, 3) == [None, None, "C"]
+
+
+def test_missing_last_marker_fails_the_last_section():
+    text = packed((1, "A"), (2, "B\nC text of page 3"))
+    assert split_packed_answer(text, 3) == ["A", None, None]
+
+
+def test_duplicate_marker_fails_its_section():
+    text = packed((1, "A"), (1, "A again"), (2, "B"))
+    assert split_packed_answer(text, 2) == [None, "B"]
+
+
+def test_out_of_order_marker_fails_affected_sections():
+    text = packed((1, "A"), (3, "C"), (2, "B"))
+    assert split_packed_answer(text, 3) == [None, None, None]
+
+
+def test_marker_beyond_count_is_stray():
+    text = packed((1, "A"), (2, "B"), (3, "extra"))
+    assert split_packed_answer(text, 2) == ["A", None]
+
+
+def test_empty_section_fails():
+    text = packed((1, ""), (2, "B"))
+    assert split_packed_answer(text, 2) == [None, "B"]
+
+
+def test_truncated_answer_fails_last_section():
+    text = packed((1, "A"), (2, "B"), (3, "C partially"))
+    assert split_packed_answer(text, 3, complete=False) == ["A", "B", None]
+
+
+def test_no_markers():
+    assert split_packed_answer("没有分节的回答", 2) == [None, None]
+
+
+def test_packed_prompt_round_trip():
+    prompt = "请识别图片中的文字。\n保留表格格式。"
+    question = build_packed_question(prompt, 3)
+    assert question.startswith("Image-1: <image>\nImage-2: <image>\nImage-3: <image>\n")
+    assert packed_prompt(question) == prompt
+
+
+def test_patch_budget():
+    settings = PackSettings(patch_budget=13, max_page_patches=6, max_pages=3)
+    assert packable(6, settings) and not packable(7, settings)
+    assert fits(6, 1, 6, settings) and not fits(12, 2, 2, settings)
+    assert not fits(3, 3, 1, settings)
@@ -0,0 +1,62 @@
+"""预处理来源：PDF每个请求只写入共享内存一次，各页来源跨进程时只携带块名称"""
+
+import gc
+import pickle
+from multiprocessing import shared_memory
+
+import fitz
+import pytest
+
+import preprocess_pipeline
+from preprocess_pipeline import SharedDocument, load_source
+
+
+def make_pdf(pages: int, padding: int = 0) -> bytes:
+    doc = fitz.open()
+    for index in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {index + 1}", fontsize=24)
+    # 用元数据撑大文件，验证pickle的大小与PDF大小无关
+    if padding:
+        doc.set_metadata({"subject": "x" * padding})
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_page_source_pickles_without_document():
+    small, large = SharedDocument(make_pdf(2)), SharedDocument(make_pdf(2, padding=200_000))
+    assert large.size > 200_000
+    assert len(pickle.dumps(large.page(1))) < 1024
+    assert abs(len(pickle.dumps(large.page(1))) - len(pickle.dumps(small.page(1)))) < 16
+
+
+def test_unpickled_source_renders_the_page():
+    document = SharedDocument(make_pdf(3), min_zoom=1.0, max_zoom=2.0)
+    source = pickle.loads(pickle.dumps(document.page(2)))
+
+    assert source.page_index == 2 and source.data == b""
+    assert load_source(source).size == load_source(document.page(2)).size
+    assert document.page_count() == 3
+
+
+def test_document_parsed_once_per_process():
+    document = SharedDocument(make_pdf(2))
+    assert document.document is document.document
+    assert pickle.loads(pickle.dumps(document)).document is document.document
+
+
+def test_block_released_with_last_reference():
+    document = SharedDocument(make_pdf(1))
+    name = document.name
+    source = document.page(0)
+    document.document
+    del document
+    gc.collect()
+    shared_memory.SharedMemory(name=name).close()  # 各页来源仍引用文档
+
+    del source
+    gc.collect()
+    assert name not in preprocess_pipeline._open_documents
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
@@ -0,0 +1,88 @@
+"""重复循环检测：按最小周期判定、在最后一个完整重复处截断，以及各行的停止原因与节省的token数"""
+
+from types import SimpleNamespace
+
+import torch
+
+from repetition_stopping import (STOP_EOS, STOP_MAX_NEW_TOKENS, STOP_REPETITION, GenerationStoppingCriteria,
+                                 RepetitionDetector, RepetitionSettings, StopStats)
+
+EOS = 0
+
+
+def feed(detector: RepetitionDetector, tokens) -> int:
+    """逐个追加token，返回检测到循环时已追加的token数（未检测到返回0）"""
+    for count, token_id in enumerate(tokens, 1):
+        if detector.append(token_id):
+            return count
+    return 0
+
+
+def test_loop_detected_exactly_at_threshold():
+    # 周期5：需要 max(5 × 3, 20) = 20 个重复token
+    detector = RepetitionDetector(RepetitionSettings(min_ngram=4, max_ngram=16, min_repeats=3, min_span=20))
+    prefix = [101, 102, 103]
+    assert feed(detector, prefix + [1, 2, 3, 4, 5] * 6) == len(prefix) + 20
+
+
+def test_short_repetition_below_min_span_is_not_a_loop():
+    # 表格分隔线一类的短重复：4个token × 4次 = 16 < min_span
+    detector = RepetitionDetector(RepetitionSettings(min_ngram=4, max_ngram=16, min_repeats=3, min_span=20))
+    assert feed(detector, [101] + [7, 7, 8, 9] * 4 + list(range(200, 230))) == 0
+
+
+def test_smallest_period_decides_truncation():
+    # 周期3与周期6在第15个重复token同时达到阈值；按周期3截断保留5个完整单元，按周期6只保留4个
+    detector = RepetitionDetector(RepetitionSettings(min_ngram=2, max_ngram=8, min_repeats=2, min_span=15))
+    prefix = [101, 102]
+    assert feed(detector, prefix + [1, 2, 3] * 6) == len(prefix) + 15
+    assert detector.tokens[:detector.keep] == prefix + [1, 2, 3] * 5
+
+
+def test_truncates_at_last_complete_repetition():
+    # 第10个重复token处判定为循环，末尾多出的1个token不是完整的重复单元
+    detector = RepetitionDetector(RepetitionSettings(min_ngram=3, max_ngram=8, min_repeats=3, min_span=10))
+    prefix = [101, 102]
+    assert feed(detector, prefix + [1, 2, 3] * 5) == len(prefix) + 10
+    assert detector.tokens[-1] == 1
+    assert detector.tokens[:detector.keep] == prefix + [1, 2, 3] * 3
+
+
+def test_stop_reasons_and_tokens_saved():
+    settings = RepetitionSettings(min_ngram=3, max_ngram=8, min_repeats=3, min_span=10)
+    scope = SimpleNamespace(cancelled=False, reason=None)
+    rows = [
+        [101, 102] + [1, 2, 3] * 4,  # 第12个token处判定为循环
+        [11, 12, 13, EOS] + [EOS] * 10,  # 正常结束
+        list(range(21, 35)),  # 预算6个token
+        list(range(41, 55)),  # 第4步后截止时间已过
+    ]
+    criteria = GenerationStoppingCriteria(settings, batch_size=4, max_new_tokens=[50, 50, 6, 50],
+                                          stop_token_ids=[EOS], cancel_scopes=[None, None, None, scope])
+    input_ids = torch.tensor(rows)
+    for step in range(1, input_ids.shape[1] + 1):
+        if step == 5:
+            scope.cancelled, scope.reason = True, "deadline"
+        done = criteria(input_ids[:, :step])
+    # 正常结束的行由generate自身停止
+    assert done.tolist() == [True, False, True, True]
+
+    def decode(ids):
+        return " ".join(map(str, ids))
+
+    results = [criteria.finalize(row, f"回答{row}", decode) for row in range(4)]
+    text, info = results[0]
+    assert text == decode([101, 102] + [1, 2, 3] * 3)
+    assert (info.stop_reason, info.generated_tokens, info.tokens_saved) == (STOP_REPETITION, 12, 38)
+    assert results[1] == ("回答1", (STOP_EOS, 3, 0, None))
+    assert results[2] == ("回答2", (STOP_MAX_NEW_TOKENS, 6, 0, None))
+    text, info = results[3]
+    assert text == decode([41, 42, 43, 44])
+    assert (info.stop_reason, info.generated_tokens, info.tokens_saved) == ("deadline", 4, 46)
+
+    stats = StopStats()
+    for _, info in results:
+        stats.record(info)
+    metrics = stats.get_metrics()
+    assert metrics["stop_reasons"] == {STOP_EOS: 1, STOP_MAX_NEW_TOKENS: 1, STOP_REPETITION: 1, "deadline": 1}
+    assert (metrics["generated_tokens"], metrics["tokens_saved"]) == (25, 84)
@@ -0,0 +1,83 @@
+"""OCR结果缓存：内存LRU按条目数与字节数淘汰，SQLite按最近访问时间淘汰，磁盘命中提升到内存，按模型版本清除"""
+
+import itertools
+
+import pytest
+
+import result_cache
+from result_cache import MemoryLRUCache, OCRResultCache, SQLiteResultCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """每次读取前进1秒，使accessed_at的先后与调用顺序一致"""
+    ticks = itertools.count(1_000_000)
+
+    class FakeTime:
+        @staticmethod
+        def time():
+            return float(next(ticks))
+
+    monkeypatch.setattr(result_cache, "time", FakeTime)
+
+
+def test_memory_evicts_least_recently_used_by_entry_count():
+    cache = MemoryLRUCache(max_entries=2)
+    cache.put("a", "结果A", "stub")
+    cache.put("b", "结果B", "stub")
+    assert cache.get("a") == "结果A"  # a变为最近使用
+    cache.put("c", "结果C", "stub")
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("结果A", None, "结果C")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_memory_evicts_by_byte_count():
+    cache = MemoryLRUCache(max_entries=100, max_bytes=10)
+    cache.put("a", "x" * 4, "stub")
+    cache.put("b", "y" * 4, "stub")
+    cache.put("c", "z" * 4, "stub")
+
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 8
+    # 单条超过上限的结果不缓存，也不挤掉已有条目
+    cache.put("huge", "w" * 11, "stub")
+    assert cache.get("huge") is None and cache.get("b") == "y" * 4
+
+
+def test_sqlite_evicts_by_accessed_at(tmp_path, clock):
+    cache = SQLiteResultCache(str(tmp_path / "cache.sqlite3"), max_bytes=10)
+    cache.put("a", "x" * 4, "stub")
+    cache.put("b", "y" * 4, "stub")
+    assert cache.get("a") == ("x" * 4, "stub")  # 更新a的accessed_at，b成为最久未访问
+    cache.put("c", "z" * 4, "stub")
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+    cache.close()
+
+
+def test_disk_hit_is_promoted_to_memory(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    OCRResultCache(disk_path=path).put("page", {"raw_text": "图纸标题"}, "stub")
+    # 模拟重启：新实例的内存层为空
+    cache = OCRResultCache(disk_path=path)
+
+    assert cache.get("page") == ({"raw_text": "图纸标题"}, "disk")
+    assert cache.get("page") == ({"raw_text": "图纸标题"}, "memory")
+    metrics = cache.get_metrics()
+    assert metrics["hits"] == {"memory": 1, "disk": 1}
+    assert metrics["memory"]["entries"] == 1
+
+
+def test_purge_by_model_version(tmp_path):
+    cache = OCRResultCache(disk_path=str(tmp_path / "cache.sqlite3"))
+    cache.put("old", {"raw_text": "旧模型"}, "stub-v1")
+    cache.put("new", {"raw_text": "新模型"}, "stub-v2")
+
+    assert cache.purge("stub-v1") == {"memory": 1, "disk": 1}
+    assert cache.get("old") == (None, None)
+    assert cache.get("new")[0] == {"raw_text": "新模型"}
+    assert cache.purge() == {"memory": 1, "disk": 1}
+    assert cache.get("new") == (None, None)
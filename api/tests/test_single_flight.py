@@ -0,0 +1,69 @@
+"""并发的相同请求合并为一次推理：第二个调用方加入进行中的任务，第一个调用方取消后其余调用方仍拿到结果"""
+
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+import intervl_service as service
+from cancellation import CancelScope
+
+
+def png_bytes(size=(448, 448)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_identical_call_joins_inflight_task(stub_service):
+    content = png_bytes()
+
+    async def main():
+        return await asyncio.gather(service.run_ocr(content, "识别"), service.run_ocr(content, "识别"))
+
+    first, second = asyncio.run(main())
+
+    assert first["raw_text"] == second["raw_text"] == "<image>\n识别|patches=1"
+    assert sorted([first["metadata"]["deduplicated"], second["metadata"]["deduplicated"]]) == [False, True]
+    # 每个调用方拿到独立副本
+    assert first is not second and first["metadata"] is not second["metadata"]
+    assert service.single_flight.get_metrics() == {"inflight": 0, "executed": 1, "deduplicated": 1}
+    assert service.model_registry.get_metrics()["models"]["stub"]["pages"] == 1
+
+
+def test_different_prompts_are_not_merged(stub_service):
+    content = png_bytes()
+
+    async def main():
+        return await asyncio.gather(service.run_ocr(content, "识别"), service.run_ocr(content, "提取表格"))
+
+    results = asyncio.run(main())
+
+    assert [result["metadata"]["deduplicated"] for result in results] == [False, False]
+    assert service.single_flight.get_metrics()["executed"] == 2
+
+
+def test_work_finishes_for_remaining_waiter_when_first_caller_cancelled(stub_service):
+    content = png_bytes()
+    first_scope, second_scope = CancelScope(), CancelScope()
+
+    async def main():
+        first = asyncio.ensure_future(service.run_ocr(content, "识别", cancel_scope=first_scope))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(service.run_ocr(content, "识别", cancel_scope=second_scope))
+        await asyncio.sleep(0.05)
+        # 第一个调用方断开：它的协程被取消，共享任务因第二个调用方仍在等待而继续
+        first_scope.cancel()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    result = asyncio.run(main())
+
+    assert result["raw_text"] == "<image>\n识别|patches=1"
+    assert result["metadata"]["deduplicated"] is True
+    assert not second_scope.cancelled
+    assert service.single_flight.get_metrics() == {"inflight": 0, "executed": 1, "deduplicated": 1}
+    assert service.model_registry.get_metrics()["models"]["stub"]["pages"] == 1
@@ -0,0 +1,127 @@
+"""
+自适应分块预算
+
+预处理前在缩小的灰度图上做一次廉价的密度分析（墨迹占比、笔画边缘占比、
+有内容的区域占比），据此为每张图片选择分块上限：几乎空白的封面只用1~2块，
+密集的规格表才用满12块。可选地丢弃完全空白的分块（缩略图仍保留全局信息）。
+
+预设:
+- draft: 分块上限4，丢弃空白分块（渐进式识别的第一遍，见progressive_ocr.py）
+- fast: 分块上限6，丢弃空白分块
+- balanced: 分块上限12，按内容密度自适应
+- accurate: 固定分块上限12（原有行为）
+"""
+
+import math
+from typing import Any, Dict, NamedTuple, Tuple
+
+import numpy as np
+from PIL import Image
+
+from image_preprocess import select_grid
+
+
+class TilePreset(NamedTuple):
+    min_tiles: int
+    max_tiles: int
+    adaptive: bool
+    drop_blank_tiles: bool
+
+
+TILE_PRESETS: Dict[str, TilePreset] = {
+    "draft": TilePreset(min_tiles=1, max_tiles=4, adaptive=True, drop_blank_tiles=True),
+    "fast": TilePreset(min_tiles=1, max_tiles=6, adaptive=True, drop_blank_tiles=True),
+    "balanced": TilePreset(min_tiles=2, max_tiles=12, adaptive=True, drop_blank_tiles=False),
+    "accurate": TilePreset(min_tiles=12, max_tiles=12, adaptive=False, drop_blank_tiles=False),
+}
+
+ANALYSIS_SIZE = 512  # 密度分析所用缩略图的最长边
+ANALYSIS_GRID = 8  # 统计内容区域占比的网格
+INK_CONTRAST = 48  # 比纸面背景暗多少（灰度级）算作墨迹
+EDGE_THRESHOLD = 40  # 相邻像素灰度差超过该值算作笔画边缘
+BLANK_INK_RATIO = 0.001  # 墨迹占比低于该值视为空白页
+CELL_INK_RATIO = 0.002  # 网格单元墨迹占比超过该值视为有内容
+DENSE_EDGE_RATIO = 0.08  # 达到该边缘占比即视为密集小字，需要最高分辨率
+
+
+class DensityStats(NamedTuple):
+    ink_ratio: float
+    edge_ratio: float
+    content_ratio: float
+
+    @property
+    def blank(self) -> bool:
+        return self.ink_ratio < BLANK_INK_RATIO
+
+
+def validate_preset(preset: str) -> str:
+    if preset not in TILE_PRESETS:
+        raise ValueError(f"未知的分块预设: {preset}，支持: {list(TILE_PRESETS)}")
+    return preset
+
+
+def analyze_density(image: Image.Image) -> DensityStats:
+    """在缩小的灰度图上估计墨迹密度与内容区域"""
+    factor = max(1, max(image.size) // ANALYSIS_SIZE)
+    small = image.reduce(factor) if factor > 1 else image
+    gray = np.asarray(small.convert("L"), dtype=np.int16)
+
+    background = np.percentile(gray, 90)
+    ink = gray < background - INK_CONTRAST
+    edge_x = np.abs(np.diff(gray, axis=1)) > EDGE_THRESHOLD
+    edge_y = np.abs(np.diff(gray, axis=0)) > EDGE_THRESHOLD
+    edge_ratio = (edge_x.mean() + edge_y.mean()) / 2
+
+    height, width = ink.shape
+    cell_h, cell_w = max(1, height // ANALYSIS_GRID), max(1, width // ANALYSIS_GRID)
+    rows, cols = height // cell_h, width // cell_w
+    cells = ink[:rows * cell_h, :cols * cell_w].reshape(rows, cell_h, cols, cell_w).mean(axis=(1, 3))
+    content_ratio = (cells > CELL_INK_RATIO).mean()
+
+    return DensityStats(float(ink.mean()), float(edge_ratio), float(content_ratio))
+
+
+def choose_max_num(stats: DensityStats, preset: TilePreset) -> int:
+    """按内容密度选择分块上限"""
+    if not preset.adaptive:
+        return preset.max_tiles
+    if stats.blank:
+        return preset.min_tiles
+    # 内容区域越大需要覆盖的分块越多；笔画越密越需要高分辨率
+    detail = min(1.0, stats.edge_ratio / DENSE_EDGE_RATIO)
+    need = stats.content_ratio * (0.25 + 0.75 * detail)
+    return max(preset.min_tiles, min(preset.max_tiles, math.ceil(need * preset.max_tiles)))
+
+
+def plan_tiles(image: Image.Image, preset_name: str, image_size: int = 448,
+               max_num: int = 12) -> Tuple[int, bool, Dict[str, Any]]:
+    """
+    为图片选择分块方案
+
+    Returns:
+        (分块上限, 是否丢弃空白分块, 报告用的分块信息)
+    """
+    preset = TILE_PRESETS[preset_name]
+    stats = analyze_density(image) if preset.adaptive else None
+    budget = min(max_num, choose_max_num(stats, preset) if stats else preset.max_tiles)
+    cols, rows = select_grid(image.width, image.height, image_size, budget)
+    info = {
+        "preset": preset_name,
+        "max_num": budget,
+        "grid": f"{cols}x{rows}",
+    }
+    if stats is not None:
+        info.update({
+            "ink_ratio": round(stats.ink_ratio, 4),
+            "edge_ratio": round(stats.edge_ratio, 4),
+            "content_ratio": round(stats.content_ratio, 4),
+        })
+    return budget, preset.drop_blank_tiles, info
+
+
+def record_dropped_tiles(info: Dict[str, Any], num_patches: int) -> Dict[str, Any]:
+    """根据实际分块数（含缩略图）记录被丢弃的空白分块数"""
+    cols, rows = map(int, info["grid"].split("x"))
+    expected = cols * rows + (1 if cols * rows != 1 else 0)
+    info["dropped_tiles"] = expected - num_patches
+    return info
@@ -0,0 +1,60 @@
+"""
+基于token对数概率的置信度
+
+生成时记录每一步所选token的对数概率（贪心解码即为最大对数概率），
+回答的置信度取各token概率的几何平均 exp(mean(logprob))：全部token都很确定时接近1，
+出现较多犹豫的token（模糊的小字、看不清的表格）时明显下降。
+
+- HF / ONNX后端：TokenConfidence作为transformers的LogitsProcessor传给生成过程，
+  只读取分数、不修改
+- 连续批处理引擎：在逐token解码时由chosen_logprobs直接计算
+- 多个回答合并（多提示词、区域识别）时按token数加权合并
+"""
+
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+
+def chosen_logprobs(logits: torch.Tensor) -> Tuple[List[int], List[float]]:
+    """贪心解码：返回各行选中的token及其对数概率"""
+    logprobs, token_ids = torch.log_softmax(logits.float(), dim=-1).max(dim=-1)
+    return token_ids.tolist(), logprobs.tolist()
+
+
+def sequence_confidence(logprobs: Sequence[float]) -> Optional[float]:
+    """各token概率的几何平均，没有记录时为None"""
+    if not logprobs:
+        return None
+    return round(math.exp(sum(logprobs) / len(logprobs)), 4)
+
+
+def combine_confidence(confidences: Sequence[Optional[float]], token_counts: Sequence[int]) -> Optional[float]:
+    """按token数加权合并多个回答的置信度（几何平均），全部未知时为None"""
+    total = weighted = 0.0
+    for confidence, count in zip(confidences, token_counts):
+        if confidence is None or confidence <= 0:
+            continue
+        count = max(count, 1)
+        total += count
+        weighted += count * math.log(confidence)
+    return round(math.exp(weighted / total), 4) if total else None
+
+
+class TokenConfidence(LogitsProcessor):
+    """记录每一步各行所选token的对数概率（不修改分数）"""
+
+    def __init__(self, batch_size: int):
+        self.logprobs: List[List[float]] = [[] for _ in range(batch_size)]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        _, logprobs = chosen_logprobs(scores)
+        for row, logprob in enumerate(logprobs):
+            self.logprobs[row].append(logprob)
+        return scores
+
+    def confidence(self, row: int, num_tokens: int) -> Optional[float]:
+        """该行前num_tokens个token（之后为结束后的填充步）的置信度"""
+        return sequence_confidence(self.logprobs[row][:max(num_tokens, 1)])
@@ -0,0 +1,137 @@
+"""
+视觉特征缓存
+
+同一页面常先用general提示词识别，再用table / specification提示词追问，每次都要对相同的
+分块重新执行视觉编码器。InternViT对每个分块独立编码（pixel shuffle与mlp1投影也按分块进行），
+因此按分块缓存extract_feature的输出是精确的：以 (模型版本, 分块内容哈希) 为键的LRU缓存，
+按字节数限制容量，后续提示词只需对未命中的分块执行ViT前向。
+
+分块哈希在预处理阶段（进程池中）计算；推理时通过 tiles(keys) 上下文把当前这批分块的键
+告知被包装的extract_feature。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+
+def tile_hashes(pixel_values: torch.Tensor) -> List[str]:
+    """每个预处理后分块的内容哈希"""
+    array = pixel_values.detach().cpu().contiguous().numpy()
+    return [hashlib.blake2b(tile, digest_size=16).hexdigest() for tile in array]
+
+
+class VisionFeatureCache:
+    """按分块缓存视觉编码器输出的LRU缓存（线程安全）"""
+
+    def __init__(self, max_bytes: int, model_version: str = "", keep_on_device: bool = False):
+        """
+        Args:
+            max_bytes: 缓存的特征张量总字节数上限，0表示禁用
+            model_version: 模型版本，作为键的一部分
+            keep_on_device: True时特征留在推理设备（省去拷贝，占用显存），否则存到CPU内存
+        """
+        self.max_bytes = max_bytes
+        self.model_version = model_version
+        self.keep_on_device = keep_on_device
+        self._entries: "OrderedDict[Tuple[str, str], torch.Tensor]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @contextmanager
+    def tiles(self, keys: Optional[Sequence[str]]):
+        """在当前线程中声明接下来extract_feature处理的分块键（按分块顺序）"""
+        previous = getattr(self._local, "keys", None)
+        self._local.keys = list(keys) if keys is not None and self.enabled else None
+        try:
+            yield
+        finally:
+            self._local.keys = previous
+
+    def install(self, model):
+        """包装model.extract_feature，使其查询缓存"""
+        extract_feature = model.extract_feature
+
+        def cached_extract_feature(pixel_values: torch.Tensor) -> torch.Tensor:
+            keys = getattr(self._local, "keys", None)
+            if keys is None or len(keys) != pixel_values.shape[0]:
+                return extract_feature(pixel_values)
+            return self._extract(extract_feature, pixel_values, keys)
+
+        model.extract_feature = cached_extract_feature
+
+    def _extract(self, extract_feature, pixel_values: torch.Tensor, keys: List[str]) -> torch.Tensor:
+        features: List[Optional[torch.Tensor]] = [self._get(key) for key in keys]
+        missing = [index for index, feature in enumerate(features) if feature is None]
+        with self._lock:
+            self._hits += len(keys) - len(missing)
+            self._misses += len(missing)
+
+        if missing:
+            # 只对未命中的分块执行视觉编码器
+            index = torch.tensor(missing, device=pixel_values.device)
+            computed = extract_feature(pixel_values.index_select(0, index))
+            for row, position in enumerate(missing):
+                features[position] = computed[row]
+                self._put(keys[position], computed[row])
+            if len(missing) == len(keys):
+                return computed
+        return torch.stack([feature.to(pixel_values.device) for feature in features])
+
+    def _get(self, key: str) -> Optional[torch.Tensor]:
+        with self._lock:
+            feature = self._entries.get((self.model_version, key))
+            if feature is not None:
+                self._entries.move_to_end((self.model_version, key))
+            return feature
+
+    def _put(self, key: str, feature: torch.Tensor):
+        feature = feature.detach()
+        feature = feature.clone() if self.keep_on_device else feature.to("cpu", copy=True)
+        size = feature.numel() * feature.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            entry_key = (self.model_version, key)
+            old = self._entries.pop(entry_key, None)
+            if old is not None:
+                self._bytes -= old.numel() * old.element_size()
+            self._entries[entry_key] = feature
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.numel() * evicted.element_size()
+                self._evictions += 1
+
+    def clear(self):
+        """清空缓存（模型热重载后旧特征失效）"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+            }
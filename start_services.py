@@ -40,7 +40,9 @@ class ServiceManager:
                 'cwd': self.project_root / 'api',
                 'port': 8000,
                 'health_url': 'http://localhost:8000/health',
-                'startup_delay': 5
+                'startup_timeout': 60,  # 等待端口开放（模型在后台加载）
+                'ready_state': 'ready',  # /health返回的state达到该值才算就绪
+                'ready_timeout': 900  # 等待模型加载与预热完成
             },
             'flask_web': {
                 'name': 'Flask Web 前端',
@@ -48,7 +50,7 @@ class ServiceManager:
                 'cwd': self.project_root / 'web',
                 'port': 5000,
                 'health_url': 'http://localhost:5000/api/system/status',
-                'startup_delay': 3
+                'startup_timeout': 30
             }
         }
         
@@ -170,14 +172,14 @@ Python: {sys.version.split()[0]}
             
             self.services[service_id] = process
             
-            # 等待服务启动
-            time.sleep(config['startup_delay'])
-            
-            # 检查进程是否还在运行
-            if process.poll() is not None:
-                stdout, stderr = process.communicate()
-                print(f"{Colors.FAIL}❌ {config['name']} 启动失败{Colors.ENDC}")
-                print(f"错误信息: {stderr}")
+            # 轮询健康检查地址，端口开放即视为启动完成
+            if not self.wait_for_service(service_id, process):
+                if process.poll() is not None:
+                    stdout, stderr = process.communicate()
+                    print(f"{Colors.FAIL}❌ {config['name']} 启动失败{Colors.ENDC}")
+                    print(f"错误信息: {stderr}")
+                else:
+                    print(f"{Colors.FAIL}❌ {config['name']} 在 {config['startup_timeout']} 秒内未响应{Colors.ENDC}")
                 return False
             
             print(f"{Colors.OKGREEN}✅ {config['name']} 启动成功 (PID: {process.pid}){Colors.ENDC}")
@@ -187,6 +189,50 @@ Python: {sys.version.split()[0]}
             print(f"{Colors.FAIL}❌ 启动 {config['name']} 时发生错误: {e}{Colors.ENDC}")
             return False
     
+    def wait_for_service(self, service_id: str, process: subprocess.Popen, interval: float = 0.5) -> bool:
+        """轮询健康检查地址直到服务响应、进程退出或超时"""
+        config = self.service_configs[service_id]
+        deadline = time.time() + config['startup_timeout']
+        while time.time() < deadline:
+            if process.poll() is not None:
+                return False
+            try:
+                requests.get(config['health_url'], timeout=2)
+                return True
+            except requests.exceptions.RequestException:
+                time.sleep(interval)
+        return False
+    
+    def wait_until_ready(self, service_id: str, interval: float = 1.0) -> bool:
+        """轮询/health直到state达到就绪状态，期间打印加载阶段与进度"""
+        config = self.service_configs[service_id]
+        deadline = time.time() + config['ready_timeout']
+        last_phase = None
+        
+        while time.time() < deadline:
+            try:
+                status = requests.get(config['health_url'], timeout=5).json()
+            except (requests.exceptions.RequestException, ValueError):
+                status = {}
+            
+            state = status.get('state')
+            if state == config['ready_state']:
+                timings = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in status.get('timings', {}).items())
+                print(f"{Colors.OKGREEN}✅ {config['name']} 已就绪 ({timings}){Colors.ENDC}")
+                return True
+            if state == 'failed':
+                print(f"{Colors.FAIL}❌ {config['name']} 模型加载失败: {status.get('error')}{Colors.ENDC}")
+                return False
+            
+            phase = (state, status.get('phase'))
+            if state and phase != last_phase:
+                print(f"   {state}: {status.get('phase')} ({status.get('progress', 0):.0%})")
+                last_phase = phase
+            time.sleep(interval)
+        
+        print(f"{Colors.WARNING}⚠️  {config['name']} 在 {config['ready_timeout']} 秒内未就绪{Colors.ENDC}")
+        return False
+    
     def check_service_health(self, service_id: str, max_retries: int = 10) -> bool:
         """检查服务健康状态"""
         config = self.service_configs[service_id]
@@ -197,6 +243,9 @@ Python: {sys.version.split()[0]}
         
         print(f"{Colors.OKBLUE}🔍 检查 {config['name']} 健康状态...{Colors.ENDC}")
         
+        if config.get('ready_state'):
+            return self.wait_until_ready(service_id)
+        
         for attempt in range(max_retries):
             try:
                 response = requests.get(health_url, timeout=5)
@@ -224,9 +273,6 @@ Python: {sys.version.split()[0]}
             if not self.start_service(service_id):
                 print(f"{Colors.FAIL}❌ 启动失败，停止后续服务启动{Colors.ENDC}")
                 return False
-            
-            # 等待一下再启动下一个服务
-            time.sleep(2)
         
         print(f"\n{Colors.OKGREEN}🎉 所有服务启动完成！{Colors.ENDC}")
         return True
@@ -5,7 +5,7 @@
 提供RESTful API和现代化的用户界面
 """
 
-from flask import Flask, render_template, request, jsonify, session, send_file
+from flask import Flask, render_template, request, jsonify, session, send_file, Response, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 import os
@@ -628,6 +628,57 @@ def process_ocr():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/api/ocr/stream', methods=['POST'])
+def stream_ocr():
+    """流式OCR接口：以SSE转发InterVL服务逐段生成的文本（图片或PDF的单页）"""
+    global intervl_client
+    
+    if not intervl_client:
+        return jsonify({
+            'success': False,
+            'error': 'InterVL API客户端未初始化，请先初始化系统',
+            'timestamp': datetime.now().isoformat()
+        }), 500
+    
+    data = request.get_json() or {}
+    file_path = data.get('file_path')
+    if not file_path:
+        return jsonify({
+            'success': False,
+            'error': '文件路径不能为空',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    abs_file_path = Path(file_path) if Path(file_path).is_absolute() else Path(__file__).parent / file_path
+    if not abs_file_path.exists():
+        return jsonify({
+            'success': False,
+            'error': f'文件不存在: {file_path}',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    # PDF文件流式识别单页，page从1开始，默认第1页
+    try:
+        page = int(data.get('page', 1))
+    except (TypeError, ValueError):
+        page = 0
+    if page < 1:
+        return jsonify({
+            'success': False,
+            'error': f"页码无效: {data.get('page')}",
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    def generate():
+        for item in intervl_client.stream_file(str(abs_file_path), data.get('prompt'), page):
+            yield f"event: {item['event']}\ndata: {json.dumps(item['data'], ensure_ascii=False)}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # ==================== RAG问答API ====================
 
 @app.route('/api/chat/query', methods=['POST'])
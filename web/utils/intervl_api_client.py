@@ -11,30 +11,45 @@ import fitz  # PyMuPDF
 import io
 from PIL import Image
 from pathlib import Path
-from typing import Dict, Any, Optional, Union
+from typing import Dict, Any, Iterator, Optional, Union
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 默认OCR提示词
+DEFAULT_OCR_PROMPT = "请详细提取这个文档中的文字内容，包括标题、正文、表格和技术参数。重点关注文档的主要内容和结构。"
+
+# 截止时间请求头（Unix时间戳，秒）：超过后服务端停止推理，客户端放弃等待时不再白白生成
+DEADLINE_HEADER = "X-Request-Deadline"
+DEADLINE_MARGIN = 2.0  # 服务端比客户端提前放弃的秒数，留出返回504的时间
+
 class InterVLAPIClient:
     """InterVL OCR API客户端"""
     
-    def __init__(self, base_url: str = "http://localhost:8000"):
+    def __init__(self, base_url: str = "http://localhost:8000", timeout: float = 300,
+                 document_timeout: float = 3600):
         """
         初始化API客户端
         
         Args:
             base_url: InterVL FastAPI服务的基础URL
+            timeout: 单次请求超时（秒），同时作为服务端的截止时间
+            document_timeout: 整份PDF / 批量处理的截止时间（秒）
         """
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
-        self.session.timeout = 300  # 5分钟超时
+        self.timeout = timeout
+        self.document_timeout = document_timeout
+    
+    def _deadline_headers(self, timeout: float) -> Dict[str, str]:
+        """由超时时间推算发给服务端的截止时间"""
+        return {DEADLINE_HEADER: f"{time.time() + max(timeout - DEADLINE_MARGIN, 0):.3f}"}
         
     def health_check(self) -> Dict[str, Any]:
         """检查API服务健康状态"""
         try:
-            response = self.session.get(f"{self.base_url}/health")
+            response = self.session.get(f"{self.base_url}/health", timeout=self.timeout)
             response.raise_for_status()
             return {
                 'success': True,
@@ -51,7 +66,7 @@ class InterVLAPIClient:
     def get_model_info(self) -> Dict[str, Any]:
         """获取模型信息"""
         try:
-            response = self.session.get(f"{self.base_url}/model/info")
+            response = self.session.get(f"{self.base_url}/model/info", timeout=self.timeout)
             response.raise_for_status()
             return {
                 'success': True,
@@ -68,6 +83,8 @@ class InterVLAPIClient:
         """
         处理PDF文件进行OCR - 支持单页或全文档处理
         
+        PDF直接上传到服务端光栅化，不再在本地渲染并重新编码为JPEG
+        
         Args:
             pdf_path: PDF文件路径
             page_num: 页码（从0开始，-1表示处理所有页面）
@@ -82,16 +99,8 @@ class InterVLAPIClient:
                 return self.process_full_pdf(pdf_path, prompt)
             
             # 否则处理单页
-            # 1. 将PDF转换为图片
-            image = self._pdf_to_image(pdf_path, page_num)
-            if not image:
-                return {
-                    'success': False,
-                    'error': 'PDF转换为图片失败'
-                }
-            
-            # 2. 调用OCR API
-            return self.process_image(image, prompt)
+            with open(pdf_path, 'rb') as f:
+                return self._call_ocr_api(f, prompt, extra_data={'page': page_num + 1})
             
         except Exception as e:
             logger.error(f"PDF处理失败: {e}")
@@ -100,24 +109,88 @@ class InterVLAPIClient:
                 'error': str(e)
             }
     
-    def process_full_pdf(self, pdf_path: Union[str, Path], prompt: str = None) -> Dict[str, Any]:
+    def process_full_pdf(self, pdf_path: Union[str, Path], prompt: str = None,
+                         pages: str = None, skip_blank: bool = None,
+                         dedup_distance: int = None, progressive: bool = False) -> Dict[str, Any]:
         """
         处理完整PDF的所有页面进行OCR
         
+        整个PDF一次上传，服务端逐页光栅化并以NDJSON流式返回每页结果。
+        服务端按感知哈希跳过空白页，近似重复页复用此前页面的结果
+        
         Args:
             pdf_path: PDF文件路径
             prompt: 自定义提示词
+            pages: 页码范围（从1开始），如 "1-3,5"；默认处理全部页面
+            skip_blank: 是否跳过空白页，默认使用服务端配置
+            dedup_distance: 近似重复页的汉明距离阈值，-1表示不去重，默认使用服务端配置
+            progressive: 渐进式识别，服务端先返回低分辨率初稿，之后以同页码的细化结果替换
             
         Returns:
             合并后的OCR处理结果
         """
         try:
-            # 首先获取PDF页数
-            doc = fitz.open(str(pdf_path))
-            total_pages = len(doc)
-            doc.close()
+            logger.info(f"开始处理PDF完整文档: {pdf_path}")
+            
+            page_items = {}  # 页码 -> 该页最新的结果（细化结果替换初稿）
+            total_pages = 0
+            skipped_pages = []
+            reused_pages = {}
+            refined_pages = []
+            start_time = time.time()
             
-            logger.info(f"开始处理PDF完整文档: {pdf_path}, 共 {total_pages} 页")
+            data = {'prompt': prompt or DEFAULT_OCR_PROMPT}
+            if pages:
+                data['pages'] = pages
+            if skip_blank is not None:
+                data['skip_blank'] = 'true' if skip_blank else 'false'
+            if dedup_distance is not None:
+                data['dedup_distance'] = dedup_distance
+            if progressive:
+                data['progressive'] = 'true'
+            
+            with open(pdf_path, 'rb') as f:
+                response = self.session.post(
+                    f"{self.base_url}/ocr/pdf",
+                    files={'file': (Path(pdf_path).name, f, 'application/pdf')},
+                    data=data,
+                    headers=self._deadline_headers(self.document_timeout),
+                    timeout=self.timeout,
+                    stream=True
+                )
+            response.raise_for_status()
+            
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    item = json.loads(line)
+                    
+                    if item.get('type') == 'document':
+                        total_pages = item.get('total_pages', 0)
+                        logger.info(f"PDF共 {total_pages} 页，待处理 {len(item.get('pages', []))} 页")
+                        continue
+                    if item.get('type') == 'summary':
+                        refined_pages = item.get('refined_pages', [])
+                        continue
+                    if item.get('type') != 'page':
+                        continue
+                    
+                    page_no = item.get('page')
+                    if item.get('status') == 'skipped':
+                        skipped_pages.append(page_no)
+                        logger.info(f"第 {page_no} 页为空白页，已跳过")
+                        continue
+                    if item.get('status') != 'success':
+                        logger.warning(f"第 {page_no} 页OCR处理失败: {item.get('error', '未知错误')}")
+                        continue
+                    
+                    stage = (item.get('metadata', {}).get('progressive') or {}).get('stage')
+                    if stage == 'refined' and page_no in page_items:
+                        logger.info(f"第 {page_no} 页细化完成，替换初稿")
+                    else:
+                        logger.info(f"第 {page_no} 页处理完成，提取文本 {len(item.get('raw_text', ''))} 字符")
+                    page_items[page_no] = item
             
             all_text = []
             all_confidence = []
@@ -126,47 +199,32 @@ class InterVLAPIClient:
             all_annotations = []
             all_specifications = []
             total_processing_time = 0
-            
-            # 处理每一页
-            for page_num in range(total_pages):
-                logger.info(f"正在处理第 {page_num + 1}/{total_pages} 页...")
+            for page_no in sorted(page_items):
+                item = page_items[page_no]
                 
-                # 转换当前页为图片
-                image = self._pdf_to_image(pdf_path, page_num)
-                if not image:
-                    logger.warning(f"第 {page_num + 1} 页转换失败，跳过")
+                # 近似重复页只标注来源页，不重复累积文本和结构化内容
+                reused_from = item.get('metadata', {}).get('reused_from')
+                if reused_from:
+                    reused_pages[page_no] = reused_from
+                    all_text.append(f"=== 第 {page_no} 页 ===\n（与第 {reused_from} 页内容相同）")
                     continue
                 
-                # 处理当前页
-                page_result = self.process_image(image, prompt)
+                # 累积结果
+                page_text = item.get('raw_text', '')
+                if page_text.strip():
+                    all_text.append(f"=== 第 {page_no} 页 ===\n{page_text}")
                 
-                if page_result.get('success'):
-                    # 累积结果
-                    page_text = page_result.get('raw_text', '')
-                    if page_text.strip():
-                        all_text.append(f"=== 第 {page_num + 1} 页 ===\n{page_text}")
-                    
-                    # 累积其他信息
-                    if page_result.get('confidence'):
-                        all_confidence.append(page_result['confidence'])
-                    
-                    if page_result.get('tables'):
-                        all_tables.extend(page_result['tables'])
-                    
-                    if page_result.get('processes'):
-                        all_processes.extend(page_result['processes'])
-                    
-                    if page_result.get('annotations'):
-                        all_annotations.extend(page_result['annotations'])
-                    
-                    if page_result.get('specifications'):
-                        all_specifications.extend(page_result['specifications'])
-                    
-                    total_processing_time += page_result.get('processing_time', 0)
-                    
-                    logger.info(f"第 {page_num + 1} 页处理完成，提取文本 {len(page_text)} 字符")
-                else:
-                    logger.warning(f"第 {page_num + 1} 页OCR处理失败: {page_result.get('error', '未知错误')}")
+                # 累积其他信息
+                if item.get('confidence'):
+                    all_confidence.append(item['confidence'])
+                
+                structured = item.get('structured_content', {})
+                all_tables.extend(structured.get('tables', []))
+                all_processes.extend(structured.get('diagrams', []))
+                all_annotations.extend(structured.get('annotations', []))
+                all_specifications.extend(structured.get('specifications', []))
+                
+                total_processing_time += item.get('metadata', {}).get('processing_time', 0)
             
             # 合并所有结果
             combined_text = '\n\n'.join(all_text)
@@ -181,11 +239,15 @@ class InterVLAPIClient:
                 'annotations': all_annotations,
                 'specifications': all_specifications,
                 'processing_time': total_processing_time,
+                'api_processing_time': time.time() - start_time,
                 'total_pages': total_pages,
                 'processed_pages': len(all_text),
                 'metadata': {
                     'pages_processed': len(all_text),
                     'total_pages': total_pages,
+                    'skipped_pages': skipped_pages,
+                    'reused_pages': reused_pages,
+                    'refined_pages': refined_pages,
                     'avg_confidence': avg_confidence,
                     'total_chars': len(combined_text)
                 }
@@ -256,49 +318,124 @@ class InterVLAPIClient:
                 'error': str(e)
             }
     
-    def process_batch_files(self, file_paths: list, prompt: str = None) -> Dict[str, Any]:
+    def stream_file(self, file_path: Union[str, Path], prompt: str = None,
+                    page: int = 1) -> Iterator[Dict[str, Any]]:
         """
-        批量处理文件
+        流式处理图片或PDF文件，逐个产出服务端推送的SSE事件
         
         Args:
-            file_paths: 文件路径列表
+            file_path: 图片或PDF文件路径
             prompt: 自定义提示词
+            page: PDF文件的页码（从1开始），图片文件忽略
             
-        Returns:
-            批量处理结果
+        Yields:
+            {'event': 事件类型, 'data': 事件数据}，事件类型为
+            phase（阶段计时）、token（文本片段）、result（完整结果）或error
         """
+        data = {"prompt": prompt or DEFAULT_OCR_PROMPT}
+        if Path(file_path).suffix.lower() == '.pdf':
+            data["page"] = page
         try:
-            files_data = []
-            for file_path in file_paths:
-                path = Path(file_path)
-                if path.suffix.lower() == '.pdf':
-                    # PDF文件需要先转换
-                    image = self._pdf_to_image(file_path, 0)
-                    if image:
-                        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                            image.save(temp_file.name, 'JPEG', quality=95)
-                            with open(temp_file.name, 'rb') as f:
-                                files_data.append(('files', f.read()))
-                            Path(temp_file.name).unlink(missing_ok=True)
-                else:
-                    # 图片文件直接读取
-                    with open(file_path, 'rb') as f:
-                        files_data.append(('files', f.read()))
-            
-            data = {}
-            if prompt:
-                data['prompt'] = prompt
+            with open(file_path, 'rb') as f:
+                response = self.session.post(
+                    f"{self.base_url}/ocr/stream",
+                    files={"file": f},
+                    data=data,
+                    headers=self._deadline_headers(self.timeout),
+                    timeout=self.timeout,
+                    stream=True
+                )
+            response.raise_for_status()
+            
+            with response:
+                yield from self._iter_sse(response)
                 
+        except requests.exceptions.RequestException as e:
+            logger.error(f"流式API调用失败: {e}")
+            yield {'event': 'error', 'data': {'error': f'API调用失败: {str(e)}'}}
+        except Exception as e:
+            logger.error(f"流式OCR处理失败: {e}")
+            yield {'event': 'error', 'data': {'error': str(e)}}
+    
+    def _iter_sse(self, response) -> Iterator[Dict[str, Any]]:
+        """解析SSE响应流"""
+        event, data_lines = 'message', []
+        for line in response.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == '':
+                if data_lines:
+                    yield {'event': event, 'data': json.loads('\n'.join(data_lines))}
+                event, data_lines = 'message', []
+            elif line.startswith('event:'):
+                event = line[len('event:'):].strip()
+            elif line.startswith('data:'):
+                data_lines.append(line[len('data:'):].strip())
+    
+    def iter_batch_files(self, file_paths: list, prompt: str = None) -> Iterator[Dict[str, Any]]:
+        """
+        批量处理文件，逐项返回服务端的NDJSON结果
+        
+        图片和PDF均直接上传，PDF由服务端逐页处理；结果按完成顺序到达，
+        每项的index为其在file_paths中的序号，PDF的每页单独一项并带page字段
+        
+        Args:
+            file_paths: 文件路径列表
+            prompt: 自定义提示词
+            
+        Yields:
+            {"type": "batch" | "item" | "summary", ...}
+        """
+        opened = [open(file_path, 'rb') for file_path in file_paths]
+        try:
+            files_data = [('files', (Path(file_path).name, f)) for file_path, f in zip(file_paths, opened)]
             response = self.session.post(
-                f"{self.base_url}/ocr/batch", 
+                f"{self.base_url}/ocr/batch",
                 files=files_data,
-                data=data
+                data={'prompt': prompt or DEFAULT_OCR_PROMPT},
+                headers=self._deadline_headers(self.document_timeout),
+                timeout=self.timeout,
+                stream=True
             )
-            response.raise_for_status()
+        finally:
+            for f in opened:
+                f.close()
+        response.raise_for_status()
+        
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+    
+    def process_batch_files(self, file_paths: list, prompt: str = None) -> Dict[str, Any]:
+        """
+        批量处理文件
+        
+        Args:
+            file_paths: 文件路径列表
+            prompt: 自定义提示词
             
+        Returns:
+            批量处理结果，results按原始顺序（PDF按页码）排列
+        """
+        try:
+            items = []
+            summary = {}
+            for item in self.iter_batch_files(file_paths, prompt):
+                if item.get('type') == 'item':
+                    items.append(item)
+                elif item.get('type') == 'summary':
+                    summary = item
+            
+            items.sort(key=lambda item: (item['index'], item.get('page', 0)))
             return {
                 'success': True,
-                'results': response.json()
+                'results': {
+                    'status': 'completed',
+                    'total_files': len(file_paths),
+                    'results': items,
+                    'summary': summary
+                }
             }
             
         except Exception as e:
@@ -334,23 +471,26 @@ class InterVLAPIClient:
             logger.error(f"PDF转换失败: {e}")
             return None
     
-    def _call_ocr_api(self, file_obj, prompt: str = None) -> Dict[str, Any]:
+    def _call_ocr_api(self, file_obj, prompt: str = None,
+                      extra_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """调用OCR API"""
         try:
             start_time = time.time()
             
             files = {"file": file_obj}
-            data = {}
+            data = dict(extra_data or {})
             
             if prompt:
                 data["prompt"] = prompt
             else:
-                data["prompt"] = "请详细提取这个文档中的文字内容，包括标题、正文、表格和技术参数。重点关注文档的主要内容和结构。"
+                data["prompt"] = DEFAULT_OCR_PROMPT
             
             response = self.session.post(
                 f"{self.base_url}/ocr/process",
                 files=files,
-                data=data
+                data=data,
+                headers=self._deadline_headers(self.timeout),
+                timeout=self.timeout
             )
             
             processing_time = time.time() - start_time